@@ -0,0 +1,180 @@
+"""Verify many supplicants in one run, for auditing active sessions."""
+import collections
+import json
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.verifier import Verifier
+
+
+class BatchVerifier:
+    """Run pkix_cd_verify's checks over a stream of JSON records.
+
+    Each input line is a JSON object with ``called`` (Called-Station-Id),
+    ``calling`` (User-Name), and either ``certfile`` (path to the PEM
+    certificate) or ``cert_pem``. An optional ``id`` is copied to the
+    result. Each output line is a JSON object with ``line``, ``called``,
+    ``calling``, ``code`` and ``messages``, where ``code`` is what
+    pkix_cd_verify would exit with for that record. Results are written
+    in input order, as soon as they're ready.
+
+    Every record is checked by the same Verifier, so the trust map is
+    loaded once. The most recently used ``cache_size`` certificate files
+    are read and hashed once, identical records among the most recent
+    ``cache_size`` are verified once, and records are verified
+    concurrently, so DNS-bound checks overlap. Give the Verifier a
+    registry cache and a live verify cache to also share DNS lookups
+    between records.
+    """
+
+    # Results waiting to be written, per worker, before reading more input.
+    window = 4
+
+    def __init__(self, verifier, live_verify=False, require_registry=False,
+                 ns_override=None, concurrency=8, cache_size=10000):
+        """Initialize with the Verifier and the checks to run.
+
+        Args:
+            verifier (Verifier): Verifier holding the trust map and caches.
+            live_verify (bool): Verify directly against DNS, in addition
+                to cached information.
+            require_registry (bool): Require IoT Registry revocation checks.
+            ns_override (str): Override system name server.
+            concurrency (int): Maximum number of records to verify at the
+                same time.
+            cache_size (int): Maximum number of certificates, and of
+                verdicts, to keep for reuse by later records.
+        """
+        self.verifier = verifier
+        self.live_verify = live_verify
+        self.require_registry = require_registry
+        self.ns_override = ns_override
+        self.concurrency = max(1, concurrency)
+        self.cache_size = max(1, cache_size)
+        self.certificates = {}
+        self.verdicts = {}
+
+    def run(self, lines, output):
+        """Verify the record on each of ``lines``, writing results to ``output``.
+
+        Args:
+            lines (iterable): Lines of JSON, one record per line. Blank
+                lines are skipped.
+            output (file): Text file for the results, one JSON object per line.
+
+        Return:
+            collections.Counter: Number of records for each exit code.
+        """
+        counts = collections.Counter()
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for line_number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                record, verdict = self.submit(executor, line)
+                pending.append((line_number, record, verdict))
+                while len(pending) > self.concurrency * self.window:
+                    counts[self.write_result(output, *pending.popleft())] += 1
+            while pending:
+                counts[self.write_result(output, *pending.popleft())] += 1
+        return counts
+
+    def submit(self, executor, line):
+        """Start verifying the record on ``line``.
+
+        Return:
+            dict: The record, or an empty dict if it can't be parsed.
+            Future: Resolves to the exit code and messages.
+        """
+        record = {}
+        try:
+            parsed = json.loads(line)
+            if not isinstance(parsed, dict):
+                raise ValueError("Expected a JSON object, got {}".format(type(parsed).__name__))
+            record = parsed
+            called, calling = str(record["called"]), str(record["calling"])
+            certificate = self.get_certificate(record)
+        except (ValueError, KeyError, OSError) as err:
+            return record, self.get_done(Verifier.EXIT_MISSING_TRUST_MAP, ["Unusable record: {}".format(err)])
+        if certificate is None:
+            message = "Certificate file not found: {}!".format(record["certfile"])
+            return record, self.get_done(Verifier.EXIT_MISSING_CERTIFICATE, [message])
+        try:
+            key = (called, calling, certificate.sha256)
+        except ValueError as err:
+            return record, self.get_done(Verifier.EXIT_MISSING_TRUST_MAP,
+                                         ["Unreadable certificate: {}".format(err)])
+        verdict = self.recall(self.verdicts, key)
+        if verdict is None:
+            verdict = self.remember(self.verdicts, key, executor.submit(self.verify, called, calling, certificate))
+        return record, verdict
+
+    def get_certificate(self, record):
+        """Return the record's certificate, or None if its file is missing.
+
+        Raise:
+            KeyError if the record has neither ``certfile`` nor ``cert_pem``.
+            ValueError if it isn't a string.
+        """
+        if "cert_pem" in record:
+            source = record["cert_pem"]
+        else:
+            source = record["certfile"]
+        if not isinstance(source, str):
+            raise ValueError("Certificate must be a string.")
+        if source in self.certificates:
+            return self.recall(self.certificates, source)
+        certificate = None
+        if "cert_pem" in record:
+            certificate = CertificateContext(source)
+        else:
+            try:
+                with open(source) as f_on_disk:
+                    certificate = CertificateContext(f_on_disk.read())
+            except FileNotFoundError:
+                pass
+        return self.remember(self.certificates, source, certificate)
+
+    def recall(self, cache, key):
+        """Return the value cached for ``key``, marking it recently used, or None."""
+        if key not in cache:
+            return None
+        # Dicts keep insertion order, so the least recently used entry is first.
+        cache[key] = cache.pop(key)
+        return cache[key]
+
+    def remember(self, cache, key, value):
+        """Cache ``value`` for ``key``, evicting the least recently used entries, and return it."""
+        while len(cache) >= self.cache_size:
+            del cache[next(iter(cache))]
+        cache[key] = value
+        return value
+
+    def verify(self, called, calling, certificate):
+        """Return the exit code and messages for one supplicant."""
+        try:
+            return self.verifier.verify(called, calling, certificate, self.live_verify,
+                                        self.require_registry, self.ns_override)
+        except Exception as err:
+            # An unhandled exception in pkix_cd_verify exits with 1.
+            return Verifier.EXIT_MISSING_TRUST_MAP, ["Verify error: {}".format(err)]
+
+    @classmethod
+    def get_done(cls, code, messages):
+        """Return a Future which already holds ``code`` and ``messages``."""
+        verdict = Future()
+        verdict.set_result((code, messages))
+        return verdict
+
+    @classmethod
+    def write_result(cls, output, line_number, record, verdict):
+        """Wait for ``verdict`` and write it to ``output``, returning its code."""
+        code, messages = verdict.result()
+        result = {"line": line_number, "called": record.get("called"),
+                  "calling": record.get("calling"), "code": code, "messages": messages}
+        if "id" in record:
+            result["id"] = record["id"]
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+        return code
@@ -0,0 +1,170 @@
+"""OpenSSL hashed CA certificate directory, as made by c_rehash."""
+import hashlib
+import os
+import re
+
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.utility import Utility
+
+
+class CADirectory:
+    """Maintain a directory of CA certificates named by subject hash.
+
+    OpenSSL's ``ca_path`` lookup finds an issuer by opening
+    ``HASH.0``, ``HASH.1``, ... in turn, where HASH is the issuer's
+    subject name hash, and stops at the first missing file. This class
+    keeps such a directory in sync with a set of CA certificates.
+    Certificates are deduplicated by SHA-256 fingerprint, files for
+    unchanged certificates are left alone, and each hash's files are
+    kept numbered without gaps.
+
+    The subject hash is computed in Python, the same way as OpenSSL's
+    ``X509_NAME_hash`` (``openssl x509 -hash``).
+    """
+
+    file_name_pattern = re.compile(r"([0-9a-f]{8})\.([0-9]+)")
+
+    # DER tags for the string types OpenSSL canonicalizes, and their codecs.
+    canonical_string_codecs = {0x0c: "utf-8",        # UTF8String
+                               0x13: "latin-1",      # PrintableString
+                               0x14: "latin-1",      # T61String
+                               0x16: "latin-1",      # IA5String
+                               0x1a: "latin-1",      # VisibleString
+                               0x1c: "utf-32-be",    # UniversalString
+                               0x1e: "utf-16-be"}    # BMPString
+    canonical_whitespace = " \t\n\v\f\r"
+
+    def __init__(self, path):
+        """Initialize with the directory path, creating it if needed."""
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    @classmethod
+    def get_subject_hash(cls, certificate):
+        """Return the OpenSSL subject name hash, as 8 hex digits.
+
+        Args:
+            certificate: Certificate in PEM or DER format, or a
+                CertificateContext.
+        """
+        subject_der = CertificateContext.wrap(certificate).x509.subject.public_bytes()
+        digest = hashlib.sha1(cls.get_canonical_name(subject_der)).digest()
+        return "{:08x}".format(int.from_bytes(digest[:4], "little"))
+
+    @classmethod
+    def get_canonical_name(cls, name_der):
+        """Return OpenSSL's canonical encoding of a DER-encoded Name.
+
+        That's the DER of each RDN, concatenated without the enclosing
+        SEQUENCE, with string values converted to lowercased UTF8String
+        with whitespace trimmed and collapsed.
+        """
+        _, rdns, _ = CertificateContext.read_tlv(name_der, 0)
+        canonical = b""
+        offset = 0
+        while offset < len(rdns):
+            _, rdn, offset = CertificateContext.read_tlv(rdns, offset)
+            attributes = []
+            attr_offset = 0
+            while attr_offset < len(rdn):
+                _, attribute, attr_offset = CertificateContext.read_tlv(rdn, attr_offset)
+                oid_tag, oid, value_offset = CertificateContext.read_tlv(attribute, 0)
+                value_tag, value, _ = CertificateContext.read_tlv(attribute, value_offset)
+                attributes.append(cls.encode_tlv(0x30, cls.encode_tlv(oid_tag, oid)
+                                                 + cls.get_canonical_value(value_tag, value)))
+            # DER orders the members of a SET OF by their encoding.
+            canonical += cls.encode_tlv(0x31, b"".join(sorted(attributes)))
+        return canonical
+
+    @classmethod
+    def get_canonical_value(cls, tag, value):
+        """Return the canonical encoding of an attribute value."""
+        codec = cls.canonical_string_codecs.get(tag)
+        if codec is None:
+            return cls.encode_tlv(tag, value)
+        text = value.decode(codec, errors="replace").strip(cls.canonical_whitespace)
+        canonical = []
+        for char in text:
+            if char in cls.canonical_whitespace:
+                if not canonical or canonical[-1] != " ":
+                    canonical.append(" ")
+            elif char.isascii():
+                canonical.append(char.lower())
+            else:
+                canonical.append(char)
+        return cls.encode_tlv(0x0c, "".join(canonical).encode("utf-8"))
+
+    @classmethod
+    def encode_tlv(cls, tag, value):
+        """Return the DER encoding of ``value`` with ``tag``."""
+        length = len(value)
+        if length < 0x80:
+            return bytes([tag, length]) + value
+        length_bytes = length.to_bytes((length.bit_length() + 7) // 8, "big")
+        return bytes([tag, 0x80 | len(length_bytes)]) + length_bytes + value
+
+    def read_existing(self):
+        """Return {subject_hash: [(index, fingerprint), ...]} for files on disk.
+
+        Lists are sorted by index. Unparseable files count as stale.
+        """
+        existing = {}
+        for file_name in os.listdir(self.path):
+            match = self.file_name_pattern.fullmatch(file_name)
+            if not match:
+                continue
+            try:
+                with open(os.path.join(self.path, file_name), "rb") as cert_file:
+                    fingerprint = CertificateContext(cert_file.read()).sha256
+            except ValueError:
+                fingerprint = None
+            existing.setdefault(match.group(1), []).append((int(match.group(2)), fingerprint))
+        return {k: sorted(v) for k, v in existing.items()}
+
+    def get_file_path(self, subject_hash, index):
+        """Return the path for the ``index``th certificate with ``subject_hash``."""
+        return os.path.join(self.path, "{}.{}".format(subject_hash, index))
+
+    def sync(self, pem_certs):
+        """Make the directory hold exactly ``pem_certs``.
+
+        Args:
+            pem_certs (list): PEM-encoded CA certificates.
+
+        Return:
+            int: Number of certificates added.
+            int: Number of certificates removed.
+        """
+        wanted = {}
+        for pem in pem_certs:
+            certificate = CertificateContext(pem)
+            wanted.setdefault(self.get_subject_hash(certificate), {})[certificate.sha256] = certificate
+        existing = self.read_existing()
+        added = removed = 0
+        for subject_hash in sorted(set(wanted) | set(existing)):
+            certificates = wanted.get(subject_hash, {})
+            kept = []
+            for index, fingerprint in existing.get(subject_hash, []):
+                if fingerprint in certificates and fingerprint not in [x for _, x in kept]:
+                    kept.append((index, fingerprint))
+                else:
+                    removed += 1
+            kept_fingerprints = [x for _, x in kept]
+            # Every file is replaced by renaming a complete one over it, and stale files are
+            # only removed afterwards, so OpenSSL never finds a wanted certificate missing.
+            # Kept certificates move down to close gaps, since OpenSSL stops at the first one.
+            for new_index, (index, fingerprint) in enumerate(kept):
+                if new_index != index:
+                    Utility.write_file_atomically(self.get_file_path(subject_hash, new_index),
+                                                  certificates[fingerprint].pem)
+            new_index = len(kept)
+            for fingerprint, certificate in certificates.items():
+                if fingerprint in kept_fingerprints:
+                    continue
+                Utility.write_file_atomically(self.get_file_path(subject_hash, new_index), certificate.pem)
+                new_index += 1
+                added += 1
+            for index, _ in existing.get(subject_hash, []):
+                if index >= new_index:
+                    os.unlink(self.get_file_path(subject_hash, index))
+        return added, removed
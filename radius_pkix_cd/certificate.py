@@ -0,0 +1,222 @@
+"""Parse-once certificate context."""
+import base64
+import binascii
+import hashlib
+
+
+class CertificateContext:
+    """Decode a certificate once, and memoize what we derive from it.
+
+    The verify pipeline needs the same certificate's DER, hashes,
+    subject and authorityKeyIdentifier in several places. Each of the
+    ``dane_discovery`` helpers re-parses the certificate it's given, so
+    the stages share one of these instead.
+
+    The DER, SHA-256 and subject commonName are read directly from the
+    encoding. Only the other properties need ``cryptography`` and
+    ``dane_discovery``, which are imported on first use, so the common
+    cache-only authorization doesn't pay to import them.
+    """
+
+    pem_header = "-----BEGIN CERTIFICATE-----"
+    pem_footer = "-----END CERTIFICATE-----"
+    common_name_oid = bytes([0x55, 0x04, 0x03])
+
+    # DER tags for the DirectoryString types, and their codecs. As in
+    # OpenSSL, T61String is read as Latin-1.
+    string_codecs = {0x0c: "utf-8",        # UTF8String
+                     0x13: "ascii",        # PrintableString
+                     0x14: "latin-1",      # T61String
+                     0x16: "ascii",        # IA5String
+                     0x1a: "ascii",        # VisibleString
+                     0x1c: "utf-32-be",    # UniversalString
+                     0x1e: "utf-16-be"}    # BMPString
+
+    def __init__(self, certificate):
+        """Initialize with a certificate.
+
+        Args:
+            certificate (str): Certificate in PEM or DER format.
+        """
+        self.certificate = certificate
+        self.memo = {}
+
+    @classmethod
+    def wrap(cls, certificate):
+        """Return ``certificate`` as a CertificateContext.
+
+        Args:
+            certificate: Certificate in PEM or DER format, or a
+                CertificateContext, which is returned as-is.
+        """
+        if isinstance(certificate, cls):
+            return certificate
+        return cls(certificate)
+
+    def memoize(self, name, compute):
+        """Return the memoized value for ``name``, computing it on first use."""
+        if name not in self.memo:
+            self.memo[name] = compute()
+        return self.memo[name]
+
+    @classmethod
+    def read_tlv(cls, data, offset):
+        """Return the tag, value and next offset of the DER TLV at ``offset``.
+
+        Raise:
+            ValueError if the DER is truncated.
+        """
+        if offset + 2 > len(data):
+            raise ValueError("Truncated DER.")
+        tag = data[offset]
+        length = data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            num_bytes = length & 0x7f
+            length = int.from_bytes(data[offset:offset + num_bytes], "big")
+            offset += num_bytes
+        if offset + length > len(data):
+            raise ValueError("Truncated DER.")
+        return tag, data[offset:offset + length], offset + length
+
+    @property
+    def x509(self):
+        """Return the cryptography.x509.Certificate object."""
+        from dane_discovery.pki import PKI
+        return self.memoize("x509", lambda: PKI.build_x509_object(self.certificate))
+
+    @property
+    def der(self):
+        """Return the DER-encoded certificate.
+
+        Raise:
+            ValueError if the certificate isn't PEM or DER.
+        """
+        def compute():
+            certificate = self.certificate
+            if isinstance(certificate, bytes) and not certificate.lstrip().startswith(b"-----"):
+                return certificate
+            if isinstance(certificate, bytes):
+                certificate = certificate.decode("ascii")
+            _, found, body = certificate.partition(self.pem_header)
+            body, footer, _ = body.partition(self.pem_footer)
+            if not (found and footer):
+                raise ValueError("Certificate is not in PEM format.")
+            return base64.b64decode("".join(body.split()), validate=True)
+        return self.memoize("der", compute)
+
+    @property
+    def pem(self):
+        """Return the PEM-encoded certificate, as bytes."""
+        from dane_discovery.pki import PKI
+        return self.memoize("pem", lambda: PKI.serialize_cert(self.x509, "PEM"))
+
+    def get_sha256(self, selector=0):
+        """Return the hex SHA-256 for the selector, as in DANE.generate_sha_by_selector.
+
+        Args:
+            selector (int): ``0`` for the entire certificate, ``1`` for
+                the public key only.
+        """
+        if selector not in [0, 1]:
+            raise ValueError("Invalid selector.")
+
+        def compute():
+            if selector == 0:
+                hashable = self.der
+            else:
+                from dane_discovery.pki import PKI
+                hashable = PKI.serialize_cert(self.x509, "RPK_DER")
+            return hashlib.sha256(hashable).hexdigest()
+        return self.memoize("sha256_{}".format(selector), compute)
+
+    @property
+    def sha256(self):
+        """Return the hex SHA-256 of the entire certificate (selector 0)."""
+        return self.get_sha256(0)
+
+    @property
+    def meta(self):
+        """Return certificate metadata, as in PKI.get_cert_meta."""
+        from dane_discovery.pki import PKI
+
+        def compute():
+            retval = {"subject": {}, "extensions": {}}
+            for item in self.x509.subject:
+                retval["subject"][item.oid._name] = item.value
+            for extension in self.x509.extensions:
+                xtn = PKI.parse_extension(extension)
+                xtn_name = [x for x in xtn.keys()][0]
+                retval["extensions"][xtn_name] = xtn[xtn_name]
+            return retval
+        return self.memoize("meta", compute)
+
+    @property
+    def common_name(self):
+        """Return the subject commonName, read from the DER.
+
+        Raise:
+            KeyError if the subject has no commonName.
+            ValueError if the certificate, or any subject attribute, can't
+                be decoded.
+        """
+        def compute():
+            common_name = None
+            for oid, value in self.get_subject_attributes():
+                if oid == self.common_name_oid:
+                    common_name = value
+            if common_name is None:
+                raise KeyError("commonName")
+            return common_name
+        return self.memoize("common_name", compute)
+
+    def get_subject_attributes(self):
+        """Return (OID, value) for each subject attribute, read from the DER.
+
+        OIDs are DER-encoded, and values are decoded strings.
+
+        Raise:
+            ValueError if the DER is truncated, or a value isn't a string
+                type, or isn't valid for its type.
+        """
+        _, certificate, _ = self.read_tlv(self.der, 0)
+        _, tbs, _ = self.read_tlv(certificate, 0)
+        offset = 0
+        # Skip the optional [0] version, serialNumber, signature, issuer and validity.
+        fields = []
+        while len(fields) < 5 and offset < len(tbs):
+            tag, value, offset = self.read_tlv(tbs, offset)
+            if tag != 0xa0:
+                fields.append(value)
+        if len(fields) < 5:
+            raise ValueError("Truncated DER.")
+        subject = fields[4]
+        attributes = []
+        rdn_offset = 0
+        while rdn_offset < len(subject):
+            _, rdn, rdn_offset = self.read_tlv(subject, rdn_offset)
+            attr_offset = 0
+            while attr_offset < len(rdn):
+                _, attribute, attr_offset = self.read_tlv(rdn, attr_offset)
+                _, oid, value_offset = self.read_tlv(attribute, 0)
+                value_tag, value, _ = self.read_tlv(attribute, value_offset)
+                codec = self.string_codecs.get(value_tag)
+                if codec is None:
+                    raise ValueError("Subject attribute has unsupported type 0x{:02x}.".format(value_tag))
+                try:
+                    attributes.append((oid, value.decode(codec)))
+                except UnicodeDecodeError as err:
+                    raise ValueError("Subject attribute can't be decoded: {}".format(err))
+        return attributes
+
+    @property
+    def aki(self):
+        """Return the authorityKeyIdentifier, as in PKI.get_authority_key_id_from_certificate."""
+        from cryptography import x509
+        from dane_discovery.pki import PKI
+
+        def compute():
+            akid = self.x509.extensions.get_extension_for_class(
+                x509.AuthorityKeyIdentifier).value.key_identifier
+            return PKI.format_keyid(binascii.hexlify(akid).decode())
+        return self.memoize("aki", compute)
@@ -0,0 +1,116 @@
+"""Command-line arguments shared by the verify entry points.
+
+pkix_cd_verify and pkix_cd_verify_client must accept exactly the same
+arguments, pkix_cd_verify_batch the same ones less the supplicant's, and
+pkix_cd_verify_daemon those less the trust map's as well, so they're
+defined once, here. This module only depends on
+the standard library, so the thin client stays cheap to start.
+"""
+
+
+def add_verify_arguments(parser):
+    """Add the pkix_cd_verify arguments to ``parser``."""
+    parser.add_argument("--called", dest="called", required=True,
+                        help="Called-Station-Id.")
+    parser.add_argument("--calling", dest="calling", required=True,
+                        help="Callling-Station-Id.")
+    parser.add_argument("--certfile", dest="certfile", required=True,
+                        help="Certificate file presented by supplicant.")
+    add_verifier_arguments(parser)
+
+
+def add_verifier_arguments(parser):
+    """Add the pkix_cd_verify arguments that aren't about one supplicant to ``parser``."""
+    parser.add_argument("--trustmap", dest="trustmap", required=True,
+                        help="Trust map, provided by pkix_cd_manage_trust.")
+    add_policy_arguments(parser)
+
+
+def add_policy_arguments(parser):
+    """Add the pkix_cd_verify arguments that aren't about one supplicant or trust map to ``parser``."""
+    parser.add_argument("--live-verify", dest="live_verify", required=False, action="store_true",
+                        help="Verify directly against DNS, in addition to cached information.")
+    parser.add_argument("--require-registry", dest="require_registry", required=False, action="store_true",
+                        help="Set this to require IoT Registry revocation checks for all clients.")
+    parser.add_argument("--ns_override", dest="ns_override", required=False, help="Override system name server.")
+    parser.add_argument("--registry-cache", dest="registry_cache", required=False,
+                        help="Cache IoT Registry revocation status in this file, shared between processes.")
+    parser.add_argument("--registry-cache-max-age", dest="registry_cache_max_age", required=False, type=int,
+                        help="Maximum seconds to trust a cached IoT Registry status.")
+    parser.add_argument("--registry-cache-negative-ttl", dest="registry_cache_negative_ttl", required=False,
+                        type=int, help="Maximum seconds to cache an IoT Registry revocation.")
+    parser.add_argument("--registry-domains", dest="registry_domains", required=False,
+                        help="File listing the IoT Registry domains, one per line, in place of the built-in list.")
+    parser.add_argument("--live-verify-cache", dest="live_cache", required=False,
+                        help="Cache live verify results in this file, shared between processes.")
+    parser.add_argument("--live-verify-cache-max-age", dest="live_cache_max_age", required=False, type=int,
+                        help="Maximum seconds to trust a cached live verify result.")
+    parser.add_argument("--live-verify-cache-negative-ttl", dest="live_cache_negative_ttl", required=False,
+                        type=int, help="Maximum seconds to cache a failed live verify.")
+    parser.add_argument("--live-verify-cache-size", dest="live_cache_size", required=False, type=int,
+                        help="Maximum number of cached live verify results.")
+    parser.add_argument("--live-verify-cache-stale", dest="live_cache_stale", required=False, type=int,
+                        help="Seconds to keep using an expired live verify result while it is refreshed.")
+    parser.add_argument("--dns-pool", dest="dns_pool", required=False, choices=["tcp", "tls"],
+                        help=("Keep TCP or DNS-over-TLS connections to the name server open between lookups, "
+                              "and cache responses for their TTL. Pays off in long-running verifiers."))
+    parser.add_argument("--deadline-ms", dest="deadline_ms", required=False, type=int,
+                        help="Latency budget per authorization. Live verify and IoT Registry checks still "
+                             "running when it expires are handled by --deadline-policy.")
+    parser.add_argument("--deadline-policy", dest="deadline_policy", required=False,
+                        choices=["fail-closed", "last-known-good"],
+                        help="Fail a check which runs past the deadline, or use its last cached result.")
+    parser.add_argument("--deadline-fallback-max-age", dest="deadline_fallback_max_age", required=False,
+                        type=int, help="Maximum age in seconds of a cached result used by last-known-good.")
+    parser.add_argument("--parallel-stages", dest="parallel_stages", required=False, action="store_true",
+                        help="With --deadline-ms, run live verify and the IoT Registry check at the same time.")
+    parser.add_argument("--metrics-log", dest="metrics_log", required=False,
+                        help="Append a JSON line of timings and counters per authorization here. Use - for stderr.")
+    parser.add_argument("--metrics-statsd", dest="metrics_statsd", required=False,
+                        help="Send timings and counters to this statsd server, as host:port.")
+    parser.set_defaults(live_verify=False)
+    parser.set_defaults(require_registry=False)
+    parser.set_defaults(ns_override=None)
+    parser.set_defaults(registry_cache=None)
+    parser.set_defaults(registry_cache_max_age=3600)
+    parser.set_defaults(registry_cache_negative_ttl=60)
+    parser.set_defaults(registry_domains=None)
+    parser.set_defaults(live_cache=None)
+    parser.set_defaults(live_cache_max_age=3600)
+    parser.set_defaults(live_cache_negative_ttl=60)
+    parser.set_defaults(live_cache_size=10000)
+    parser.set_defaults(live_cache_stale=0)
+    parser.set_defaults(dns_pool=None)
+    parser.set_defaults(deadline_ms=None)
+    parser.set_defaults(deadline_policy="fail-closed")
+    parser.set_defaults(deadline_fallback_max_age=86400)
+    parser.set_defaults(parallel_stages=False)
+    parser.set_defaults(metrics_log=None)
+    parser.set_defaults(metrics_statsd=None)
+
+
+def get_verifier_options(args):
+    """Return keyword arguments for Verifier, from parsed arguments."""
+    return {"registry_cache": args.registry_cache,
+            "registry_cache_max_age": args.registry_cache_max_age,
+            "registry_cache_negative_ttl": args.registry_cache_negative_ttl,
+            "registry_domains": args.registry_domains,
+            "live_cache": args.live_cache,
+            "live_cache_max_age": args.live_cache_max_age,
+            "live_cache_negative_ttl": args.live_cache_negative_ttl,
+            "live_cache_size": args.live_cache_size,
+            "live_cache_stale": args.live_cache_stale,
+            "dns_pool": args.dns_pool,
+            "deadline_ms": args.deadline_ms,
+            "deadline_policy": args.deadline_policy,
+            "deadline_fallback_max_age": args.deadline_fallback_max_age,
+            "parallel_stages": args.parallel_stages,
+            "metrics_log": args.metrics_log,
+            "metrics_statsd": args.metrics_statsd}
+
+
+def get_checks(args):
+    """Return keyword arguments for Verifier.verify, other than the supplicant's."""
+    return {"live_verify": args.live_verify,
+            "require_registry": args.require_registry,
+            "ns_override": args.ns_override}
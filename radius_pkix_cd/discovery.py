@@ -0,0 +1,128 @@
+"""Discover PKIX-CD trust information for identities in DNS."""
+from concurrent.futures import ThreadPoolExecutor
+
+from dane_discovery.exceptions import TLSAError
+from dane_discovery.identity import Identity
+
+from radius_pkix_cd import metrics
+from radius_pkix_cd.certificate import CertificateContext
+
+
+class Discovery:
+    """Discover the certificates and trust chains for identities."""
+
+    @classmethod
+    def discover_identity(cls, dnsname, ns_override=None):
+        """Return the trust information published for one identity.
+
+        Args:
+            dnsname (str): DNS name of identity.
+            ns_override (str): Override system name server.
+
+        Return:
+            dict: Keys are ``akis`` and ``cert_hashes`` (lists of str),
+                ``ca_certificates`` (list of PEM-encoded root certificates),
+                and ``ttl`` (int, the lowest TTL of the identity's TLSA records).
+
+        Raise:
+            TLSAError, ValueError or KeyError if discovery fails.
+        """
+        identity = Identity(dnsname, None, ns_override)
+        akis = []
+        cert_hashes = []
+        ca_certificates = []
+        for _, cert in identity.get_all_certificates(filters=["PKIX-CD"]).items():
+            certificate = CertificateContext(cert)
+            akis.append(certificate.aki)
+            ca_certificates.append(identity.get_pkix_cd_trust_chain(certificate.pem)["root"])
+            cert_hashes.append(certificate.sha256)
+        ttl = min(x["tlsa_parsed"]["ttl"] for x in identity.dane_credentials)
+        return {"akis": akis, "cert_hashes": cert_hashes,
+                "ca_certificates": ca_certificates, "ttl": ttl}
+
+    @classmethod
+    def try_discover_identity(cls, dnsname, ns_override=None):
+        """Wrap discover_identity, returning None if discovery fails."""
+        try:
+            return cls.discover_identity(dnsname, ns_override)
+        except (TLSAError, ValueError, KeyError) as err:
+            print("Recoverable error for {}: {}".format(dnsname, err))
+            print("Continuing...")
+            return None
+
+    @classmethod
+    def discover_all(cls, dnsnames, ns_override=None, concurrency=1, cache=None,
+                     resolvers=None):
+        """Discover many identities, with bounded concurrency.
+
+        If a cache is provided, only identities without an unexpired cache
+        entry are looked up in DNS. The cache is updated with fresh results
+        and pruned of identities not in ``dnsnames``, but not saved.
+
+        If a resolver pool is provided, the TLSA records of the identities
+        to look up are fetched first, pipelined over one connection.
+
+        Args:
+            dnsnames (list): DNS names of identities.
+            ns_override (str): Override system name server.
+            concurrency (int): Maximum number of identities to discover
+                at the same time.
+            cache (DiscoveryCache): Optional cache of previous results.
+            resolvers (ResolverPool): Optional pool which dane_discovery's
+                lookups are routed through.
+
+        Return:
+            dict: Keys are DNS names, in the order given, and values are as
+                returned by :func:`discover_identity`. Identities which
+                could not be discovered are left out.
+        """
+        dnsnames = list(dnsnames)
+        found = {}
+        if cache is not None:
+            cache.retain(dnsnames)
+            found = {x: cache.get(x) for x in dnsnames}
+            found = {k: v for k, v in found.items() if v is not None}
+        to_query = [x for x in dnsnames if x not in found]
+        if cache is not None:
+            metrics.current().incr("discovery_cache_hit", len(found))
+            metrics.current().incr("discovery_cache_miss", len(to_query))
+        if resolvers is not None:
+            resolvers.prefetch(to_query, "TLSA", ns_override)
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            results = executor.map(lambda x: cls.try_discover_identity(x, ns_override),
+                                   to_query)
+            for dnsname, result in zip(to_query, results):
+                if result is None:
+                    metrics.current().incr("discovery_failed")
+                    continue
+                found[dnsname] = result
+                if cache is not None:
+                    cache.set(dnsname, result)
+        return {x: found[x] for x in dnsnames if x in found}
+
+    @classmethod
+    def build_trust_map(cls, authz_config, discovered):
+        """Merge discovery results into the trust map and CA set.
+
+        Args:
+            authz_config (dict): As returned by
+                :func:`~radius_pkix_cd.utility.Utility.get_authz_config`.
+            discovered (dict): As returned by :func:`discover_all`.
+
+        Return:
+            dict: Trust map, as described in
+                :func:`~radius_pkix_cd.utility.Utility.update_trust_store_file`.
+                Identities which could not be discovered map to an empty dict.
+            set: PEM-encoded CA certificates.
+        """
+        configured_trust = {}
+        ca_certificates = set([])
+        for dnsname, realms in authz_config.items():
+            trust = {}
+            if dnsname in discovered:
+                trust = {"akis": discovered[dnsname]["akis"],
+                         "cert_hashes": discovered[dnsname]["cert_hashes"]}
+                ca_certificates.update(discovered[dnsname]["ca_certificates"])
+            for realm in realms:
+                configured_trust.setdefault(realm, {})[dnsname] = dict(trust)
+        return configured_trust, ca_certificates
@@ -0,0 +1,90 @@
+"""Persistent, TTL-aware cache of identity discovery results."""
+import json
+import time
+
+from radius_pkix_cd.utility import Utility
+
+
+class DiscoveryCache:
+    """Keep discovery results between pkix_cd_manage_trust runs.
+
+    Entries are keyed by DNS name and expire according to the TTL of
+    the identity's TLSA records, capped at ``max_ttl``. The cache is a
+    JSON file, replaced atomically when saved.
+
+    File format::
+
+        {"version": 1,
+         "entries":
+            {"my._device.example":
+                {"expires": 1634860800.0,
+                 "akis": ["AKI1"],
+                 "cert_hashes": ["cert_hash_1"],
+                 "ca_certificates": ["-----BEGIN CERTIFICATE-----..."]
+                }
+            }
+        }
+    """
+
+    version = 1
+
+    def __init__(self, path, max_ttl=86400):
+        """Initialize with the cache file path, loading existing entries.
+
+        A missing or unreadable cache file starts an empty cache.
+
+        Args:
+            path (str): Path to cache file.
+            max_ttl (int): Never keep an entry longer than this many seconds.
+        """
+        self.path = path
+        self.max_ttl = max_ttl
+        self.entries = {}
+        try:
+            with open(path) as cache_file:
+                contents = json.load(cache_file)
+            if contents.get("version") == self.version:
+                self.entries = contents["entries"]
+        except (FileNotFoundError, json.decoder.JSONDecodeError, AttributeError, KeyError):
+            self.entries = {}
+
+    def get(self, dnsname, now=None):
+        """Return the unexpired discovery result for ``dnsname``, or None.
+
+        Return:
+            dict: As returned by
+                :func:`~radius_pkix_cd.discovery.Discovery.discover_identity`.
+        """
+        now = time.time() if now is None else now
+        entry = self.entries.get(dnsname)
+        if entry is None or entry["expires"] <= now:
+            return None
+        return {"akis": entry["akis"], "cert_hashes": entry["cert_hashes"],
+                "ca_certificates": [x.encode() for x in entry["ca_certificates"]],
+                "ttl": int(entry["expires"] - now)}
+
+    def set(self, dnsname, result, now=None):
+        """Store a discovery result for ``dnsname``.
+
+        Args:
+            dnsname (str): DNS name of identity.
+            result (dict): As returned by
+                :func:`~radius_pkix_cd.discovery.Discovery.discover_identity`.
+        """
+        now = time.time() if now is None else now
+        ttl = min(result.get("ttl", self.max_ttl), self.max_ttl)
+        self.entries[dnsname] = {"expires": now + ttl,
+                                 "akis": result["akis"],
+                                 "cert_hashes": result["cert_hashes"],
+                                 "ca_certificates": [x.decode() if isinstance(x, bytes) else x
+                                                     for x in result["ca_certificates"]]}
+
+    def retain(self, dnsnames):
+        """Drop every entry whose DNS name is not in ``dnsnames``."""
+        keep = set(dnsnames)
+        self.entries = {k: v for k, v in self.entries.items() if k in keep}
+
+    def save(self):
+        """Write the cache to disk."""
+        contents = {"version": self.version, "entries": self.entries}
+        Utility.write_file_atomically(self.path, json.dumps(contents).encode())
@@ -0,0 +1,115 @@
+"""One process-wide hook on dane_discovery's lookups.
+
+Several features change what ``DANE.get_responses`` and
+``DANE.wrap_requests`` do: metrics count them, a ResolverPool answers
+them, and deadlines bound their timeouts. Rather than
+each wrapping whatever it finds on ``DANE``, which makes the outcome
+depend on the order they were enabled in, :func:`install` replaces the
+two functions once, with dispatchers which count every call and then
+hand it to the pool, if one is set, or to dane_discovery.
+"""
+import contextlib
+import threading
+import time
+
+from radius_pkix_cd import metrics
+
+
+lock = threading.Lock()
+originals = {}
+pool = None
+http_timeout = False
+# Per-thread deadline, from time.monotonic(), set by deadline().
+local = threading.local()
+
+
+def install():
+    """Route dane_discovery lookups through this module, for the whole process."""
+    from dane_discovery.dane import DANE
+
+    with lock:
+        if originals:
+            return
+        originals["get_responses"] = DANE.get_responses
+        originals["wrap_requests"] = DANE.wrap_requests
+        DANE.get_responses = staticmethod(get_responses)
+        DANE.wrap_requests = staticmethod(wrap_requests)
+
+
+def set_pool(resolver_pool):
+    """Answer lookups from ``resolver_pool`` from now on, or from dane_discovery if None."""
+    global pool
+    install()
+    pool = resolver_pool
+
+
+def enable_http_timeout():
+    """Give up on CA certificate downloads after ``dns_timeout``, as for DNS queries.
+
+    ``DANE.wrap_requests`` waits on the web server for as long as it
+    takes, so downloads not answered by a pool go to
+    ``Utility.wrap_requests`` instead.
+    """
+    global http_timeout
+    install()
+    http_timeout = True
+
+
+@contextlib.contextmanager
+def route(resolver_pool):
+    """Answer lookups from ``resolver_pool``, for the duration."""
+    previous = pool
+    set_pool(resolver_pool)
+    try:
+        yield resolver_pool
+    finally:
+        set_pool(previous)
+
+
+@contextlib.contextmanager
+def deadline(when):
+    """Cut this thread's lookups short at ``when``, for the duration.
+
+    dane_discovery doesn't pass every caller's ``dns_timeout`` on (its
+    TLSA lookups use the default), so the dispatchers bound the timeout
+    they're given by what's left until ``when`` instead.
+
+    Args:
+        when (float): Deadline, from ``time.monotonic()``, or None.
+    """
+    install()
+    previous = getattr(local, "deadline", None)
+    local.deadline = when
+    try:
+        yield
+    finally:
+        local.deadline = previous
+
+
+def get_timeout(dns_timeout):
+    """Return ``dns_timeout``, or the seconds left until this thread's deadline, if fewer."""
+    when = getattr(local, "deadline", None)
+    if when is None:
+        return dns_timeout
+    return min(dns_timeout, max(0.001, when - time.monotonic()))
+
+
+def get_responses(dnsname, rr_type, nsaddr=None, dns_timeout=5):
+    """Stand-in for ``DANE.get_responses``."""
+    metrics.current().incr("dns_queries")
+    dns_timeout = get_timeout(dns_timeout)
+    if pool is not None:
+        return pool.get_responses(dnsname, rr_type, nsaddr, dns_timeout)
+    return originals["get_responses"](dnsname, rr_type, nsaddr, dns_timeout)
+
+
+def wrap_requests(url, nsaddr=None, dns_timeout=5):
+    """Stand-in for ``DANE.wrap_requests``."""
+    metrics.current().incr("dns_queries")
+    dns_timeout = get_timeout(dns_timeout)
+    if pool is not None:
+        return pool.wrap_requests(url, nsaddr, dns_timeout)
+    if http_timeout:
+        from radius_pkix_cd.utility import Utility
+        return Utility.wrap_requests(url, nsaddr, dns_timeout)
+    return originals["wrap_requests"](url, nsaddr, dns_timeout)
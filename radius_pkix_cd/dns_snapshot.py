@@ -0,0 +1,151 @@
+"""Record DNS and CA certificate lookups, and replay them offline."""
+import base64
+import contextlib
+import gzip
+import io
+import json
+import threading
+
+import dns.exception
+from dane_discovery.dane import DANE
+
+from radius_pkix_cd.utility import Utility
+
+
+class DNSSnapshot:
+    """A snapshot of the lookups made by ``dane_discovery``.
+
+    While recording, every ``DANE.get_responses`` query and every
+    ``DANE.wrap_requests`` CA certificate download is passed through
+    to the network and its result kept. While replaying, the same calls
+    are answered from the snapshot, and nothing touches the network.
+    This lets one host build the trust map and distribute the snapshot,
+    and makes runs against large access lists reproducible.
+
+    Lookups are intercepted by patching ``DANE`` for the whole process,
+    so only one snapshot may be recording or replaying at a time.
+
+    The snapshot file is gzip-compressed JSON::
+
+        {"version": 1,
+         "queries":
+            {"my._device.example|TLSA":
+                {"dnssec": true, "tcp": true, "tls": false,
+                 "responses": ["my._device.example. 300 IN TLSA 4 0 0 ..."]},
+             "gone._device.example|TLSA":
+                {"error": "The DNS query name does not exist: ..."}
+            },
+         "documents":
+            {"https://device.example/.well-known/ca/AKI.pem": "base64..."}
+        }
+    """
+
+    version = 1
+
+    def __init__(self, path):
+        """Initialize an empty snapshot.
+
+        Args:
+            path (str): Path to snapshot file.
+        """
+        self.path = path
+        self.queries = {}
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        """Return the snapshot stored at ``path``.
+
+        Raise:
+            FileNotFoundError if the snapshot file does not exist.
+            ValueError if the file is not a snapshot.
+        """
+        with open(path, "rb") as snapshot_file:
+            raw = snapshot_file.read()
+        try:
+            contents = json.loads(gzip.decompress(raw))
+            if contents["version"] != cls.version:
+                raise ValueError("Unsupported version {}".format(contents["version"]))
+            snapshot = cls(path)
+            snapshot.queries = contents["queries"]
+            snapshot.documents = contents["documents"]
+        except (OSError, EOFError, TypeError, KeyError, ValueError) as err:
+            raise ValueError("Invalid DNS snapshot {}: {}".format(path, err))
+        return snapshot
+
+    def save(self):
+        """Write the snapshot to disk."""
+        contents = {"version": self.version, "queries": self.queries,
+                    "documents": self.documents}
+        raw = json.dumps(contents, sort_keys=True, separators=(",", ":")).encode()
+        compressed = io.BytesIO()
+        # GzipFile, rather than gzip.compress, takes mtime on Python 3.7.
+        with gzip.GzipFile(fileobj=compressed, mode="wb", mtime=0) as gzip_file:
+            gzip_file.write(raw)
+        Utility.write_file_atomically(self.path, compressed.getvalue())
+
+    @classmethod
+    def get_query_key(cls, dnsname, rr_type):
+        """Return the snapshot key for a DNS query."""
+        return "{}|{}".format(dnsname.rstrip(".").lower(), rr_type)
+
+    @contextlib.contextmanager
+    def intercept(self, get_responses, wrap_requests):
+        """Route DANE lookups to the given functions, for the duration."""
+        originals = {"get_responses": DANE.__dict__["get_responses"],
+                     "wrap_requests": DANE.__dict__["wrap_requests"]}
+        DANE.get_responses = staticmethod(get_responses)
+        DANE.wrap_requests = staticmethod(wrap_requests)
+        try:
+            yield self
+        finally:
+            for name, original in originals.items():
+                setattr(DANE, name, original)
+
+    def record(self):
+        """Return a context manager which records lookups into this snapshot.
+
+        Failed DNS queries are recorded too, and fail the same way on replay.
+        """
+        get_responses = DANE.get_responses
+        wrap_requests = DANE.wrap_requests
+
+        def record_responses(dnsname, rr_type, nsaddr=None, dns_timeout=5):
+            key = self.get_query_key(dnsname, rr_type)
+            try:
+                result = get_responses(dnsname, rr_type, nsaddr, dns_timeout)
+            except dns.exception.DNSException as err:
+                with self.lock:
+                    self.queries[key] = {"error": str(err)}
+                raise
+            with self.lock:
+                self.queries[key] = result
+            return result
+
+        def record_requests(url, nsaddr=None, dns_timeout=5):
+            content = wrap_requests(url, nsaddr, dns_timeout)
+            with self.lock:
+                self.documents[url] = base64.b64encode(content).decode()
+            return content
+
+        return self.intercept(record_responses, record_requests)
+
+    def replay(self):
+        """Return a context manager which answers lookups from this snapshot.
+
+        A DNS query missing from the snapshot fails as a DNS error, and a
+        missing CA certificate as an empty download.
+        """
+        def replay_responses(dnsname, rr_type, nsaddr=None, dns_timeout=5):
+            result = self.queries.get(self.get_query_key(dnsname, rr_type))
+            if result is None:
+                raise dns.exception.DNSException("{} {} not in DNS snapshot".format(dnsname, rr_type))
+            if "error" in result:
+                raise dns.exception.DNSException(result["error"])
+            return dict(result, responses=list(result["responses"]))
+
+        def replay_requests(url, nsaddr=None, dns_timeout=5):
+            return base64.b64decode(self.documents.get(url, ""))
+
+        return self.intercept(replay_responses, replay_requests)
@@ -0,0 +1,153 @@
+"""Match DNS names against many domains at once."""
+
+
+class DomainPolicy:
+    """Match DNS names against a set of domains, with a suffix trie.
+
+    Domains are stored as a trie of their labels, in reverse-DNS order,
+    so matching a name walks one node per label, however many domains
+    there are. A name matches a domain if it falls strictly under it,
+    as for :func:`~radius_pkix_cd.utility.Utility.dnsname_in_domain`:
+    ``my._device.example.com`` matches ``example.com``, and
+    ``example.com`` doesn't. Matching is case-insensitive.
+
+    Each domain may carry values. For subtree grants in the access list
+    (``SSID|*._device.example.com``), the values are the realms the
+    subtree is granted access to.
+    """
+
+    wildcard_prefix = "*."
+
+    # Key for a node's values. Labels are never empty, so it can't clash.
+    values_key = ""
+
+    def __init__(self, domains=()):
+        """Initialize with domains that carry no values.
+
+        Args:
+            domains (iterable): Domain names, optionally prefixed with ``*.``.
+        """
+        self.root = {}
+        for domain in domains:
+            self.add(domain)
+
+    @classmethod
+    def load(cls, path):
+        """Return a DomainPolicy with the domains listed in a file.
+
+        The file has one domain per line. Blank lines and lines starting
+        with ``#`` are ignored.
+
+        Raise:
+            FileNotFoundError if the file does not exist.
+            ValueError if a line is not a domain name.
+        """
+        from radius_pkix_cd.utility import Utility
+        policy = cls()
+        with open(path) as domains_file:
+            for line_no, line in enumerate(domains_file, 1):
+                domain = line.strip()
+                if not domain or domain.startswith("#"):
+                    continue
+                try:
+                    Utility.verify_dns_name(domain, allow_wildcard=True)
+                except ValueError as err:
+                    raise ValueError("{}:{}: Bad domain name: {}".format(path, line_no, err))
+                policy.add(domain)
+        return policy
+
+    @classmethod
+    def is_wildcard(cls, name):
+        """Return True if ``name`` is a subtree grant, like ``*.example.com``."""
+        return name.startswith(cls.wildcard_prefix)
+
+    @classmethod
+    def get_labels(cls, name):
+        """Return the labels of ``name``, lowercased and in reverse-DNS order.
+
+        A leading ``*.`` is dropped.
+        """
+        if cls.is_wildcard(name):
+            name = name[len(cls.wildcard_prefix):]
+        labels = name.lower().rstrip(".").split(".")
+        labels.reverse()
+        return labels
+
+    @classmethod
+    def get_wildcards(cls, dns_name):
+        """Return the subtree grants ``dns_name`` would fall under, nearest first.
+
+        For ``a.b.example.com``, that's ``*.b.example.com``,
+        ``*.example.com`` and ``*.com``.
+        """
+        labels = dns_name.lower().rstrip(".").split(".")
+        if "" in labels:
+            # Not a DNS name, so not under any domain.
+            return []
+        return [cls.wildcard_prefix + ".".join(labels[x:]) for x in range(1, len(labels))]
+
+    def add(self, domain, value=None):
+        """Add ``domain``, with an optional value."""
+        node = self.root
+        for label in self.get_labels(domain):
+            node = node.setdefault(label, {})
+        values = node.setdefault(self.values_key, set())
+        if value is not None:
+            values.add(value)
+
+    def remove(self, domain, value=None):
+        """Remove ``value`` from ``domain``, or the whole domain if no value is given.
+
+        Nodes left without domains under them are pruned.
+        """
+        path = [self.root]
+        for label in self.get_labels(domain):
+            if label not in path[-1]:
+                return
+            path.append(path[-1][label])
+        values = path[-1].get(self.values_key)
+        if values is None:
+            return
+        values.discard(value)
+        if value is None or not values:
+            del path[-1][self.values_key]
+        labels = self.get_labels(domain)
+        while len(path) > 1 and not path[-1]:
+            path.pop()
+            del path[-1][labels[len(path) - 1]]
+
+    def get_values(self, dns_name):
+        """Return the values of every domain ``dns_name`` falls under, as a set."""
+        labels = self.get_labels(dns_name)
+        found = set()
+        if self.values_key in labels:
+            # Not a DNS name, and the empty label would walk into a node's values.
+            return found
+        node = self.root
+        # The last label can't lead to a domain the name is strictly under.
+        for label in labels[:-1]:
+            node = node.get(label)
+            if node is None:
+                break
+            found.update(node.get(self.values_key, ()))
+        return found
+
+    def matches(self, dns_name):
+        """Return True if ``dns_name`` falls under any of the domains.
+
+        Raise:
+            ValueError if ``dns_name`` has an empty label, like
+                ``a..iotregistry.ca``. It isn't a DNS name, so whether it's
+                under a domain has no answer; callers mustn't take it as no.
+        """
+        labels = self.get_labels(dns_name)
+        if self.values_key in labels:
+            raise ValueError("Malformed DNS name: {}".format(dns_name))
+        node = self.root
+        for label in labels[:-1]:
+            node = node.get(label)
+            if node is None:
+                return False
+            if self.values_key in node:
+                return True
+        return False
@@ -0,0 +1,215 @@
+"""Optional per-stage timing and counters for verify and manage_trust.
+
+Each operation (one authorization, or one pkix_cd_manage_trust run) gets
+a Metrics object, which records how long each stage took, counts DNS
+queries and cache hits and misses, and the outcome. When it's done, the
+Metrics are handed to the configured exporters:
+
+- JSONLogExporter appends one JSON object per line to a file.
+- StatsdExporter sends statsd timers and counters over UDP, so the
+  aggregator can build histograms across processes.
+
+Code deep in the call stack records against the current Metrics, found
+with :func:`current`. When metrics are disabled that's NULL_METRICS,
+whose methods do nothing.
+"""
+import contextlib
+import json
+import socket
+import sys
+import threading
+import time
+
+
+local = threading.local()
+process_metrics = None
+
+
+def current():
+    """Return the Metrics for the operation in progress, or NULL_METRICS."""
+    return getattr(local, "metrics", None) or process_metrics or NULL_METRICS
+
+
+class Metrics:
+    """Stage durations, counters and outcome for one operation."""
+
+    def __init__(self, operation, labels=None):
+        """Start timing an operation.
+
+        Args:
+            operation (str): ``verify`` or ``manage_trust``.
+            labels (dict): Extra context for the JSON log. Not sent to statsd.
+        """
+        self.operation = operation
+        self.labels = labels or {}
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.stages = {}
+        self.counters = {}
+        self.outcome = None
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage ``name``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def incr(self, name, amount=1):
+        """Add ``amount`` to counter ``name``."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextlib.contextmanager
+    def activate(self, process_wide=False):
+        """Make this the current Metrics, for the enclosed block.
+
+        Args:
+            process_wide (bool): Apply to all threads, for operations which
+                fan out to a thread pool. Otherwise, only this thread.
+        """
+        # Imported here, as it imports this module.
+        from radius_pkix_cd import dns_dispatch
+
+        global process_metrics
+        dns_dispatch.install()
+        if process_wide:
+            previous, process_metrics = process_metrics, self
+        else:
+            previous, local.metrics = getattr(local, "metrics", None), self
+        try:
+            yield self
+        finally:
+            if process_wide:
+                process_metrics = previous
+            else:
+                local.metrics = previous
+
+    def finish(self, outcome):
+        """Stop timing, and record the outcome (an exit code)."""
+        self.duration = time.perf_counter() - self.started
+        self.outcome = outcome
+
+    def to_dict(self):
+        """Return the metrics as a dict, with durations in milliseconds."""
+        return {"operation": self.operation, "timestamp": self.timestamp,
+                "duration_ms": (self.duration or 0.0) * 1000.0,
+                "stages_ms": {k: v * 1000.0 for k, v in self.stages.items()},
+                "counters": dict(self.counters), "outcome": self.outcome,
+                "labels": self.labels}
+
+
+class NullMetrics(Metrics):
+    """Metrics which record nothing, for when metrics are disabled."""
+
+    null_context = contextlib.nullcontext()
+
+    def __init__(self):
+        """Initialize."""
+        super().__init__("null")
+
+    def stage(self, name):
+        """Do nothing."""
+        return self.null_context
+
+    def incr(self, name, amount=1):
+        """Do nothing."""
+
+    def activate(self, process_wide=False):
+        """Do nothing."""
+        return self.null_context
+
+    def finish(self, outcome):
+        """Do nothing."""
+
+
+NULL_METRICS = NullMetrics()
+
+
+class JSONLogExporter:
+    """Append one JSON line per operation to a file, or ``-`` for stderr."""
+
+    def __init__(self, path):
+        """Initialize with the log file path."""
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, metrics):
+        """Write ``metrics`` as a JSON line."""
+        line = json.dumps(metrics.to_dict(), sort_keys=True) + "\n"
+        with self.lock:
+            if self.path == "-":
+                sys.stderr.write(line)
+                return
+            try:
+                with open(self.path, "a") as log_file:
+                    log_file.write(line)
+            except OSError as err:
+                print("Unable to write metrics to {}: {}".format(self.path, err))
+
+
+class StatsdExporter:
+    """Send timers and counters to a statsd server."""
+
+    def __init__(self, address, prefix="radius_pkix_cd"):
+        """Initialize with the statsd server's address.
+
+        Args:
+            address (str): ``host:port``.
+            prefix (str): Prefix for metric names.
+        """
+        host, _, port = address.rpartition(":")
+        self.address = (host or "localhost", int(port))
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def get_lines(self, metrics):
+        """Return the statsd lines for ``metrics``."""
+        base = "{}.{}".format(self.prefix, metrics.operation)
+        values = metrics.to_dict()
+        lines = ["{}.duration:{:.3f}|ms".format(base, values["duration_ms"]),
+                 "{}.outcome.{}:1|c".format(base, values["outcome"])]
+        lines.extend("{}.stage.{}:{:.3f}|ms".format(base, k, v) for k, v in sorted(values["stages_ms"].items()))
+        lines.extend("{}.{}:{}|c".format(base, k, v) for k, v in sorted(values["counters"].items()))
+        return lines
+
+    def export(self, metrics):
+        """Send ``metrics`` in one datagram. Failures are ignored."""
+        try:
+            self.sock.sendto("\n".join(self.get_lines(metrics)).encode(), self.address)
+        except OSError:
+            pass
+
+
+def get_exporters(metrics_log=None, metrics_statsd=None):
+    """Return the exporters for the given settings. Empty means disabled.
+
+    Args:
+        metrics_log (str): Path for the JSON log, or ``-`` for stderr.
+        metrics_statsd (str): statsd server, as ``host:port``.
+    """
+    exporters = []
+    if metrics_log:
+        exporters.append(JSONLogExporter(metrics_log))
+    if metrics_statsd:
+        exporters.append(StatsdExporter(metrics_statsd))
+    return exporters
+
+
+def start(exporters, operation, labels=None):
+    """Return a new Metrics if any exporters are configured, else NULL_METRICS."""
+    if not exporters:
+        return NULL_METRICS
+    return Metrics(operation, labels)
+
+
+def export(exporters, metrics):
+    """Hand finished ``metrics`` to each exporter."""
+    for exporter in exporters:
+        exporter.export(metrics)
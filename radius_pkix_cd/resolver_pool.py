@@ -0,0 +1,373 @@
+"""Share DNS connections and responses between lookups in one process.
+
+``dane_discovery`` sets up every lookup from scratch: ``DANE.get_responses``
+opens a new connection to the name server per query (first trying
+DNS-over-TLS, then UDP), and ``DANE.wrap_requests`` builds a new resolver
+and HTTP session per CA certificate download. A ResolverPool answers the
+same calls over connections which stay open between lookups, and caches
+responses for their TTL, so identities sharing records, and repeated
+checks of the same identity, don't go back to the name server.
+"""
+import contextlib
+import socket
+import ssl
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
+import dns.resolver
+import requests
+from dane_discovery.dane import DANE
+from forcediphttpsadapter.adapters import ForcedIPHTTPSAdapter
+
+from radius_pkix_cd import dns_dispatch
+from radius_pkix_cd import metrics
+
+
+installed = None
+install_lock = threading.Lock()
+
+
+def install(transport="tcp"):
+    """Route dane_discovery lookups through a ResolverPool, for the whole process.
+
+    Long-running processes (the verify service, rlm_python) share one
+    pool between all of their Verifiers. The first transport asked for wins.
+
+    Return:
+        ResolverPool: The process-wide pool.
+    """
+    global installed
+    with install_lock:
+        if installed is None:
+            installed = ResolverPool(transport)
+            dns_dispatch.set_pool(installed)
+        return installed
+
+
+class ResolverPool:
+    """Persistent connections to name servers, and a response cache.
+
+    Each query borrows an idle connection to its name server, or opens
+    one, and gives it back afterwards, so a process holds about as many
+    connections as it makes concurrent lookups. Connections idle for
+    longer than ``idle_timeout`` are assumed closed by the server and
+    replaced, and a query which fails on a reused connection is retried
+    once on a new one. :func:`prefetch` pipelines many queries over one
+    connection.
+
+    Responses are cached by name, type and name server, for the lowest
+    TTL in the answer, and handed out with their TTLs counted down.
+    Empty answers are cached for the SOA minimum, up to ``negative_ttl``.
+    Failed lookups are not cached.
+    """
+
+    ports = {"tcp": 53, "tls": 853}
+
+    # Queries in flight at once on a pipelined connection.
+    pipeline_depth = 32
+
+    def __init__(self, transport="tcp", max_ttl=3600, negative_ttl=60,
+                 max_entries=10000, idle_timeout=10):
+        """Initialize an empty pool.
+
+        Args:
+            transport (str): ``tcp``, or ``tls`` for DNS-over-TLS.
+            max_ttl (int): Maximum seconds to cache a response.
+            negative_ttl (int): Maximum seconds to cache an empty answer.
+            max_entries (int): Maximum number of cached responses.
+            idle_timeout (int): Seconds before an idle connection is
+                replaced, rather than reused.
+
+        Raise:
+            ValueError if the transport is not supported.
+        """
+        if transport not in self.ports:
+            raise ValueError("Unsupported DNS transport: {}".format(transport))
+        self.transport = transport
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self.ssl_context = None
+        if transport == "tls":
+            # As dns.query.tls does, when no server name is known.
+            self.ssl_context = ssl.create_default_context()
+            self.ssl_context.check_hostname = False
+        self.connections = {}
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def intercept(self):
+        """Route dane_discovery lookups through this pool, for the duration."""
+        try:
+            with dns_dispatch.route(self):
+                yield self
+        finally:
+            self.close()
+
+    @classmethod
+    def get_nameserver(cls, nsaddr=None):
+        """Return ``nsaddr``, or the system's first name server."""
+        return nsaddr or dns.resolver.get_default_resolver().nameservers[0]
+
+    @classmethod
+    def get_cache_key(cls, dnsname, rr_type, nameserver):
+        """Return the response cache key for a query."""
+        return (dnsname.rstrip(".").lower(), rr_type, nameserver)
+
+    def get_responses(self, dnsname, rr_type, nsaddr=None, dns_timeout=5):
+        """Stand-in for ``DANE.get_responses``, returning the same dict.
+
+        Raise:
+            dns.exception.DNSException if the query fails.
+        """
+        nameserver = self.get_nameserver(nsaddr)
+        key = self.get_cache_key(dnsname, rr_type, nameserver)
+        result = self.get_cached(key)
+        if result is not None:
+            metrics.current().incr("dns_pool_cache_hit")
+            return result
+        query = dns.message.make_query(dnsname, rr_type, want_dnssec=True)
+        response = self.query(query, nameserver, dns_timeout)
+        self.set_cached(key, response)
+        return self.get_query_details(response, rr_type, None)
+
+    def query(self, query, nameserver, dns_timeout=5):
+        """Send ``query`` to ``nameserver`` and return the response message.
+
+        Raise:
+            dns.exception.DNSException if the query fails.
+        """
+        metrics.current().incr("dns_pool_queries")
+        for attempt in range(2):
+            connection, reused = self.checkout(nameserver, dns_timeout)
+            try:
+                expiration = time.time() + dns_timeout
+                dns.query.send_tcp(connection, query, expiration)
+                response, _ = dns.query.receive_tcp(connection, expiration)
+                if not query.is_response(response):
+                    raise dns.query.BadResponse()
+            except (OSError, EOFError, dns.exception.DNSException) as err:
+                connection.close()
+                # The server may have closed a connection we held on to.
+                if reused and attempt == 0 and not isinstance(err, dns.exception.Timeout):
+                    continue
+                if isinstance(err, dns.exception.DNSException):
+                    raise
+                raise dns.exception.DNSException("Query to {} failed: {}".format(nameserver, err))
+            self.checkin(nameserver, connection)
+            return response
+
+    def prefetch(self, dnsnames, rr_type, nsaddr=None, dns_timeout=5):
+        """Cache responses for many names, pipelining the queries.
+
+        Queries are written to one connection without waiting for each
+        response, up to ``pipeline_depth`` at a time, and responses are
+        matched up by query ID as they arrive. Errors are not raised:
+        names left uncached are looked up as usual when they're needed.
+
+        Return:
+            int: Number of responses cached.
+        """
+        nameserver = self.get_nameserver(nsaddr)
+        pending = {}
+        for dnsname in dnsnames:
+            key = self.get_cache_key(dnsname, rr_type, nameserver)
+            if key not in pending and self.get_cached(key) is None:
+                pending[key] = dns.message.make_query(dnsname, rr_type, want_dnssec=True)
+        batch = list(pending.items())
+        cached = 0
+        try:
+            connection, _ = self.checkout(nameserver, dns_timeout)
+        except dns.exception.DNSException as err:
+            print("Unable to prefetch from {}: {}".format(nameserver, err), file=sys.stderr)
+            return cached
+        try:
+            for offset in range(0, len(batch), self.pipeline_depth):
+                in_flight = {}
+                for key, query in batch[offset:offset + self.pipeline_depth]:
+                    # Random IDs could collide within a window, so number them.
+                    query.id = (batch[offset][1].id + len(in_flight)) & 0xFFFF
+                    in_flight[query.id] = (key, query)
+                expiration = time.time() + dns_timeout
+                for _, query in in_flight.values():
+                    dns.query.send_tcp(connection, query, expiration)
+                metrics.current().incr("dns_pool_queries", len(in_flight))
+                while in_flight:
+                    response, _ = dns.query.receive_tcp(connection, expiration)
+                    key, query = in_flight.pop(response.id, (None, None))
+                    if query is None or not query.is_response(response):
+                        raise dns.query.BadResponse()
+                    if self.set_cached(key, response):
+                        cached += 1
+        except (OSError, EOFError, dns.exception.DNSException) as err:
+            connection.close()
+            print("Prefetch from {} stopped: {}".format(nameserver, err), file=sys.stderr)
+            return cached
+        self.checkin(nameserver, connection)
+        return cached
+
+    def checkout(self, nameserver, dns_timeout=5):
+        """Borrow a connection to ``nameserver``, opening one if none is idle.
+
+        Return:
+            socket.socket: Connected, non-blocking stream socket.
+            bool: True if the connection was used before.
+
+        Raise:
+            dns.exception.DNSException if a connection can't be opened.
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = self.connections.get(nameserver, [])
+            while idle:
+                connection, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return connection, True
+                connection.close()
+        return self.connect(nameserver, dns_timeout), False
+
+    def checkin(self, nameserver, connection):
+        """Give back a connection after a successful query."""
+        with self.lock:
+            self.connections.setdefault(nameserver, []).append((connection, time.monotonic()))
+
+    def connect(self, nameserver, dns_timeout=5):
+        """Open a connection to ``nameserver``.
+
+        Raise:
+            dns.exception.DNSException if the connection fails.
+        """
+        metrics.current().incr("dns_pool_connections")
+        address = (nameserver, self.ports[self.transport])
+        try:
+            connection = socket.create_connection(address, timeout=dns_timeout)
+            if self.ssl_context is not None:
+                connection = self.ssl_context.wrap_socket(connection)
+        except OSError as err:
+            raise dns.exception.DNSException("Unable to connect to {}: {}".format(nameserver, err))
+        # dns.query expects a non-blocking socket, and enforces its own timeouts.
+        connection.setblocking(False)
+        return connection
+
+    def close(self):
+        """Close all idle connections."""
+        with self.lock:
+            connections, self.connections = self.connections, {}
+        for idle in connections.values():
+            for connection, _ in idle:
+                connection.close()
+
+    def get_cached(self, key):
+        """Return the cached query details for ``key``, or None."""
+        with self.lock:
+            entry = self.responses.get(key)
+        if entry is None:
+            return None
+        response, expires = entry
+        remaining = int(expires - time.time())
+        if remaining <= 0:
+            return None
+        return self.get_query_details(response, key[1], remaining)
+
+    def set_cached(self, key, response):
+        """Cache ``response`` under ``key``, if its TTL allows.
+
+        Return:
+            bool: True if the response was cached.
+        """
+        ttl = self.get_ttl(response)
+        if ttl <= 0:
+            return False
+        now = time.time()
+        with self.lock:
+            if len(self.responses) >= self.max_entries:
+                self.responses = {k: v for k, v in self.responses.items() if v[1] > now}
+            while len(self.responses) >= self.max_entries:
+                # Dicts keep insertion order, so this drops the oldest entry.
+                del self.responses[next(iter(self.responses))]
+            self.responses[key] = (response, now + ttl)
+        return True
+
+    def get_ttl(self, response):
+        """Return the seconds ``response`` may be cached for, or 0 if it mustn't be."""
+        rcode = response.rcode()
+        if rcode not in [dns.rcode.NOERROR, dns.rcode.NXDOMAIN]:
+            return 0
+        if response.answer:
+            return min([self.max_ttl] + [x.ttl for x in response.answer])
+        soas = [x for x in response.authority if x.rdtype == dns.rdatatype.SOA]
+        if not soas:
+            return 0
+        return min(self.negative_ttl, soas[0].ttl, soas[0][0].minimum)
+
+    def get_query_details(self, response, rr_type, ttl=None):
+        """Return the ``DANE.get_responses`` dict for a response message.
+
+        Args:
+            response (dns.message.Message): Response from the name server.
+            rr_type (str): RR type which was queried.
+            ttl (int): TTL to report for the records, if lower than theirs.
+        """
+        query_details = {"tls": self.transport == "tls", "tcp": True}
+        query_details["dnssec"] = "AD" in dns.flags.to_text(response.flags).split()
+        answer = response.answer
+        if ttl is not None:
+            answer = [x.copy() for x in answer]
+            for rrset in answer:
+                rrset.update_ttl(ttl)
+        # The same filter as DANE.get_responses, so results are interchangeable.
+        query_details["responses"] = [a.to_text() for a in answer
+                                      if rr_type in a.to_text().split(" ")[3]]
+        return query_details
+
+    def wrap_requests(self, url, nsaddr=None, dns_timeout=5):
+        """Stand-in for ``DANE.wrap_requests``, returning the document.
+
+        The host's address is looked up through the pool, and each
+        thread keeps one HTTP session, so downloads from the same host
+        reuse the connection.
+
+        Raise:
+            ValueError if the host has no address.
+        """
+        parsed = urlparse(url)
+        hostname = parsed.hostname
+        ip_address = self.get_address(hostname, nsaddr, dns_timeout)
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            self.local.addresses = {}
+        prefix = "{}://{}/".format(parsed.scheme, parsed.netloc)
+        if self.local.addresses.get(prefix) != ip_address:
+            session.mount(prefix, ForcedIPHTTPSAdapter(dest_ip=ip_address))
+            self.local.addresses[prefix] = ip_address
+        r = session.get(url, headers={"Host": hostname}, timeout=dns_timeout)
+        return r.content
+
+    def get_address(self, hostname, nsaddr=None, dns_timeout=5):
+        """Return the first IPv4 address of ``hostname``, following CNAMEs.
+
+        Raise:
+            ValueError if the lookup fails, or finds no address.
+        """
+        try:
+            responses = self.get_responses(hostname, "A", nsaddr, dns_timeout)["responses"]
+        except dns.exception.DNSException as err:
+            raise ValueError("Caught error '{}' when retrieving A record.".format(err))
+        for rrset in responses:
+            for line in rrset.splitlines():
+                fields = line.split()
+                if len(fields) == 5 and fields[3] == "A":
+                    return fields[4]
+        raise ValueError("No A records for {}".format(hostname))
@@ -0,0 +1,115 @@
+"""Expiring results, shared between processes."""
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResultCache:
+    """Share expiring results between processes, backed by SQLite.
+
+    Any number of pkix_cd_verify processes, and the verify service, may
+    use the same cache file at once. Cache failures are never fatal:
+    if the database can't be read, it's a miss, and if it can't be
+    written, the result just isn't cached.
+    """
+
+    schema = ("CREATE TABLE IF NOT EXISTS results "
+              "(key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+              "stored REAL NOT NULL, expires REAL NOT NULL, "
+              "used REAL NOT NULL DEFAULT 0)")
+
+    # How stale a result's last-used time may get before a hit updates it.
+    # Hits are reads; this keeps most of them that way.
+    touch_interval = 60
+
+    def __init__(self, path, max_ttl=3600, negative_ttl=60, max_entries=None):
+        """Initialize with the path to the cache database.
+
+        Args:
+            path (str): Path to the SQLite database. Created if missing.
+            max_ttl (int): Never keep a result longer than this many seconds.
+            negative_ttl (int): Never keep a negative result longer than
+                this many seconds.
+            max_entries (int): Optional limit on the number of results.
+                The least recently used results are evicted first.
+        """
+        self.path = path
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.local = threading.local()
+
+    def get_connection(self):
+        """Return this thread's database connection."""
+        if not hasattr(self.local, "connection"):
+            connection = sqlite3.connect(self.path, timeout=1)
+            connection.execute(self.schema)
+            columns = [x[1] for x in connection.execute("PRAGMA table_info(results)")]
+            if "used" not in columns:
+                # Caches created before eviction was supported.
+                connection.execute("ALTER TABLE results ADD COLUMN used REAL NOT NULL DEFAULT 0")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            connection.commit()
+            self.local.connection = connection
+        return self.local.connection
+
+    def get(self, key, now=None, allow_expired=False):
+        """Return the cached result for ``key``, or None.
+
+        Args:
+            key (str): Cache key.
+            allow_expired (bool): Return the result even if it has expired.
+
+        Return:
+            dict: Keys are ``value``, ``stored`` and ``expires``.
+        """
+        now = time.time() if now is None else now
+        try:
+            connection = self.get_connection()
+            row = connection.execute(
+                "SELECT value, stored, expires, used FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[2] <= now and not allow_expired):
+                return None
+            if self.max_entries and row[3] < now - self.touch_interval:
+                connection.execute("UPDATE results SET used = ? WHERE key = ?", (now, key))
+                connection.commit()
+        except sqlite3.Error as err:
+            print("Result cache unavailable: {}".format(err))
+            return None
+        return {"value": json.loads(row[0]), "stored": row[1], "expires": row[2]}
+
+    def set(self, key, value, ttl, negative=False, now=None):
+        """Cache ``value`` under ``key`` for ``ttl`` seconds.
+
+        The TTL is capped at ``max_ttl``, or ``negative_ttl`` if
+        ``negative`` is set. If the cache is then over ``max_entries``,
+        the least recently used results are evicted.
+
+        Args:
+            key (str): Cache key.
+            value: Anything that can be serialized to JSON.
+            ttl (int): Seconds the value is valid for, usually a DNS TTL.
+            negative (bool): This is a negative result.
+        """
+        now = time.time() if now is None else now
+        ttl = min(ttl, self.negative_ttl if negative else self.max_ttl)
+        if ttl <= 0:
+            return
+        try:
+            connection = self.get_connection()
+            connection.execute("INSERT OR REPLACE INTO results (key, value, stored, expires, used) "
+                               "VALUES (?, ?, ?, ?, ?)", (key, json.dumps(value), now, now + ttl, now))
+            if self.max_entries:
+                self.evict(connection)
+            connection.commit()
+        except sqlite3.Error as err:
+            print("Result cache unavailable: {}".format(err))
+
+    def evict(self, connection):
+        """Delete the least recently used results beyond ``max_entries``."""
+        count = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_entries:
+            connection.execute("DELETE FROM results WHERE key IN "
+                               "(SELECT key FROM results ORDER BY used LIMIT ?)",
+                               (count - self.max_entries,))
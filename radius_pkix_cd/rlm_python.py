@@ -0,0 +1,210 @@
+"""PKIX-CD authorization inside FreeRADIUS, via rlm_python3.
+
+Running ``pkix_cd_verify`` from the EAP-TLS ``verify { client = ... }``
+hook costs a fork and exec, and a trust map parse, per handshake. This
+module makes the same decision in the FreeRADIUS process instead. The
+trust map, parsed certificates and the IoT Registry cache stay resident
+between requests, and the trust map is reloaded when
+``pkix_cd_manage_trust`` publishes a new one.
+
+Settings come from the ``config { ... }`` section of the rlm_python3
+module instance. See ``tests/configs/freeradius/python3`` for an
+example. Settings:
+
+- ``trustmap``: Trust map, provided by pkix_cd_manage_trust. Required.
+- ``live_verify``: ``yes`` to verify directly against DNS, as well.
+- ``require_registry``: ``yes`` to require IoT Registry checks.
+- ``ns_override``: Override system name server.
+- ``registry_cache``, ``registry_cache_max_age``,
+  ``registry_cache_negative_ttl``: As for pkix_cd_verify.
+- ``registry_domains``: As for pkix_cd_verify's ``--registry-domains``.
+- ``live_cache``, ``live_cache_max_age``, ``live_cache_negative_ttl``,
+  ``live_cache_size``, ``live_cache_stale``: As for pkix_cd_verify's
+  ``--live-verify-cache`` options.
+- ``dns_pool``: ``tcp`` or ``tls``, as for pkix_cd_verify's ``--dns-pool``.
+- ``deadline_ms``, ``deadline_policy``, ``deadline_fallback_max_age``,
+  ``parallel_stages``: As for pkix_cd_verify's ``--deadline-ms`` options.
+- ``metrics_log``, ``metrics_statsd``: As for pkix_cd_verify.
+- ``certificate_attribute``: Request attribute holding the client
+  certificate, as PEM. Default: ``TLS-Client-Cert``.
+
+Settings are read once, when the module is instantiated.
+
+The certificate is read from the request, not from
+``TLS-Client-Cert-Filename``: FreeRADIUS deletes that file as soon as
+the EAP-TLS ``verify { client = ... }`` command returns, and keeping a
+copy would cost a command per handshake anyway. Have the EAP-TLS
+configuration keep the client certificate in the request as PEM (as
+``tls_cache_cert``, or your FreeRADIUS version's equivalent, does), and
+set ``certificate_attribute`` to match.
+
+Call the module from one section only, the ``authorize`` section of the
+EAP-TLS ``virtual_server`` (e.g. check-eap-tls). The Calling identity is
+taken from ``User-Name``, and the SSID from ``Called-Station-Id``, as
+for the ``client =`` hook.
+"""
+import functools
+
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.verifier import Verifier
+
+try:
+    import radiusd
+except ImportError:
+    # Only available when running inside FreeRADIUS.
+    radiusd = None
+
+
+# Values from FreeRADIUS' rlm_python3 radiusd module.
+RLM_MODULE_REJECT = getattr(radiusd, "RLM_MODULE_REJECT", 0)
+RLM_MODULE_FAIL = getattr(radiusd, "RLM_MODULE_FAIL", 1)
+RLM_MODULE_OK = getattr(radiusd, "RLM_MODULE_OK", 2)
+RLM_MODULE_INVALID = getattr(radiusd, "RLM_MODULE_INVALID", 4)
+L_AUTH = getattr(radiusd, "L_AUTH", 2)
+L_INFO = getattr(radiusd, "L_INFO", 3)
+L_ERR = getattr(radiusd, "L_ERR", 4)
+
+# pkix_cd_verify exit code to module return code. Anything else fails.
+RESULT_CODES = {Verifier.EXIT_OK: RLM_MODULE_OK,
+                Verifier.EXIT_MISSING_CERTIFICATE: RLM_MODULE_INVALID,
+                Verifier.EXIT_INVALID_CALLED_STATION: RLM_MODULE_REJECT,
+                Verifier.EXIT_CERT_HASH_MISMATCH: RLM_MODULE_REJECT,
+                Verifier.EXIT_LIVE_VERIFY_FAILED: RLM_MODULE_REJECT,
+                Verifier.EXIT_REGISTRY_FAILED: RLM_MODULE_REJECT}
+
+DEFAULT_CERTIFICATE_ATTRIBUTE = "TLS-Client-Cert"
+
+settings = {}
+verifiers = {}
+
+
+def log(level, message):
+    """Log through FreeRADIUS, or print when running outside of it."""
+    if radiusd is None:
+        print(message)
+    else:
+        radiusd.radlog(level, "pkix_cd: {}".format(message))
+
+
+def get_settings(config=None):
+    """Return module settings, from the rlm_python3 ``config`` section.
+
+    Args:
+        config (dict): Settings, as strings. Default: ``radiusd.config``.
+
+    Raise:
+        ValueError if ``trustmap`` is not set.
+    """
+    if config is None:
+        config = getattr(radiusd, "config", {})
+    if not config.get("trustmap"):
+        raise ValueError("The trustmap setting is required.")
+
+    def flag(name):
+        return str(config.get(name, "no")).lower() in ["yes", "true", "1"]
+    return {"trustmap": config["trustmap"],
+            "live_verify": flag("live_verify"),
+            "require_registry": flag("require_registry"),
+            "ns_override": config.get("ns_override") or None,
+            "certificate_attribute": config.get("certificate_attribute", DEFAULT_CERTIFICATE_ATTRIBUTE),
+            "options": {"registry_cache": config.get("registry_cache") or None,
+                        "registry_cache_max_age": int(config.get("registry_cache_max_age", 3600)),
+                        "registry_cache_negative_ttl": int(config.get("registry_cache_negative_ttl", 60)),
+                        "registry_domains": config.get("registry_domains") or None,
+                        "live_cache": config.get("live_cache") or None,
+                        "live_cache_max_age": int(config.get("live_cache_max_age", 3600)),
+                        "live_cache_negative_ttl": int(config.get("live_cache_negative_ttl", 60)),
+                        "live_cache_size": int(config.get("live_cache_size", 10000)),
+                        "live_cache_stale": int(config.get("live_cache_stale", 0)),
+                        "dns_pool": config.get("dns_pool") or None,
+                        "deadline_ms": int(config.get("deadline_ms", 0)) or None,
+                        "deadline_policy": config.get("deadline_policy", "fail-closed"),
+                        "deadline_fallback_max_age": int(config.get("deadline_fallback_max_age", 86400)),
+                        "parallel_stages": flag("parallel_stages"),
+                        "metrics_log": config.get("metrics_log") or None,
+                        "metrics_statsd": config.get("metrics_statsd") or None}}
+
+
+def get_verifier(settings):
+    """Return the resident Verifier for ``settings``, creating it if needed."""
+    key = (settings["trustmap"], tuple(sorted(settings["options"].items())))
+    if key not in verifiers:
+        verifiers[key] = Verifier(settings["trustmap"], **settings["options"])
+    return verifiers[key]
+
+
+@functools.lru_cache(maxsize=1024)
+def get_certificate(cert_pem):
+    """Return a CertificateContext for ``cert_pem``, shared between requests."""
+    return CertificateContext(cert_pem)
+
+
+def get_attributes(request):
+    """Return request attributes as a dict.
+
+    rlm_python3 passes attributes as a tuple of (name, value) pairs,
+    with string values wrapped in double quotes.
+    """
+    attributes = {}
+    for name, value in request or ():
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        attributes[name] = value
+    return attributes
+
+
+def authorize_request(request, settings):
+    """Authorize one request, returning an exit code and messages.
+
+    Args:
+        request (tuple): Request attributes, as passed by rlm_python3.
+        settings (dict): As returned by :func:`get_settings`.
+
+    Return:
+        int: One of the ``Verifier.EXIT_*`` codes.
+        list: Human-readable messages explaining the outcome.
+    """
+    attributes = get_attributes(request)
+    called = attributes.get("Called-Station-Id", "")
+    calling = attributes.get("User-Name", "")
+    certificate = attributes.get(settings["certificate_attribute"], "")
+    if "-----BEGIN" not in certificate:
+        return Verifier.EXIT_MISSING_CERTIFICATE, [
+            "No PEM certificate in {}!".format(settings["certificate_attribute"])]
+    return get_verifier(settings).verify(called, calling, get_certificate(certificate.replace("\\n", "\n")),
+                                         settings["live_verify"], settings["require_registry"],
+                                         settings["ns_override"])
+
+
+def instantiate(p):
+    """Read settings, and load the trust map before the first request."""
+    try:
+        settings.clear()
+        settings.update(get_settings())
+        get_verifier(settings).load_trust_map()
+    except FileNotFoundError as err:
+        log(L_INFO, "Trust map not found: {}! Will retry on first request.".format(err.filename))
+    except ValueError as err:
+        log(L_ERR, str(err))
+        return -1
+    return 0
+
+
+def authorize(p):
+    """Authorize the request against the trust map and PKIX-CD."""
+    try:
+        code, messages = authorize_request(p, settings)
+    except Exception as err:
+        # An unhandled exception in pkix_cd_verify exits with 1.
+        code, messages = Verifier.EXIT_MISSING_TRUST_MAP, ["Unexpected error: {}".format(err)]
+    for message in messages:
+        log(L_AUTH, message)
+    return RESULT_CODES.get(code, RLM_MODULE_FAIL)
+
+
+def detach(p):
+    """Drop resident state."""
+    settings.clear()
+    verifiers.clear()
+    get_certificate.cache_clear()
+    return RLM_MODULE_OK
@@ -1,10 +1,15 @@
 """Manage trust map and CA bundle for RADIUS server."""
 import argparse
+import contextlib
 
-from dane_discovery.identity import Identity
-from dane_discovery.pki import PKI
-from dane_discovery.dane import DANE
-
+from radius_pkix_cd import metrics
+from radius_pkix_cd.ca_directory import CADirectory
+from radius_pkix_cd.discovery import Discovery
+from radius_pkix_cd.discovery_cache import DiscoveryCache
+from radius_pkix_cd.domain_policy import DomainPolicy
+from radius_pkix_cd.dns_snapshot import DNSSnapshot
+from radius_pkix_cd.resolver_pool import ResolverPool
+from radius_pkix_cd.trust_journal import TrustJournal
 from radius_pkix_cd.utility import Utility
 
 
@@ -14,46 +19,121 @@ description=("Manage trust map for radius_pkix_cd tool.\n"
              "...where CalledStation is the Called-Station-Id and "
              "my._device.example.com is the name of the "
              "device allowed to access the Called-Station-Id. "
-             "Devices may be associated with multiple CalledStations.")
+             "Devices may be associated with multiple CalledStations. "
+             "CalledStation|*._device.example.com grants every device under "
+             "_device.example.com, checked against DNS at authentication time.")
 
 parser = argparse.ArgumentParser(description=description)
-parser.add_argument("--infile", dest="infile", required=True, help="Network access list.")
+parser.add_argument("--infile", dest="infile", required=True, nargs="+",
+                    help="Network access list. May be several files, or - for stdin.")
 parser.add_argument("--trustmap", dest="trustmap", required=True, help="Trust map (outfile) for pkix_cd_verify.")
 parser.add_argument("--cacerts", dest="cacerts", required=True, help="Outfile for CA certificates.")
+parser.add_argument("--trustindex", dest="trustindex", required=False,
+                    help="Optional outfile for the compiled trust map index.")
+parser.add_argument("--trustshards", dest="trustshards", required=False,
+                    help="Optional directory for the trust map, split into one file per realm.")
+parser.add_argument("--cadir", dest="cadir", required=False,
+                    help="Optional OpenSSL hashed CA directory (c_rehash style) to keep in sync with --cacerts.")
+parser.add_argument("--journal", dest="journal", required=False, action="store_true",
+                    help="Record what changed in each generation in TRUSTMAP.journal.")
+parser.add_argument("--journal-max-entries", dest="journal_max_entries", required=False, type=int,
+                    help="Number of generations to keep in the journal.")
 parser.add_argument("--ns_override", dest="ns_override", required=False, help="Override system name server.")
+parser.add_argument("--concurrency", dest="concurrency", required=False, type=int,
+                    help="Maximum number of identities to discover at the same time.")
+parser.add_argument("--discovery-cache", dest="discovery_cache", required=False,
+                    help="Cache discovery results here, and only re-query expired identities.")
+parser.add_argument("--cache-max-ttl", dest="cache_max_ttl", required=False, type=int,
+                    help="Maximum seconds to trust a cached discovery result.")
+snapshot_group = parser.add_mutually_exclusive_group()
+snapshot_group.add_argument("--dns-record", dest="dns_record", required=False,
+                            help="Record every DNS and CA certificate lookup into this snapshot file.")
+snapshot_group.add_argument("--dns-replay", dest="dns_replay", required=False,
+                            help="Answer DNS and CA certificate lookups from this snapshot file, offline.")
+parser.add_argument("--dns-pool", dest="dns_pool", required=False, choices=["tcp", "tls"],
+                    help=("Keep TCP or DNS-over-TLS connections to the name server open between lookups, "
+                          "pipeline TLSA queries, and cache responses for their TTL."))
+parser.add_argument("--metrics-log", dest="metrics_log", required=False,
+                    help="Append a JSON line of timings and counters for this run here. Use - for stderr.")
+parser.add_argument("--metrics-statsd", dest="metrics_statsd", required=False,
+                    help="Send timings and counters to this statsd server, as host:port.")
+parser.set_defaults(trustindex=None)
+parser.set_defaults(cadir=None)
+parser.set_defaults(trustshards=None)
+parser.set_defaults(journal=False)
+parser.set_defaults(journal_max_entries=1000)
+parser.set_defaults(metrics_log=None)
+parser.set_defaults(metrics_statsd=None)
+parser.set_defaults(dns_record=None)
+parser.set_defaults(dns_replay=None)
+parser.set_defaults(dns_pool=None)
+parser.set_defaults(discovery_cache=None)
+parser.set_defaults(cache_max_ttl=86400)
+parser.set_defaults(concurrency=8)
 parser.set_defaults(ns_override=None)
 
 
 def main():
     """Wrap the process of managing the trust map and CA certs files."""
     args = parser.parse_args()
-    trust_map = Utility.get_authz_config(args.infile)
-    configured_trust = {}
-    ca_certificates = set([])
-    for dnsname, realms in trust_map.items():
-        for realm in realms:
-            if realm not in configured_trust:
-                configured_trust[realm] = {dnsname: {}}
-            else:
-                if not dnsname in configured_trust[realm]:
-                    configured_trust[realm][dnsname] = {}
-        identity = Identity(dnsname, None, args.ns_override)
-        akis = []
-        cert_hashes = []
-        try:
-            for _, cert in identity.get_all_certificates(filters=["PKIX-CD"]).items():
-                akis.append(PKI.get_authority_key_id_from_certificate(cert))
-                ca_certificates.add(identity.get_pkix_cd_trust_chain(cert)["root"])
-                cert_hashes.append(DANE.generate_sha_by_selector(cert, "sha256", 0))
-            configured_trust[realm][dnsname]["akis"] = akis
-            configured_trust[realm][dnsname]["cert_hashes"] = cert_hashes
-        except (ValueError, KeyError) as err:
-            print("Recoverable error: {}".format(err))
-            print("Continuing...")
-            continue
-    if Utility.update_trust_store_file(args.trustmap, configured_trust):
+    exporters = metrics.get_exporters(args.metrics_log, args.metrics_statsd)
+    operation = metrics.start(exporters, "manage_trust")
+    with operation.activate(process_wide=True):
+        manage_trust(args, operation)
+    if exporters:
+        operation.finish(0)
+        metrics.export(exporters, operation)
+
+
+def manage_trust(args, operation):
+    """Refresh the trust store, timing each stage in ``operation``."""
+    with operation.stage("read_access_list"):
+        trust_map = Utility.get_authz_config(args.infile)
+    operation.incr("identities", len(trust_map))
+    cache = None
+    if args.discovery_cache and args.dns_record:
+        # Cache hits would be missing from the snapshot.
+        print("Ignoring --discovery-cache while recording a DNS snapshot.")
+    elif args.discovery_cache:
+        cache = DiscoveryCache(args.discovery_cache, args.cache_max_ttl)
+    pool = contextlib.nullcontext()
+    if args.dns_pool and not args.dns_replay:
+        pool = ResolverPool(args.dns_pool).intercept()
+    # Subtree grants have nothing to discover; they're checked with live verify.
+    dnsnames = [x for x in trust_map if not DomainPolicy.is_wildcard(x)]
+    with pool as resolvers:
+        # Inside the pool, so that a recording captures the pool's answers.
+        snapshot = contextlib.nullcontext()
+        if args.dns_record:
+            snapshot = DNSSnapshot(args.dns_record).record()
+        elif args.dns_replay:
+            snapshot = DNSSnapshot.load(args.dns_replay).replay()
+        with snapshot as recording, operation.stage("discovery"):
+            discovered = Discovery.discover_all(dnsnames, args.ns_override, args.concurrency, cache,
+                                                resolvers)
+    if args.dns_record:
+        recording.save()
+        print("Recorded DNS snapshot at {}".format(args.dns_record))
+    if cache is not None:
+        cache.save()
+    with operation.stage("build_trust_map"):
+        configured_trust, ca_certificates = Discovery.build_trust_map(trust_map, discovered)
+    if args.cadir:
+        # Before the trust map, so that new roots are in place first.
+        with operation.stage("cadir"):
+            added, removed = CADirectory(args.cadir).sync(sorted(ca_certificates))
+        if added or removed:
+            print("Updated CA directory {}: {} added, {} removed.".format(args.cadir, added, removed))
+    journal = None
+    if args.journal:
+        journal = TrustJournal(TrustJournal.get_path(args.trustmap), args.journal_max_entries)
+    with operation.stage("publish"):
+        updated = Utility.publish_trust_store(args.trustmap, args.cacerts, configured_trust,
+                                              sorted(ca_certificates), journal, args.trustindex,
+                                              args.trustshards)
+    operation.incr("updated", int(updated))
+    if updated:
         print("Updated trust store file.")
-        Utility.update_ca_file(args.cacerts, [x for x in ca_certificates])
     else:
         print("No update to trust store file.")
 
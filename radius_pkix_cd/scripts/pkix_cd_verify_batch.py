@@ -0,0 +1,82 @@
+"""Authorize many supplicants at once, to audit active sessions."""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+
+from radius_pkix_cd.batch import BatchVerifier
+from radius_pkix_cd.cli import add_verifier_arguments
+from radius_pkix_cd.cli import get_verifier_options
+from radius_pkix_cd.verifier import Verifier
+
+
+description=("Authorize many supplicants against the access configuration, "
+             "with the same checks and exit codes as pkix_cd_verify.\n"
+             "Infile format is one JSON object per line:\n"
+             "{\"called\": \"MAC:SSID\", \"calling\": \"my._device.example.com\", "
+             "\"certfile\": \"/path/to/cert.pem\"}\n"
+             "...where cert_pem may be given in place of certfile, and an "
+             "optional id is copied to the result. One JSON result is written "
+             "per record, in order, with the record's exit code. Exits 1 "
+             "if any record failed.")
+
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument("--infile", dest="infile", required=False,
+                    help="Records to verify. Use - for stdin.")
+parser.add_argument("--outfile", dest="outfile", required=False,
+                    help="Results. Use - for stdout.")
+add_verifier_arguments(parser)
+parser.add_argument("--concurrency", dest="concurrency", required=False, type=int,
+                    help="Maximum number of records to verify at the same time.")
+parser.add_argument("--dns-replay", dest="dns_replay", required=False,
+                    help="Answer live DNS checks from this snapshot file, recorded by pkix_cd_manage_trust.")
+parser.set_defaults(infile="-")
+parser.set_defaults(outfile="-")
+parser.set_defaults(concurrency=8)
+parser.set_defaults(dns_replay=None)
+
+
+def main():
+    """Verify every record, and report a count of each exit code on stderr.
+
+    Exit with 1 if any record failed, so a scheduled audit can alert on it.
+    """
+    args = parser.parse_args()
+    snapshot = contextlib.nullcontext()
+    if args.dns_replay:
+        # Imported here, so verifies without a snapshot don't load DNS libraries.
+        from radius_pkix_cd.dns_snapshot import DNSSnapshot
+        try:
+            snapshot = DNSSnapshot.load(args.dns_replay).replay()
+        except (FileNotFoundError, ValueError) as err:
+            print("Unable to load DNS snapshot: {}".format(err), file=sys.stderr)
+            sys.exit(1)
+    with contextlib.ExitStack() as stack:
+        # Without shared caches, still look up each registry entry and
+        # identity only once in this run.
+        options = get_verifier_options(args)
+        scratch = stack.enter_context(tempfile.TemporaryDirectory())
+        for cache in ["registry_cache", "live_cache"]:
+            options[cache] = options[cache] or os.path.join(scratch, "{}.sqlite".format(cache))
+        infile = sys.stdin
+        if args.infile != "-":
+            infile = stack.enter_context(open(args.infile))
+        outfile = sys.stdout
+        if args.outfile != "-":
+            outfile = stack.enter_context(open(args.outfile, "w"))
+        batch = BatchVerifier(Verifier(args.trustmap, **options), args.live_verify,
+                              args.require_registry, args.ns_override, args.concurrency,
+                              options["live_cache_size"])
+        # Diagnostics printed while verifying would corrupt results on stdout.
+        with snapshot, contextlib.redirect_stdout(sys.stderr):
+            counts = batch.run(infile, outfile)
+    summary = ", ".join("{}: {}".format(k, v) for k, v in sorted(counts.items()))
+    print("Verified {} records. Exit codes: {}".format(sum(counts.values()), summary or "none"),
+          file=sys.stderr)
+    if set(counts) - {Verifier.EXIT_OK}:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Thin client for the pkix_cd_verify service.
+
+Accepts the same arguments and exits with the same codes as
+pkix_cd_verify, but hands the work to pkix_cd_verify_daemon, which
+verifies as configured on its own command line. If the service can't
+be reached, or refuses because it was started with other checks,
+verification runs in-process instead, as the arguments say.
+"""
+import argparse
+import sys
+
+from radius_pkix_cd.cli import add_verify_arguments
+from radius_pkix_cd.cli import get_checks
+from radius_pkix_cd.cli import get_verifier_options
+from radius_pkix_cd.service import CHECKS_FIELD
+from radius_pkix_cd.service import DEFAULT_SOCKET_PATH
+from radius_pkix_cd.service import REFUSED_FIELD
+from radius_pkix_cd.service import TRUSTMAP_FIELD
+from radius_pkix_cd.service import send_request
+
+
+description=("Authorize supplicants via the pkix_cd_verify_daemon service. "
+             "Arguments and exit codes match pkix_cd_verify.")
+
+parser = argparse.ArgumentParser(description=description)
+add_verify_arguments(parser)
+parser.add_argument("--socket", dest="socket", required=False,
+                    help="Path to the pkix_cd_verify_daemon socket.")
+parser.add_argument("--socket-timeout", dest="socket_timeout", required=False, type=float,
+                    help="Seconds to wait for the verify service.")
+parser.set_defaults(socket=DEFAULT_SOCKET_PATH)
+parser.set_defaults(socket_timeout=10.0)
+
+
+def verify_in_process(args, cert_pem):
+    """Fall back to verifying without the service."""
+    from radius_pkix_cd.verifier import Verifier
+    verifier = Verifier(args.trustmap, **get_verifier_options(args))
+    return verifier.verify(args.called, args.calling, cert_pem,
+                           args.live_verify, args.require_registry,
+                           args.ns_override)
+
+
+def main():
+    """Ask the verify service for a verdict and exit accordingly."""
+    args = parser.parse_args()
+    # Load the presented certificate or bail.
+    try:
+        with open(args.certfile) as f_on_disk:
+            cert_pem = f_on_disk.read()
+    except FileNotFoundError:
+        print("Certificate file not found: {}!".format(args.certfile))
+        sys.exit(2)
+
+    # The service refuses to verify with other checks than its own.
+    request = {"called": args.called, "calling": args.calling,
+               "cert_pem": cert_pem, TRUSTMAP_FIELD: args.trustmap,
+               CHECKS_FIELD: get_checks(args)}
+    try:
+        response = send_request(args.socket, request, args.socket_timeout)
+        if REFUSED_FIELD in response:
+            print("Verify service refused: {}, verifying in-process.".format(response[REFUSED_FIELD]))
+            code, messages = verify_in_process(args, cert_pem)
+        else:
+            code, messages = response["code"], response["messages"]
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("Verify service not available at {}, verifying in-process.".format(args.socket))
+        code, messages = verify_in_process(args, cert_pem)
+    except (OSError, ValueError, KeyError) as err:
+        print("Verify service error: {}".format(err))
+        sys.exit(1)
+    for message in messages:
+        print(message)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Long-running verify service for pkix_cd_verify_client."""
+import argparse
+import contextlib
+import json
+import os
+import socketserver
+
+from radius_pkix_cd.cli import add_policy_arguments
+from radius_pkix_cd.cli import get_checks
+from radius_pkix_cd.cli import get_verifier_options
+from radius_pkix_cd.dns_snapshot import DNSSnapshot
+from radius_pkix_cd.service import CHECKS_FIELD
+from radius_pkix_cd.service import DEFAULT_CHECKS
+from radius_pkix_cd.service import DEFAULT_SOCKET_PATH
+from radius_pkix_cd.service import REFUSED_FIELD
+from radius_pkix_cd.service import REQUEST_FIELDS
+from radius_pkix_cd.service import TRUSTMAP_FIELD
+from radius_pkix_cd.service import decode_message
+from radius_pkix_cd.service import encode_message
+from radius_pkix_cd.verifier import Verifier
+
+
+description=("Serve pkix_cd_verify requests over a Unix socket. "
+             "Trust maps are parsed once and kept in memory, and "
+             "reloaded when pkix_cd_manage_trust publishes a new one. "
+             "Checks and caches are set here, for all requests; clients "
+             "send the supplicant's details, and requests for other "
+             "checks are refused, so the client verifies them itself. "
+             "Point the Freeradius EAP-TLS verify client at "
+             "pkix_cd_verify_client to use this service.")
+
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument("--socket", dest="socket", required=False,
+                    help="Path for the service's Unix socket.")
+parser.add_argument("--socket-mode", dest="socket_mode", required=False,
+                    help="Permissions for the socket, in octal.")
+parser.add_argument("--trustmap", dest="trustmap", required=True, action="append",
+                    help="Trust map to serve, provided by pkix_cd_manage_trust. May be used more than once.")
+parser.add_argument("--dns-replay", dest="dns_replay", required=False,
+                    help="Answer live DNS checks from this snapshot file, recorded by pkix_cd_manage_trust.")
+add_policy_arguments(parser)
+parser.set_defaults(socket=DEFAULT_SOCKET_PATH)
+parser.set_defaults(socket_mode="660")
+parser.set_defaults(dns_replay=None)
+
+
+class VerifyRequestHandler(socketserver.StreamRequestHandler):
+    """Handle one verification request per connection."""
+
+    def handle(self):
+        """Read a request, verify it, and write the response."""
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = decode_message(line)
+            missing = [x for x in REQUEST_FIELDS if x not in request]
+            if missing:
+                raise ValueError("Missing fields: {}".format(", ".join(missing)))
+            verifier = self.server.get_verifier(request.get(TRUSTMAP_FIELD))
+            checks = dict(DEFAULT_CHECKS, **request[CHECKS_FIELD])
+            if checks != self.server.checks:
+                # Verifying with our checks could pass what the client's would fail.
+                reason = "Requested checks {} are not the service's {}".format(
+                    json.dumps(checks, sort_keys=True), json.dumps(self.server.checks, sort_keys=True))
+                self.wfile.write(encode_message({REFUSED_FIELD: reason}))
+                return
+            code, messages = verifier.verify(request["called"], request["calling"],
+                                             request["cert_pem"], **self.server.checks)
+        except Exception as err:
+            # An unhandled exception in pkix_cd_verify exits with 1.
+            code, messages = 1, ["Verify service error: {}".format(err)]
+        self.wfile.write(encode_message({"code": code, "messages": messages}))
+
+
+class VerifyServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded Unix socket server holding one Verifier per trust map it serves."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, trustmaps, options=None, checks=None,
+                 handler_class=VerifyRequestHandler, replaying=False):
+        """Bind to ``socket_path``, replacing a stale socket if present.
+
+        Args:
+            trustmaps (list): Trust maps to serve, provided by
+                pkix_cd_manage_trust. Requests for others are refused.
+            options (dict): Keyword arguments for Verifier, as returned
+                by radius_pkix_cd.cli.get_verifier_options.
+            checks (dict): Keyword arguments for Verifier.verify, as
+                returned by radius_pkix_cd.cli.get_checks. Requests
+                for other checks are refused.
+            replaying (bool): Live checks are answered from a DNS
+                snapshot, so the resolver pool option is ignored.
+        """
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        options = dict(options or {})
+        if replaying:
+            # Installing the pool would replace the snapshot's answers.
+            options["dns_pool"] = None
+        self.verifiers = {x: Verifier(x, **options) for x in trustmaps}
+        self.checks = dict(DEFAULT_CHECKS, **(checks or {}))
+        super().__init__(socket_path, handler_class)
+
+    def get_verifier(self, trustmap_path=None):
+        """Return the Verifier for ``trustmap_path``.
+
+        Args:
+            trustmap_path (str): One of the trust maps served. Default:
+                the only one, if just one is served.
+
+        Raise:
+            ValueError if the trust map isn't served.
+        """
+        if trustmap_path is None and len(self.verifiers) == 1:
+            return list(self.verifiers.values())[0]
+        if trustmap_path not in self.verifiers:
+            raise ValueError("Trust map not served: {}".format(trustmap_path))
+        return self.verifiers[trustmap_path]
+
+    def server_close(self):
+        """Close the server and remove the socket file."""
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def main():
+    """Run the verify service until interrupted."""
+    args = parser.parse_args()
+    snapshot = contextlib.nullcontext()
+    if args.dns_replay:
+        snapshot = DNSSnapshot.load(args.dns_replay).replay()
+    server = VerifyServer(args.socket, args.trustmap, get_verifier_options(args),
+                          get_checks(args), replaying=bool(args.dns_replay))
+    os.chmod(args.socket, int(args.socket_mode, 8))
+    for trustmap, verifier in server.verifiers.items():
+        try:
+            verifier.load_trust_map()
+        except FileNotFoundError:
+            print("Trust map not found: {}! Will retry on first request.".format(trustmap))
+    print("Listening on {}".format(args.socket))
+    try:
+        with snapshot:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
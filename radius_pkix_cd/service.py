@@ -0,0 +1,74 @@
+"""Wire protocol for the pkix_cd_verify service.
+
+Requests and responses are single lines of JSON, exchanged over a
+Unix stream socket. This module only depends on the standard library,
+so the thin client stays cheap to start.
+"""
+import json
+import socket
+
+
+DEFAULT_SOCKET_PATH = "/var/run/radius_pkix_cd/verify.sock"
+
+# The checks the client was asked for, as returned by
+# radius_pkix_cd.cli.get_checks. How to verify, checks and caches alike,
+# is set on the pkix_cd_verify_daemon command line, and the daemon
+# refuses requests for other checks rather than verify more loosely.
+CHECKS_FIELD = "checks"
+
+REQUEST_FIELDS = ["called", "calling", "cert_pem", CHECKS_FIELD]
+
+# Checks left out of a request's CHECKS_FIELD, or the daemon's command line.
+DEFAULT_CHECKS = {"live_verify": False, "require_registry": False, "ns_override": None}
+
+# Response field, instead of ``code`` and ``messages``, when the daemon
+# refuses a request. The client then verifies in-process.
+REFUSED_FIELD = "refused"
+
+# Optional request field: which of the daemon's trust maps to verify against.
+TRUSTMAP_FIELD = "trustmap"
+
+
+def encode_message(message):
+    """Return a message dict encoded for the wire."""
+    return json.dumps(message).encode() + b"\n"
+
+
+def decode_message(line):
+    """Return a message dict decoded from a line read off the wire.
+
+    Raise:
+        ValueError if the line is not a JSON object.
+    """
+    message = json.loads(line)
+    if not isinstance(message, dict):
+        raise ValueError("Expected a JSON object, got {}".format(type(message).__name__))
+    return message
+
+
+def send_request(socket_path, request, timeout=None):
+    """Send one verification request to the service.
+
+    Args:
+        socket_path (str): Path to the service's Unix socket.
+        request (dict): Keys are listed in ``REQUEST_FIELDS``, plus
+            the optional ``TRUSTMAP_FIELD``.
+        timeout (float): Seconds to wait for the service. Default: no timeout.
+
+    Raise:
+        OSError if the service can not be reached.
+        ValueError if the service sends back garbage.
+
+    Return:
+        dict: Keys are ``code`` (int) and ``messages`` (list of str),
+            or ``REFUSED_FIELD`` (str) with the reason for refusing.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(encode_message(request))
+        with sock.makefile("rb") as reader:
+            line = reader.readline()
+    if not line:
+        raise ValueError("Verify service closed the connection without responding.")
+    return decode_message(line)
@@ -0,0 +1,170 @@
+"""Trust map split into one file per realm.
+
+A verifier only needs the part of the trust map for the SSID in the
+Called-Station-Id. With the sharded layout, that's the only part it
+reads. The layout is a directory::
+
+    manifest.json    {"version": 1, "generation": 3,
+                      "shards": {"SSID1": {"file": "0123456789abcdef-fedcba9876543210.json",
+                                           "sha256": "..."}}}
+    0123456789abcdef-fedcba9876543210.json
+                     {"my._device.example": {"akis": [...], "cert_hashes": [...]}}
+
+Shard files are named for a hash of the realm, so any SSID makes a safe
+file name, and for a hash of their contents, so a shard file is never
+overwritten. New shards are written first, and the manifest last, so
+replacing the manifest switches every shard to the new generation at
+once. Shards only the previous generation uses are kept until the next
+one, for verifiers still reading that generation's manifest.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from radius_pkix_cd.domain_policy import DomainPolicy
+from radius_pkix_cd.utility import Utility
+
+
+class ShardedTrustMap:
+    """Query a sharded trust map, loading each realm's shard on first use."""
+
+    version = 1
+    manifest_name = "manifest.json"
+
+    def __init__(self, path):
+        """Read the manifest of the sharded trust map at ``path``.
+
+        Raise:
+            FileNotFoundError if there is no manifest.
+            ValueError if the manifest can't be parsed.
+        """
+        self.path = path
+        manifest = self.read_manifest(path, missing_ok=False)
+        self.generation = manifest["generation"]
+        self.shards = manifest["shards"]
+        self.loaded = {}
+        self.grants = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def is_sharded(cls, path):
+        """Return True if ``path`` is a sharded trust map directory."""
+        return os.path.isdir(path)
+
+    @classmethod
+    def get_shard_file_name(cls, realm, digest):
+        """Return the file name of the shard for ``realm``, with contents digest ``digest``."""
+        return "{}-{}.json".format(hashlib.sha256(realm.encode()).hexdigest()[:16], digest[:16])
+
+    @classmethod
+    def read_manifest(cls, path, missing_ok=True):
+        """Return the manifest of the sharded trust map at ``path``.
+
+        Args:
+            missing_ok (bool): Return an empty manifest if there is none.
+
+        Raise:
+            FileNotFoundError if there is no manifest, and not ``missing_ok``.
+            ValueError if the manifest can't be parsed.
+        """
+        try:
+            with open(os.path.join(path, cls.manifest_name)) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get("version") != cls.version or not isinstance(manifest.get("shards"), dict):
+                raise ValueError("Unsupported sharded trust map manifest.")
+        except FileNotFoundError:
+            if not missing_ok:
+                raise
+            return {"version": cls.version, "generation": 0, "shards": {}}
+        except (json.decoder.JSONDecodeError, AttributeError) as err:
+            raise ValueError("Unreadable sharded trust map manifest: {}".format(err))
+        return manifest
+
+    def get_shard(self, realm):
+        """Return the trust map entries for ``realm``, loading them if needed.
+
+        Raise:
+            ValueError if the shard is missing or can't be parsed.
+        """
+        with self.lock:
+            if realm not in self.loaded:
+                shard_path = os.path.join(self.path, self.shards[realm]["file"])
+                try:
+                    with open(shard_path) as shard_file:
+                        shard = json.load(shard_file)
+                except (FileNotFoundError, json.decoder.JSONDecodeError) as err:
+                    raise ValueError("Unreadable trust map shard for {}: {}".format(realm, err))
+                self.grants[realm] = DomainPolicy(x for x in shard if DomainPolicy.is_wildcard(x))
+                self.loaded[realm] = shard
+            return self.loaded[realm]
+
+    def has_realm(self, realm):
+        """Return True if ``realm`` is in the trust map."""
+        return realm in self.shards
+
+    def has_identity(self, realm, identity):
+        """Return True if ``identity`` is allowed access to ``realm``."""
+        return self.has_realm(realm) and identity in self.get_shard(realm)
+
+    def has_subtree_grant(self, realm, identity):
+        """Return True if a subtree grant for ``realm`` covers ``identity``."""
+        if not self.has_realm(realm):
+            return False
+        self.get_shard(realm)
+        try:
+            return self.grants[realm].matches(identity)
+        except ValueError:
+            # Not a DNS name, so no grant covers it.
+            return False
+
+    def has_cert_hash(self, realm, identity, cert_hash):
+        """Return True if ``cert_hash`` is accepted for ``identity`` in ``realm``."""
+        return cert_hash in self.get_cert_hashes(realm, identity)
+
+    def get_cert_hashes(self, realm, identity):
+        """Return the accepted certificate hashes for ``identity`` in ``realm``."""
+        if not self.has_realm(realm):
+            return []
+        return self.get_shard(realm).get(identity, {}).get("cert_hashes", [])
+
+    @classmethod
+    def write(cls, path, trust_map):
+        """Write ``trust_map`` as shards in the directory at ``path``.
+
+        Only shards whose contents changed are written. Shards used by
+        neither this generation nor the previous one are removed.
+
+        Args:
+            path (str): Directory for the sharded trust map.
+            trust_map (dict): As described in
+                :func:`~radius_pkix_cd.utility.Utility.update_trust_store_file`.
+
+        Return:
+            bool: True if anything changed.
+        """
+        os.makedirs(path, exist_ok=True)
+        previous = cls.read_manifest(path)
+        shards = {}
+        for realm, entries in trust_map.items():
+            contents = Utility.serialize_trust_map(entries)
+            digest = Utility.get_digest(contents)
+            shard = {"file": cls.get_shard_file_name(realm, digest), "sha256": digest}
+            shard_path = os.path.join(path, shard["file"])
+            if not os.path.exists(shard_path):
+                Utility.write_file_atomically(shard_path, contents)
+            shards[realm] = shard
+        if shards == previous["shards"] and os.path.exists(os.path.join(path, cls.manifest_name)):
+            return False
+        manifest = {"version": cls.version, "generation": previous["generation"] + 1, "shards": shards}
+        Utility.write_file_atomically(os.path.join(path, cls.manifest_name),
+                                      json.dumps(manifest, sort_keys=True).encode())
+        in_use = set(x["file"] for x in list(shards.values()) + list(previous["shards"].values()))
+        for file_name in os.listdir(path):
+            if file_name.endswith(".json") and file_name != cls.manifest_name and file_name not in in_use:
+                try:
+                    os.unlink(os.path.join(path, file_name))
+                except FileNotFoundError:
+                    pass
+        print("Published sharded trust map generation {} at {}".format(manifest["generation"], path))
+        return True
@@ -0,0 +1,209 @@
+"""Compiled, memory-mappable trust map index.
+
+The index holds the same authorization data as the JSON trust map, laid
+out so that the verifier can ``mmap`` it and answer queries without
+deserializing the whole map. All integers are little-endian.
+
+Layout::
+
+    header       magic, name count, realm count, pair count,
+                 record count, blob offset
+    names        (blob offset, length) for every interned name
+    realms       name id of every realm, sorted by name
+    pairs        (pair key, realm id, identity id), sorted by pair key
+    records      (pair key, SHA-256 digest, realm id, identity id),
+                 sorted by pair key and digest
+    blob         UTF-8 realm and identity names, each stored once
+
+A pair key is the first 8 bytes of SHA-256 over ``realm\\0identity``.
+Pair key collisions are resolved by comparing the interned names.
+"""
+import hashlib
+import mmap
+import struct
+
+from radius_pkix_cd.domain_policy import DomainPolicy
+from radius_pkix_cd.utility import Utility
+
+
+class TrustIndex:
+    """Query a compiled trust map index."""
+
+    MAGIC = b"PKXCDIX1"
+    HEADER = struct.Struct("<8sIIIII")
+    NAME = struct.Struct("<II")
+    REALM = struct.Struct("<I")
+    PAIR = struct.Struct("<8sII")
+    RECORD = struct.Struct("<8s32sII")
+
+    def __init__(self, path):
+        """Map the index at ``path``.
+
+        Raise:
+            FileNotFoundError if the index does not exist.
+            ValueError if the file is not a trust map index.
+        """
+        with open(path, "rb") as f_on_disk:
+            try:
+                self.buffer = mmap.mmap(f_on_disk.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError("Empty trust map index: {}".format(path))
+        if len(self.buffer) < self.HEADER.size:
+            raise ValueError("Truncated trust map index: {}".format(path))
+        (magic, self.name_count, self.realm_count, self.pair_count,
+         self.record_count, self.blob_offset) = self.HEADER.unpack_from(self.buffer, 0)
+        if magic != self.MAGIC:
+            raise ValueError("Not a trust map index: {}".format(path))
+        self.names_offset = self.HEADER.size
+        self.realms_offset = self.names_offset + self.name_count * self.NAME.size
+        self.pairs_offset = self.realms_offset + self.realm_count * self.REALM.size
+        self.records_offset = self.pairs_offset + self.pair_count * self.PAIR.size
+        if (self.records_offset + self.record_count * self.RECORD.size != self.blob_offset
+                or self.blob_offset + self.get_blob_length() != len(self.buffer)):
+            raise ValueError("Corrupt trust map index: {}".format(path))
+        # Realms are few, so we decode them once up front.
+        self.realms = {}
+        for position in range(self.realm_count):
+            name_id, = self.REALM.unpack_from(self.buffer, self.realms_offset
+                                              + position * self.REALM.size)
+            self.realms[self.get_name(name_id)] = name_id
+
+    def get_blob_length(self):
+        """Return the blob length implied by the names table."""
+        if not self.name_count:
+            return 0
+        names_end = self.names_offset + self.name_count * self.NAME.size
+        if names_end > len(self.buffer):
+            return len(self.buffer)
+        # Names are appended to the blob in order, so the last one ends it.
+        offset, length = self.NAME.unpack_from(self.buffer, names_end - self.NAME.size)
+        return offset + length
+
+    @classmethod
+    def is_trust_index(cls, path):
+        """Return True if the file at ``path`` starts with the index magic."""
+        with open(path, "rb") as f_on_disk:
+            return f_on_disk.read(len(cls.MAGIC)) == cls.MAGIC
+
+    @classmethod
+    def pair_key(cls, realm, identity):
+        """Return the 8-byte lookup key for a realm and identity."""
+        return hashlib.sha256("{}\0{}".format(realm, identity).encode()).digest()[:8]
+
+    def get_name(self, name_id):
+        """Return the interned name for ``name_id``."""
+        offset, length = self.NAME.unpack_from(self.buffer, self.names_offset
+                                               + name_id * self.NAME.size)
+        start = self.blob_offset + offset
+        return self.buffer[start:start + length].decode()
+
+    def has_realm(self, realm):
+        """Return True if ``realm`` is in the index."""
+        return realm in self.realms
+
+    def has_identity(self, realm, identity):
+        """Return True if ``identity`` is allowed access to ``realm``."""
+        key = self.pair_key(realm, identity)
+        return any(self.names_match(realm, identity, realm_id, identity_id)
+                   for _, realm_id, identity_id
+                   in self.scan(self.pairs_offset, self.pair_count, self.PAIR, key))
+
+    def has_subtree_grant(self, realm, identity):
+        """Return True if a subtree grant for ``realm`` covers ``identity``.
+
+        Subtree grants are stored as ordinary ``*.domain`` identities, so
+        this looks up each domain above ``identity``, one per label.
+        """
+        if realm not in self.realms:
+            return False
+        return any(self.has_identity(realm, x) for x in DomainPolicy.get_wildcards(identity))
+
+    def has_cert_hash(self, realm, identity, cert_hash):
+        """Return True if ``cert_hash`` is accepted for ``identity`` in ``realm``.
+
+        Args:
+            cert_hash (str): Hex-encoded SHA-256 of the certificate.
+        """
+        try:
+            digest = bytes.fromhex(cert_hash)
+        except ValueError:
+            return False
+        key = self.pair_key(realm, identity) + digest
+        return any(self.names_match(realm, identity, realm_id, identity_id)
+                   for _, _, realm_id, identity_id
+                   in self.scan(self.records_offset, self.record_count, self.RECORD, key))
+
+    def names_match(self, realm, identity, realm_id, identity_id):
+        """Return True if the interned names match ``realm`` and ``identity``."""
+        return (self.realms.get(realm) == realm_id
+                and self.get_name(identity_id) == identity)
+
+    def scan(self, offset, count, entry, key):
+        """Yield every entry in a sorted table whose leading bytes equal ``key``."""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            start = offset + middle * entry.size
+            if self.buffer[start:start + len(key)] < key:
+                low = middle + 1
+            else:
+                high = middle
+        while low < count:
+            start = offset + low * entry.size
+            if self.buffer[start:start + len(key)] != key:
+                break
+            yield entry.unpack_from(self.buffer, start)
+            low += 1
+
+    @classmethod
+    def build(cls, trust_map):
+        """Return the compiled index for ``trust_map`` as bytes.
+
+        Args:
+            trust_map (dict): Trust map, as described in
+                :func:`~radius_pkix_cd.utility.Utility.update_trust_store_file`.
+        """
+        name_ids = {}
+        blob = bytearray()
+        names = bytearray()
+
+        def intern(name):
+            if name not in name_ids:
+                encoded = name.encode()
+                name_ids[name] = len(name_ids)
+                names.extend(cls.NAME.pack(len(blob), len(encoded)))
+                blob.extend(encoded)
+            return name_ids[name]
+
+        realms = []
+        pairs = []
+        records = []
+        for realm in sorted(trust_map):
+            realm_id = intern(realm)
+            realms.append(cls.REALM.pack(realm_id))
+            for identity, trust in trust_map[realm].items():
+                if DomainPolicy.is_wildcard(identity):
+                    # Matched against get_wildcards, which lowercases.
+                    identity = identity.lower().rstrip(".")
+                identity_id = intern(identity)
+                key = cls.pair_key(realm, identity)
+                pairs.append(cls.PAIR.pack(key, realm_id, identity_id))
+                for cert_hash in set(trust.get("cert_hashes", [])):
+                    records.append(cls.RECORD.pack(key, bytes.fromhex(cert_hash),
+                                                   realm_id, identity_id))
+        pairs.sort()
+        records.sort()
+        blob_offset = (cls.HEADER.size + len(names) + len(realms) * cls.REALM.size
+                       + len(pairs) * cls.PAIR.size + len(records) * cls.RECORD.size)
+        header = cls.HEADER.pack(cls.MAGIC, len(name_ids), len(realms), len(pairs),
+                                 len(records), blob_offset)
+        return b"".join([header, bytes(names)] + realms + pairs + records + [bytes(blob)])
+
+    @classmethod
+    def write(cls, path, trust_map):
+        """Compile ``trust_map`` and write the index to ``path``.
+
+        The index is written to a temporary file and renamed into place,
+        because a verifier may have the old index mapped.
+        """
+        Utility.write_file_atomically(path, cls.build(trust_map))
@@ -0,0 +1,162 @@
+"""Journal of what changed in each generation of the trust store.
+
+With ``pkix_cd_manage_trust --journal``, each published generation
+appends one JSON line to ``TRUSTMAP.journal``::
+
+    {"generation": 7, "timestamp": 1700000000.0,
+     "trustmap_sha256": "...", "cacerts_sha256": "...",
+     "changes": {"realms_added": ["SSID3"],
+                 "realms_removed": [],
+                 "identities_added": [{"realm": "SSID3", "identity": "my._device.example",
+                                       "akis": [...], "cert_hashes": [...]}],
+                 "identities_removed": [{"realm": "SSID1", "identity": "old._device.example"}],
+                 "identities_changed": [{"realm": "SSID1", "identity": "my._device.example",
+                                         "akis": [...], "cert_hashes": [...],
+                                         "akis_added": [...], "akis_revoked": [...],
+                                         "cert_hashes_added": [...], "cert_hashes_revoked": [...]}],
+                 "ca_roots_added": ["<sha256>"],
+                 "ca_roots_removed": []}}
+
+``changes`` turns generation ``generation - 1`` into ``generation``.
+Added and changed identities carry their complete new entry, so
+applying the same changes twice has no further effect. CA roots are
+identified by the SHA-256 of their DER encoding.
+"""
+import json
+import re
+import time
+
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.utility import Utility
+
+
+class TrustJournal:
+    """Read and append the change journal of a trust map."""
+
+    pem_pattern = re.compile(b"-----BEGIN CERTIFICATE-----.*?-----END CERTIFICATE-----", re.S)
+
+    def __init__(self, path, max_entries=1000):
+        """Initialize with the path to the journal.
+
+        Args:
+            path (str): Path to the journal file.
+            max_entries (int): Number of generations to keep.
+        """
+        self.path = path
+        self.max_entries = max_entries
+
+    @classmethod
+    def get_path(cls, trustmap_path):
+        """Return the path of the journal for a trust map."""
+        return "{}.journal".format(trustmap_path)
+
+    def read(self):
+        """Return the journal entries, oldest first.
+
+        Lines which can't be parsed are skipped.
+        """
+        entries = []
+        try:
+            with open(self.path) as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.decoder.JSONDecodeError:
+                        continue
+                    if isinstance(entry, dict) and isinstance(entry.get("generation"), int):
+                        entries.append(entry)
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def append(self, generation, changes, digests):
+        """Record the changes which produced ``generation``.
+
+        Entries for this or later generations, left from an earlier
+        series of generations, are dropped, as are the oldest entries
+        beyond ``max_entries``. The journal is replaced atomically.
+
+        Args:
+            generation (int): The new generation number.
+            changes (dict): As returned by :func:`get_changes`.
+            digests (dict): Content digests recorded in the manifest.
+        """
+        entries = [x for x in self.read() if x["generation"] < generation]
+        entries.append(dict(digests, generation=generation, timestamp=time.time(), changes=changes))
+        entries = entries[-self.max_entries:]
+        contents = "".join(json.dumps(x, sort_keys=True) + "\n" for x in entries)
+        Utility.write_file_atomically(self.path, contents.encode())
+
+    def get_changes_since(self, generation, until):
+        """Return the changes from ``generation`` up to ``until``, in order.
+
+        Return:
+            list: One ``changes`` dict per generation, or None if the
+                journal doesn't have every generation in the range.
+        """
+        entries = {x["generation"]: x for x in self.read() if generation < x["generation"] <= until}
+        if sorted(entries) != list(range(generation + 1, until + 1)):
+            return None
+        return [entries[x]["changes"] for x in sorted(entries)]
+
+    @classmethod
+    def get_changes(cls, old_trust_map, new_trust_map, old_ca_contents=b"", new_ca_contents=b""):
+        """Return the changes from one generation of the trust store to the next.
+
+        Args:
+            old_trust_map (dict): Previous trust map, as described in
+                :func:`~radius_pkix_cd.utility.Utility.update_trust_store_file`.
+            new_trust_map (dict): New trust map.
+            old_ca_contents (bytes): Previous CA bundle.
+            new_ca_contents (bytes): New CA bundle.
+        """
+        changes = {"realms_added": sorted(set(new_trust_map) - set(old_trust_map)),
+                   "realms_removed": sorted(set(old_trust_map) - set(new_trust_map)),
+                   "identities_added": [], "identities_removed": [], "identities_changed": []}
+        for realm in sorted(set(old_trust_map) | set(new_trust_map)):
+            old_realm = old_trust_map.get(realm, {})
+            new_realm = new_trust_map.get(realm, {})
+            for identity in sorted(set(old_realm) | set(new_realm)):
+                if identity not in new_realm:
+                    changes["identities_removed"].append({"realm": realm, "identity": identity})
+                    continue
+                entry = {"realm": realm, "identity": identity,
+                         "akis": new_realm[identity].get("akis", []),
+                         "cert_hashes": new_realm[identity].get("cert_hashes", [])}
+                if identity not in old_realm:
+                    changes["identities_added"].append(entry)
+                    continue
+                for field in ["akis", "cert_hashes"]:
+                    old_values = set(old_realm[identity].get(field, []))
+                    entry["{}_added".format(field)] = sorted(set(entry[field]) - old_values)
+                    entry["{}_revoked".format(field)] = sorted(old_values - set(entry[field]))
+                if old_realm[identity] != new_realm[identity]:
+                    changes["identities_changed"].append(entry)
+        old_roots = cls.get_ca_fingerprints(old_ca_contents)
+        new_roots = cls.get_ca_fingerprints(new_ca_contents)
+        changes["ca_roots_added"] = sorted(new_roots - old_roots)
+        changes["ca_roots_removed"] = sorted(old_roots - new_roots)
+        return changes
+
+    @classmethod
+    def get_ca_fingerprints(cls, ca_contents):
+        """Return the SHA-256 of each PEM certificate in a CA bundle, as a set."""
+        return set(CertificateContext(x).sha256 for x in cls.pem_pattern.findall(ca_contents))
+
+    @classmethod
+    def apply_changes(cls, trust_map, changes):
+        """Apply ``changes`` to ``trust_map``, in place.
+
+        Each identity's entry is replaced whole, never modified, so
+        readers of the trust map on other threads see either the old
+        entry or the new one.
+        """
+        for realm in changes["realms_removed"]:
+            trust_map.pop(realm, None)
+        for realm in changes["realms_added"]:
+            trust_map.setdefault(realm, {})
+        for entry in changes["identities_removed"]:
+            trust_map.get(entry["realm"], {}).pop(entry["identity"], None)
+        for entry in changes["identities_added"] + changes["identities_changed"]:
+            trust_map.setdefault(entry["realm"], {})[entry["identity"]] = {"akis": entry["akis"],
+                                                                           "cert_hashes": entry["cert_hashes"]}
@@ -0,0 +1,83 @@
+"""Query interface for the JSON trust map."""
+import copy
+import json
+
+from radius_pkix_cd.domain_policy import DomainPolicy
+from radius_pkix_cd.trust_journal import TrustJournal
+
+
+class TrustMap:
+    """Answer authorization questions from a deserialized trust map.
+
+    :class:`~radius_pkix_cd.trust_index.TrustIndex` answers the same
+    questions from the compiled binary index, so the verifier can use
+    either one.
+    """
+
+    def __init__(self, trust_map, grants=None):
+        """Initialize with the trust map.
+
+        Args:
+            trust_map (dict): Trust map, as described in
+                :func:`~radius_pkix_cd.utility.Utility.update_trust_store_file`.
+            grants (DomainPolicy): The trust map's subtree grants, if
+                already known. Default: found in ``trust_map``.
+        """
+        self.trust_map = trust_map
+        self.grants = grants
+        if grants is None:
+            self.grants = DomainPolicy()
+            for realm, identities in trust_map.items():
+                for identity in identities:
+                    if DomainPolicy.is_wildcard(identity):
+                        self.grants.add(identity, realm)
+
+    @classmethod
+    def load(cls, path):
+        """Return a TrustMap for the JSON file at ``path``."""
+        with open(path) as f_on_disk:
+            return cls(json.load(f_on_disk))
+
+    def has_realm(self, realm):
+        """Return True if ``realm`` is in the trust map."""
+        return realm in self.trust_map
+
+    def has_identity(self, realm, identity):
+        """Return True if ``identity`` is allowed access to ``realm``."""
+        return identity in self.trust_map.get(realm, {})
+
+    def has_subtree_grant(self, realm, identity):
+        """Return True if a subtree grant for ``realm`` covers ``identity``."""
+        return realm in self.grants.get_values(identity)
+
+    def has_cert_hash(self, realm, identity, cert_hash):
+        """Return True if ``cert_hash`` is accepted for ``identity`` in ``realm``."""
+        return cert_hash in self.get_cert_hashes(realm, identity)
+
+    def apply_changes(self, changes):
+        """Return a new TrustMap, with one generation's changes from the trust map journal applied.
+
+        This one is left as it is, as other threads may be reading it.
+        Only the realms and subtree grants the changes touch are copied;
+        the rest is shared.
+        """
+        entries = changes["identities_removed"] + changes["identities_added"] + changes["identities_changed"]
+        trust_map = dict(self.trust_map)
+        for realm in {x["realm"] for x in entries}:
+            if realm in trust_map:
+                trust_map[realm] = dict(trust_map[realm])
+        TrustJournal.apply_changes(trust_map, changes)
+        grants = self.grants
+        if [x for x in entries if DomainPolicy.is_wildcard(x["identity"])]:
+            grants = copy.deepcopy(self.grants)
+            for entry in changes["identities_removed"]:
+                if DomainPolicy.is_wildcard(entry["identity"]):
+                    grants.remove(entry["identity"], entry["realm"])
+            for entry in changes["identities_added"]:
+                if DomainPolicy.is_wildcard(entry["identity"]):
+                    grants.add(entry["identity"], entry["realm"])
+        return TrustMap(trust_map, grants)
+
+    def get_cert_hashes(self, realm, identity):
+        """Return the accepted certificate hashes for ``identity`` in ``realm``."""
+        return self.trust_map.get(realm, {}).get(identity, {}).get("cert_hashes", [])
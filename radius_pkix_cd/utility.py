@@ -1,24 +1,36 @@
 """Utility functions for radius_pkix_cd."""
+import hashlib
 import json
+import os
 import re
+import sys
+import tempfile
+from urllib.parse import urlparse
 
-from dane_discovery.pki import PKI
-from dane_discovery.dane import DANE
+from radius_pkix_cd import metrics
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.domain_policy import DomainPolicy
 
 
 class Utility:
     """Various utility functions found here."""
 
     iot_registry_org_domains = ["iotregistry.ca"]
+    iot_registry_domains = DomainPolicy(iot_registry_org_domains)
+
+    # Dot-separated labels, each made of the characters verify_dns_name allows.
+    dns_name_pattern = re.compile(r"[A-Za-z0-9_-]+(?:\.[A-Za-z0-9_-]+)*")
+    dotted_quad_pattern = re.compile(r"[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+")
 
     @classmethod
     def update_trust_store_file(cls, path, trust_map):
         """Update the trust store file.
 
-        This function will first compare the file
-        on disk to what's to be written, and only 
-        write the file if it's different than what's
-        already on disk.
+        This function will first compare the digest
+        of the file on disk to the digest of what's
+        to be written, and only write the file if 
+        it's different than what's already on disk.
+        The file is replaced atomically.
 
         Args:
             path (str): Path to trust store file.
@@ -42,22 +54,154 @@ class Utility:
         
         Return: True if file was updated, False otherwise.
         """
+        contents = cls.serialize_trust_map(trust_map)
+        if cls.get_digest(contents) == cls.get_file_digest(path):
+            return False
+        cls.write_file_atomically(path, contents)
+        print("Updated trust store at {}".format(path))
+        return True
+
+    @classmethod
+    def publish_trust_store(cls, trustmap_path, cacerts_path, trust_map, pem_certs, journal=None,
+                            trustindex_path=None, trustshards_path=None):
+        """Publish the trust map, CA bundle, index and shards as one generation.
+
+        Whether anything changed is decided by comparing content
+        digests against the manifest from the last generation, so
+        the existing trust map is never loaded. If anything changed,
+        every file is replaced, CA bundle first, so that a trust map is
+        never visible before the roots it relies on. The compiled index
+        and sharded trust map, if asked for, follow the trust map. The
+        manifest is written last, and records the new generation number
+        and the digest of each file (for the shards, of their own
+        manifest). An index or shards which don't match their digest,
+        or are missing, are part of what changed, so a run interrupted
+        before the manifest is repaired by the next.
+
+        Each file is replaced atomically, but not all of them at once:
+        a verifier reading the index or shards doesn't consult this
+        manifest, and may see them a moment before or after the trust map.
+
+        With a journal, the changes from the previous generation are
+        recorded before the manifest is written. Only then is the
+        previous trust map loaded, to compare against.
+
+        Args:
+            trustmap_path (str): Path to trust store file.
+            cacerts_path (str): Path to CA bundle.
+            trust_map (dict): As described in :func:`update_trust_store_file`.
+            pem_certs (list): PEM-encoded CA certificates, as bytes.
+            journal (TrustJournal): Optional journal of changes.
+            trustindex_path (str): Optional path for the compiled trust map index.
+            trustshards_path (str): Optional directory for the sharded trust map.
+
+        Return: True if a new generation was published, False otherwise.
+        """
+        # Imported here, as these modules import this one.
+        from radius_pkix_cd.sharded_trust_map import ShardedTrustMap
+        from radius_pkix_cd.trust_index import TrustIndex
+
+        trust_map_contents = cls.serialize_trust_map(trust_map)
+        ca_contents = b"\n".join(pem_certs)
+        manifest = cls.read_manifest(trustmap_path)
+        digests = {"trustmap_sha256": cls.get_digest(trust_map_contents),
+                   "cacerts_sha256": cls.get_digest(ca_contents)}
+        # Built from the trust map, so only compared with what's on disk.
+        artifacts = {}
+        if trustindex_path:
+            artifacts["trustindex_sha256"] = trustindex_path
+        if trustshards_path:
+            artifacts["trustshards_sha256"] = os.path.join(trustshards_path, ShardedTrustMap.manifest_name)
+        if (all(manifest.get(k) == v for k, v in digests.items())
+                and os.path.exists(trustmap_path) and os.path.exists(cacerts_path)
+                and all(manifest.get(k) is not None and manifest.get(k) == cls.get_file_digest(v)
+                        for k, v in artifacts.items())):
+            return False
+        changes = None
+        if journal is not None:
+            changes = journal.get_changes(cls.read_previous_trust_map(trustmap_path), trust_map,
+                                          cls.read_previous_file(cacerts_path), ca_contents)
+        cls.write_file_atomically(cacerts_path, ca_contents)
+        cls.write_file_atomically(trustmap_path, trust_map_contents)
+        manifest = dict(digests, generation=manifest.get("generation", 0) + 1)
+        if trustindex_path:
+            with metrics.current().stage("trust_index"):
+                index_contents = TrustIndex.build(trust_map)
+                cls.write_file_atomically(trustindex_path, index_contents)
+            manifest["trustindex_sha256"] = cls.get_digest(index_contents)
+            print("Updated trust map index at {}".format(trustindex_path))
+        if trustshards_path:
+            with metrics.current().stage("trust_shards"):
+                ShardedTrustMap.write(trustshards_path, trust_map)
+            manifest["trustshards_sha256"] = cls.get_file_digest(artifacts["trustshards_sha256"])
+        if journal is not None:
+            journal.append(manifest["generation"], changes, digests)
+        cls.write_file_atomically(cls.get_manifest_path(trustmap_path),
+                                  json.dumps(manifest, sort_keys=True).encode())
+        print("Published trust store generation {} at {}".format(manifest["generation"], trustmap_path))
+        return True
+
+    @classmethod
+    def read_previous_trust_map(cls, trustmap_path):
+        """Return the trust map on disk, or an empty dict if there's none to read."""
         try:
-            with open(path) as f_on_disk:
-                current_map = json.load(f_on_disk)
+            with open(trustmap_path) as f_on_disk:
+                trust_map = json.load(f_on_disk)
         except FileNotFoundError:
-            current_map = {}
-        except json.decoder.JSONDecodeError:
-            current_map = {}
-        if not current_map == trust_map:
-            with open(path, 'w') as f_on_disk:
-                json.dump(trust_map, f_on_disk)
-                print("Updated trust store at {}".format(path))
-                return True
-        return False
+            return {}
+        except json.decoder.JSONDecodeError as err:
+            print("Previous trust map unreadable, journaling it as empty: {}".format(err))
+            return {}
+        return trust_map if isinstance(trust_map, dict) else {}
+
+    @classmethod
+    def read_previous_file(cls, path):
+        """Return the contents of the file at ``path``, or b"" if missing."""
+        try:
+            with open(path, "rb") as f_on_disk:
+                return f_on_disk.read()
+        except FileNotFoundError:
+            return b""
+
+    @classmethod
+    def serialize_trust_map(cls, trust_map):
+        """Return the trust map serialized for disk, with stable key order."""
+        return json.dumps(trust_map, sort_keys=True).encode()
+
+    @classmethod
+    def get_manifest_path(cls, trustmap_path):
+        """Return the path of the manifest for a trust map."""
+        return "{}.manifest".format(trustmap_path)
+
+    @classmethod
+    def read_manifest(cls, trustmap_path):
+        """Return the manifest for a trust map, or an empty dict."""
+        try:
+            with open(cls.get_manifest_path(trustmap_path)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    @classmethod
+    def get_digest(cls, contents):
+        """Return the hex SHA-256 of ``contents``."""
+        return hashlib.sha256(contents).hexdigest()
+
+    @classmethod
+    def get_file_digest(cls, path):
+        """Return the hex SHA-256 of the file at ``path``, or None if missing."""
+        digest = hashlib.sha256()
+        try:
+            with open(path, "rb") as f_on_disk:
+                for chunk in iter(lambda: f_on_disk.read(65536), b""):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            return None
+        return digest.hexdigest()
     
     @classmethod
-    def get_authz_config(cls, path):
+    def get_authz_config(cls, paths, max_reported_errors=20):
         """Return dict representing authz configuration.
         
         The format of the file is expected to be pipe- 
@@ -66,46 +210,80 @@ class Utility:
         with a space. Because that won't work either.
 
         This function organizes permitted Called-Station-IDs 
-        by DNSName.
+        by DNSName. Duplicate lines are ignored, and realms are
+        listed in the order they first appear.
 
         If there are incorrectly-formatted lines in the file,
-        the problem line number will be printed to stdout and
-        the process will continue.
+        they are skipped, and reported together once the whole
+        access list has been read.
         
         Args:
-            path (str): Path to authz file.
+            paths (str or list): Path to authz file, or a list of
+                paths. ``-`` reads from stdin.
+            max_reported_errors (int): Only print this many of the
+                incorrectly-formatted lines.
             
         Return:
             dict: {"my._device.example": ["MySSID", "OtherSSID"]}
         """
         authz_config = {}
-        with open(path) as authz_file:
-            line_no = 0
-            for line in authz_file.readlines():
-                line = line.strip(" ").strip("\n")
-                line_no += 1
-                if not line:
-                    # Catch empty lines
-                    continue
-                line_parts = line.split("|")
-                if len(line_parts) != 2:
-                    print("Incorrectly formatted line: {}".format(line_no))
-                realm = line_parts[0]
+        errors = []
+        for realm, identity_name in cls.read_authz_entries(paths, errors):
+            # Dicts keep insertion order, and dedupe in constant time.
+            authz_config.setdefault(identity_name, {})[realm] = None
+        if errors:
+            print("Skipped {} incorrectly formatted lines:".format(len(errors)))
+            for source, line_no, reason in errors[:max_reported_errors]:
+                print("  {}:{}: {}".format(source, line_no, reason))
+            if len(errors) > max_reported_errors:
+                print("  ...and {} more.".format(len(errors) - max_reported_errors))
+        return {k: list(v) for k, v in authz_config.items()}
+
+    @classmethod
+    def read_authz_entries(cls, paths, errors=None):
+        """Yield (realm, dnsname) for each valid line of the access lists.
+
+        Files are read a line at a time, so memory use doesn't grow with
+        the size of the access list.
+
+        Args:
+            paths (str or list): Path to authz file, or a list of paths.
+                ``-`` reads from stdin.
+            errors (list): If provided, ``(path, line_no, reason)`` is
+                appended for each incorrectly formatted line.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        for path in paths:
+            if path == "-":
+                yield from cls.parse_authz_lines(sys.stdin, path, errors)
+                continue
+            with open(path) as authz_file:
+                yield from cls.parse_authz_lines(authz_file, path, errors)
+
+    @classmethod
+    def parse_authz_lines(cls, lines, source, errors=None):
+        """Yield (realm, dnsname) for each valid line in ``lines``."""
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip(" \r\n")
+            if not line:
+                # Catch empty lines
+                continue
+            realm, sep, identity_name = line.partition("|")
+            if not sep or "|" in identity_name:
+                reason = "Expected REALM|DNSNAME"
+            else:
                 try:
-                    identity_name = line_parts[1]
-                    cls.verify_dns_name(identity_name)
-                except ValueError as err:
-                    print("Bad ID name on line {}: {}".format(line_no, err))
+                    cls.verify_dns_name(identity_name, allow_wildcard=True)
+                    yield realm, identity_name
                     continue
-                if identity_name not in authz_config:
-                    authz_config[identity_name] = [realm]
-                else:
-                    authz_config[identity_name].append(realm)
-        return authz_config
+                except ValueError as err:
+                    reason = "Bad ID name: {}".format(err)
+            if errors is not None:
+                errors.append((source, line_no, reason))
 
-    
     @classmethod
-    def verify_dns_name(cls, dns_name):
+    def verify_dns_name(cls, dns_name, allow_wildcard=False):
         """Ensure that ```dns_name`` conforms to RFC 1123 constraints.
 
         Allowable length: 255 chars.
@@ -114,6 +292,8 @@ class Utility:
 
         Args:
             dns_name (str): DNS name to validate.
+            allow_wildcard (bool): Also accept a subtree grant, like
+                ``*.example.com``.
 
         Return:
             None
@@ -122,22 +302,20 @@ class Utility:
             ValueError
         """
         dns_name = dns_name.rstrip(".")
+        if allow_wildcard and DomainPolicy.is_wildcard(dns_name):
+            dns_name = dns_name[len(DomainPolicy.wildcard_prefix):]
         if cls.is_it_an_ip(dns_name):
             errmsg = "'{}' is a bad hostname (is it an IP address?)!".format(dns_name)
             raise ValueError(errmsg)
-        split_at_dot = dns_name.split(".")
-        pattern = re.compile("^([A-Za-z0-9_-]+)$")
-        for x in split_at_dot:
-            if not pattern.match(x):
-                errmsg = "'{}' is a bad hostname!".format(dns_name)
-                raise ValueError("Hostname invalid!")
+        if not cls.dns_name_pattern.fullmatch(dns_name):
+            raise ValueError("Hostname invalid!")
 
     @classmethod
     def is_it_an_ip(cls, dns_name):
         """Return True if it's an IP, False otherwise."""
-        split_at_dot = dns_name.split(".")
-        if len(split_at_dot) != 4:
+        if not cls.dotted_quad_pattern.fullmatch(dns_name):
             return False
+        split_at_dot = dns_name.split(".")
         try:
             for x in split_at_dot:
                 if not 0 < int(x) < 255:
@@ -146,24 +324,56 @@ class Utility:
             return False
         return True
 
+    @classmethod
+    def write_file_atomically(cls, path, contents):
+        """Replace the file at ``path`` with ``contents``.
+
+        The contents are written to a temporary file in the same
+        directory, flushed to disk, and renamed into place. Readers
+        see either the old file or the new one, never a partial write.
+
+        Args:
+            path (str): Path to file.
+            contents (bytes): New file contents.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".{}.".format(os.path.basename(path)))
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(contents)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
     @classmethod
     def update_ca_file(cls, file_name, pem_certs):
-        """Write all CA certificates to a file."""
-        with open(file_name, "wb") as ca_file:
-            ca_file.write(b"\n".join(pem_certs))
-
-    @classmethod
-    def check_iot_registry_issuance(cls, cert_pem):
-        """Return True if the certificate was issued by IoT Registry."""
-        cert_meta = PKI.get_cert_meta(cert_pem)
-        common_name = cert_meta["subject"]["commonName"]
-        for registry_domain in cls.iot_registry_org_domains:
-            if cls.dnsname_in_domain(common_name, registry_domain):
-                return True
-        return False
+        """Write all CA certificates to a file, atomically."""
+        cls.write_file_atomically(file_name, b"\n".join(pem_certs))
+
+    @classmethod
+    def check_iot_registry_issuance(cls, cert_pem, registry_domains=None):
+        """Return True if the certificate was issued by IoT Registry.
+
+        Args:
+            cert_pem (str): Certificate presented by supplicant, or a
+                CertificateContext.
+            registry_domains (DomainPolicy): IoT Registry domains.
+                Default: ``iot_registry_org_domains``.
+
+        Raise:
+            ValueError if the commonName can't be decoded, or isn't a
+                well-formed name.
+        """
+        if registry_domains is None:
+            registry_domains = cls.iot_registry_domains
+        return registry_domains.matches(CertificateContext.wrap(cert_pem).common_name)
 
     @classmethod
-    def check_iot_registry_revoked(cls, cert_pem, ns_override=None):
+    def check_iot_registry_revoked(cls, cert_pem, ns_override=None, cache=None, dns_timeout=5):
         """Return True if the certificate has been revoked by the IoT registry.
         
         We expect to find exactly one TLSA RR for the identity in the IoT registry.
@@ -172,10 +382,132 @@ class Utility:
         ``3 0 1`` representation.
 
         The SHA256 hash must match the presented certificate.
+
+        If a cache is provided, the outcome is cached by registry DNS name
+        and certificate hash, for as long as the registry's TLSA record TTL
+        allows. Revocations, including an empty answer, are cached as
+        negative results. Lookup errors and malformed answers are never
+        cached.
+
+        Args:
+            cert_pem (str): Certificate presented by supplicant, or a
+                CertificateContext.
+            ns_override (str): Override system name server.
+            cache (ResultCache): Optional revocation status cache.
+            dns_timeout (float): Timeout in seconds for the DNS lookup.
+        """
+        certificate = CertificateContext.wrap(cert_pem)
+        registry_dns_name = certificate.common_name
+        expected_sha = certificate.sha256
+        cache_key = cls.get_registry_cache_key(certificate)
+        if cache is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                metrics.current().incr("registry_cache_hit")
+                return cached["value"]
+            metrics.current().incr("registry_cache_miss")
+        try:
+            registry_entries = cls.get_registry_entries(registry_dns_name, ns_override, dns_timeout)
+        except ValueError as err:
+            print("IoT registry lookup failed: {}".format(err))
+            return True
+        if not registry_entries:
+            print("No IoT registry entry for {}!".format(registry_dns_name))
+            if cache is not None:
+                cache.set(cache_key, True, cache.negative_ttl, negative=True)
+            return True
+        revoked = cls.registry_entry_revokes(registry_entries, expected_sha)
+        if cache is not None:
+            ttl = min(x["ttl"] for x in registry_entries)
+            cache.set(cache_key, revoked, ttl, negative=revoked)
+        return revoked
+
+    @classmethod
+    def get_registry_entries(cls, registry_dns_name, ns_override=None, dns_timeout=5):
+        """Return the IoT Registry's TLSA records for ``registry_dns_name``.
+
+        Return:
+            list: TLSA records, parsed as by ``DANE.get_tlsa_records``.
+                Empty if the registry answered with none.
+
+        Raise:
+            ValueError if the lookup fails, or a record is malformed.
+        """
+        # Imported here, so verifies without a registry check don't load DNS libraries.
+        import dns.exception
+        from dane_discovery.dane import DANE
+        from dane_discovery.exceptions import TLSAError
+
+        try:
+            responses = DANE.get_responses(registry_dns_name, "TLSA", ns_override, dns_timeout)["responses"]
+            return [DANE.process_response(line) for rrset in responses for line in rrset.splitlines()]
+        except (dns.exception.DNSException, OSError, TLSAError, ValueError, IndexError) as err:
+            raise ValueError("Caught error '{}' when retrieving TLSA record.".format(err))
+
+    @classmethod
+    def install_http_timeout(cls):
+        """Give dane_discovery's CA certificate downloads a timeout, for the whole process.
+
+        ``DANE.wrap_requests`` waits on the web server for as long as it
+        takes. Downloads not answered by a resolver pool go to
+        :func:`wrap_requests` instead.
+        """
+        from radius_pkix_cd import dns_dispatch
+
+        dns_dispatch.enable_http_timeout()
+
+    @classmethod
+    def wrap_requests(cls, url, nsaddr=None, dns_timeout=5):
+        """Stand-in for ``DANE.wrap_requests``, giving up on the download after ``dns_timeout`` too."""
+        import requests
+        from forcediphttpsadapter.adapters import ForcedIPHTTPSAdapter
+
+        hostname = urlparse(url).hostname
+        ip_address = cls.get_a_record(hostname, nsaddr, dns_timeout)
+        session = requests.Session()
+        session.mount(url, ForcedIPHTTPSAdapter(dest_ip=ip_address))
+        return session.get(url, headers={"Host": hostname}, timeout=dns_timeout).content
+
+    @classmethod
+    def get_a_record(cls, dnsname, nsaddr=None, dns_timeout=5):
+        """Return the first A record for ``dnsname``, like ``DANE.get_a_record``.
+
+        ``DANE.get_a_record`` ignores its ``dns_timeout``, and waits on the
+        resolver's default lifetime instead.
+
+        Raise:
+            ValueError if there is no A record, or the lookup fails.
+        """
+        import dns.exception
+        import dns.resolver
+
+        resolver = dns.resolver.Resolver()
+        if nsaddr:
+            resolver.nameservers = [nsaddr]
+        resolver.timeout = resolver.lifetime = dns_timeout
+        try:
+            canonical_name = resolver.canonical_name(dnsname)
+            ip_address = str(resolver.resolve(canonical_name, "A")[0])
+        except dns.exception.DNSException as err:
+            raise ValueError("Caught error '{}' when retrieving A record.".format(err))
+        except IndexError:
+            raise ValueError("No A records for {}".format(dnsname))
+        return ip_address
+
+    @classmethod
+    def get_registry_cache_key(cls, certificate):
+        """Return the IoT Registry cache key for a CertificateContext."""
+        return "registry:{}:{}".format(certificate.common_name.lower(), certificate.sha256)
+
+    @classmethod
+    def registry_entry_revokes(cls, registry_entries, expected_sha):
+        """Return True if the registry's TLSA records revoke the certificate.
+
+        Args:
+            registry_entries (list): TLSA records, as returned by
+                ``DANE.get_tlsa_records``.
+            expected_sha (str): SHA-256 of the presented certificate.
         """
-        cert_meta = PKI.get_cert_meta(cert_pem)
-        registry_dns_name = cert_meta["subject"]["commonName"]
-        registry_entries = DANE.get_tlsa_records(registry_dns_name, nsaddr=ns_override)
         if not registry_entries:
             print("No IoT registry entry for identity!")
             return True
@@ -186,7 +518,6 @@ class Utility:
                 and registry_entry["matching_type"] == 1):
             print("Unexpected TLSA record format from registry: {}".format(reg_txt))
             return True
-        expected_sha = DANE.generate_sha_by_selector(cert_pem, "sha256", 0)
         if not expected_sha == registry_entry["certificate_association"]:
             print("Hash mismatch: Registry: {} != Cert: {}".format(registry_entry["certificate_association"], expected_sha))
             return True
@@ -0,0 +1,589 @@
+"""Authorization logic shared by pkix_cd_verify and the verify service."""
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError
+
+from radius_pkix_cd import dns_dispatch
+from radius_pkix_cd import metrics
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.domain_policy import DomainPolicy
+from radius_pkix_cd.result_cache import ResultCache
+from radius_pkix_cd.sharded_trust_map import ShardedTrustMap
+from radius_pkix_cd.trust_index import TrustIndex
+from radius_pkix_cd.trust_journal import TrustJournal
+from radius_pkix_cd.trust_map import TrustMap
+from radius_pkix_cd.utility import Utility
+
+
+class Verifier:
+    """Authorize supplicants against a trust map.
+
+    The trust map is parsed once and kept in memory. Before each
+    authorization we stat the file on disk, and reload it if
+    ``pkix_cd_manage_trust`` has published a new one. This makes a
+    single instance safe to keep around in a long-running process.
+    """
+
+    EXIT_OK = 0
+    EXIT_MISSING_TRUST_MAP = 1
+    EXIT_MISSING_CERTIFICATE = 2
+    EXIT_INVALID_CALLED_STATION = 3
+    EXIT_CERT_HASH_MISMATCH = 4
+    EXIT_LIVE_VERIFY_FAILED = 5
+    EXIT_REGISTRY_FAILED = 6
+
+    # What to do when a DNS-bound stage runs past the deadline.
+    DEADLINE_POLICIES = ["fail-closed", "last-known-good"]
+
+    # Exit code for each DNS-bound stage which can't pass.
+    STAGE_FAILURES = {"live_verify": EXIT_LIVE_VERIFY_FAILED, "registry": EXIT_REGISTRY_FAILED}
+
+    # Stages which overran their deadline keep running in the background,
+    # until their DNS timeout. With this many running, new ones fail closed.
+    max_stage_threads = 64
+
+    def __init__(self, trustmap_path, registry_cache=None, registry_cache_max_age=3600,
+                 registry_cache_negative_ttl=60, metrics_log=None, metrics_statsd=None,
+                 live_cache=None, live_cache_max_age=3600, live_cache_negative_ttl=60,
+                 live_cache_size=10000, live_cache_stale=0, registry_domains=None,
+                 dns_pool=None, deadline_ms=None, deadline_policy="fail-closed",
+                 deadline_fallback_max_age=86400, parallel_stages=False):
+        """Initialize with the path to the trust map.
+
+        Args:
+            trustmap_path (str): Trust map, provided by pkix_cd_manage_trust.
+                This may be the JSON trust map, the compiled trust map
+                index, or the sharded trust map directory.
+            registry_cache (str): Optional path to the IoT Registry
+                revocation status cache.
+            registry_cache_max_age (int): Maximum seconds to trust a cached
+                IoT Registry status.
+            registry_cache_negative_ttl (int): Maximum seconds to cache an
+                IoT Registry revocation.
+            metrics_log (str): Optional path for a JSON line of metrics
+                per authorization, or ``-`` for stderr.
+            metrics_statsd (str): Optional statsd server for metrics, as
+                ``host:port``.
+            live_cache (str): Optional path to the live verify result cache.
+            live_cache_max_age (int): Maximum seconds to trust a cached live
+                verify result.
+            live_cache_negative_ttl (int): Maximum seconds to cache a failed
+                live verify.
+            live_cache_size (int): Maximum number of cached live verify
+                results. The least recently used are evicted first.
+            live_cache_stale (int): Seconds after expiry that a cached live
+                verify result may still be used, while it's refreshed in the
+                background.
+            registry_domains (str): Optional file listing the IoT Registry
+                domains, one per line, in place of the built-in list.
+            dns_pool (str): ``tcp`` or ``tls`` to route live verify and IoT
+                Registry lookups through the process-wide
+                :class:`~radius_pkix_cd.resolver_pool.ResolverPool`.
+            deadline_ms (int): Optional latency budget per authorization,
+                in milliseconds. Live verify and the IoT Registry check
+                are abandoned if they run past it, and each of their
+                DNS queries and CA certificate downloads times out by
+                then, whatever timeout dane_discovery asks for.
+            deadline_policy (str): ``fail-closed`` to fail a stage which
+                runs past the deadline, or ``last-known-good`` to use its
+                cached result instead, if there is one.
+            deadline_fallback_max_age (int): Maximum age, in seconds, of a
+                cached result used by ``last-known-good``.
+            parallel_stages (bool): With a deadline, run live verify and
+                the IoT Registry check at the same time.
+
+        Raise:
+            FileNotFoundError if ``registry_domains`` does not exist.
+            ValueError if it lists an invalid domain, or
+                ``deadline_policy`` is unknown.
+        """
+        self.trustmap_path = trustmap_path
+        self.registry_cache = None
+        if registry_cache:
+            self.registry_cache = ResultCache(registry_cache, registry_cache_max_age,
+                                              registry_cache_negative_ttl)
+        self.live_cache = None
+        if live_cache:
+            self.live_cache = ResultCache(live_cache, live_cache_max_age, live_cache_negative_ttl,
+                                          live_cache_size)
+        self.live_cache_stale = live_cache_stale
+        self.revalidating = set()
+        self.registry_domains = None
+        if registry_domains:
+            self.registry_domains = DomainPolicy.load(registry_domains)
+        if deadline_policy not in self.DEADLINE_POLICIES:
+            raise ValueError("Unknown deadline policy: {}".format(deadline_policy))
+        self.deadline_ms = deadline_ms
+        self.deadline_policy = deadline_policy
+        self.deadline_fallback_max_age = deadline_fallback_max_age
+        self.parallel_stages = parallel_stages
+        self.stage_slots = threading.BoundedSemaphore(self.max_stage_threads)
+        if deadline_ms:
+            Utility.install_http_timeout()
+        self.metrics_exporters = metrics.get_exporters(metrics_log, metrics_statsd)
+        if dns_pool:
+            # Imported here, so verifies without a pool don't load DNS libraries.
+            from radius_pkix_cd import resolver_pool
+            resolver_pool.install(dns_pool)
+        self.trust_map = None
+        self.trust_map_stamp = None
+        self.trust_map_generation = None
+        self.lock = threading.Lock()
+
+    def load_trust_map(self):
+        """Return the trust map, reloading it if the file has changed.
+
+        Return:
+            TrustMap, TrustIndex or ShardedTrustMap, depending on the format.
+
+        A JSON trust map is brought up to date by applying the changes
+        in its journal, if ``pkix_cd_manage_trust --journal`` recorded
+        every generation since it was loaded. Otherwise it's reloaded.
+        If a newly-published trust map can't be parsed, we keep using
+        the one we already have.
+
+        Raise:
+            FileNotFoundError if the trust map does not exist.
+            ValueError if the trust map can't be parsed, and no earlier
+                trust map was loaded.
+        """
+        stamp = self.get_trust_map_stamp()
+        with self.lock:
+            if stamp != self.trust_map_stamp:
+                try:
+                    if not self.apply_trust_map_changes():
+                        self.trust_map, self.trust_map_generation = self.read_trust_map()
+                except ValueError as err:
+                    if self.trust_map is None:
+                        raise
+                    print("Keeping previous trust map, failed to load {}: {}".format(self.trustmap_path, err))
+                self.trust_map_stamp = stamp
+            return self.trust_map
+
+    def get_trust_map_stamp(self):
+        """Return what identifies the version of the trust map on disk.
+
+        The manifest is included, as it's published after the trust map:
+        a trust map read before its manifest arrives is looked at again
+        when the manifest does.
+
+        Raise:
+            FileNotFoundError if the trust map does not exist.
+        """
+        stat = os.stat(self.trustmap_path)
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        try:
+            manifest_stat = os.stat(Utility.get_manifest_path(self.trustmap_path))
+        except FileNotFoundError:
+            return stamp, None
+        return stamp, (manifest_stat.st_ino, manifest_stat.st_mtime_ns, manifest_stat.st_size)
+
+    def read_trust_map(self):
+        """Return the trust map read from disk, and its generation.
+
+        The generation is only tracked for JSON trust maps, and is None
+        for other formats.
+        """
+        if ShardedTrustMap.is_sharded(self.trustmap_path):
+            # Replacing the manifest changes the directory's stamp.
+            return ShardedTrustMap(self.trustmap_path), None
+        if TrustIndex.is_trust_index(self.trustmap_path):
+            return TrustIndex(self.trustmap_path), None
+        # Read the generation first, as the file is at least that new.
+        generation = Utility.read_manifest(self.trustmap_path).get("generation")
+        return TrustMap.load(self.trustmap_path), generation
+
+    def apply_trust_map_changes(self):
+        """Update the loaded JSON trust map from its journal.
+
+        Return:
+            bool: True if the trust map is now current, False if it needs
+                to be reloaded.
+        """
+        if not isinstance(self.trust_map, TrustMap) or self.trust_map_generation is None:
+            return False
+        generation = Utility.read_manifest(self.trustmap_path).get("generation")
+        # The same generation means the file changed without a new manifest, yet.
+        if not isinstance(generation, int) or generation <= self.trust_map_generation:
+            return False
+        journal = TrustJournal(TrustJournal.get_path(self.trustmap_path))
+        changes = journal.get_changes_since(self.trust_map_generation, generation)
+        if changes is None:
+            return False
+        # Verifies on other threads keep using the trust map they already have.
+        trust_map = self.trust_map
+        try:
+            for change in changes:
+                trust_map = trust_map.apply_changes(change)
+        except (KeyError, TypeError, AttributeError) as err:
+            print("Unusable trust map journal, reloading: {}".format(err))
+            return False
+        metrics.current().incr("trust_map_changes_applied", len(changes))
+        self.trust_map = trust_map
+        self.trust_map_generation = generation
+        return True
+
+    def verify(self, called, calling, certificate, live_verify=False,
+               require_registry=False, ns_override=None):
+        """Authorize a supplicant, returning an exit code and messages.
+
+        Args:
+            called (str): Called-Station-Id, formatted MAC:SSID.
+            calling (str): DNS name of the identity (User-Name).
+            certificate (str): Certificate presented by supplicant, in PEM
+                format, or a CertificateContext.
+            live_verify (bool): Verify directly against DNS, in addition
+                to cached information.
+            require_registry (bool): Require IoT Registry revocation checks.
+            ns_override (str): Override system name server.
+
+        Return:
+            int: One of the ``EXIT_*`` codes.
+            list: Human-readable messages explaining the outcome.
+        """
+        deadline = None
+        if self.deadline_ms:
+            deadline = time.monotonic() + self.deadline_ms / 1000.0
+        labels = {"called": called, "calling": calling}
+        operation = metrics.start(self.metrics_exporters, "verify", labels)
+        with operation.activate():
+            code, messages = self.authorize(called, calling, certificate, live_verify,
+                                            require_registry, ns_override, operation, deadline)
+        if self.metrics_exporters:
+            operation.finish(code)
+            metrics.export(self.metrics_exporters, operation)
+        return code, messages
+
+    def authorize(self, called, calling, certificate, live_verify, require_registry,
+                  ns_override, operation, deadline=None):
+        """Do the work of :func:`verify`, timing each stage in ``operation``.
+
+        ``deadline`` is the ``time.monotonic()`` by which the DNS-bound
+        stages must be done, or None to wait for them.
+        """
+        messages = []
+        certificate = CertificateContext.wrap(certificate)
+        # Load the trust map or bail.
+        try:
+            with operation.stage("load_trust_map"):
+                current_map = self.load_trust_map()
+        except FileNotFoundError:
+            messages.append("Trust map not found: {}!".format(self.trustmap_path))
+            return self.EXIT_MISSING_TRUST_MAP, messages
+        except ValueError as err:
+            messages.append("Trust map unreadable: {}: {}".format(self.trustmap_path, err))
+            return self.EXIT_MISSING_TRUST_MAP, messages
+
+        # Make sure that the called station is valid.
+        _, _, ssid = called.partition(":")
+        try:
+            with operation.stage("lookup_identity"):
+                has_realm = current_map.has_realm(ssid)
+                has_identity = has_realm and current_map.has_identity(ssid, calling)
+                subtree_grant = (has_realm and not has_identity
+                                 and current_map.has_subtree_grant(ssid, calling))
+        except ValueError as err:
+            # A sharded trust map loads the realm's shard here.
+            messages.append("Trust map unreadable: {}: {}".format(self.trustmap_path, err))
+            return self.EXIT_MISSING_TRUST_MAP, messages
+        if not has_realm:
+            messages.append("Invalid called station: {} (no match {})".format(called, ssid))
+            return self.EXIT_INVALID_CALLED_STATION, messages
+
+        # Make sure that the identity is authorized to access the called station.
+        if not (has_identity or subtree_grant):
+            messages.append("Identity {} not allowed access to {}".format(calling, ssid))
+            return self.EXIT_INVALID_CALLED_STATION, messages
+
+        # Match the certificate's hash against what we have in the trust map.
+        # Identities under a subtree grant aren't discovered, so there's
+        # nothing to match, and the certificate must pass live verify instead.
+        hash_match = True
+        if subtree_grant:
+            live_verify = True
+        else:
+            with operation.stage("hash_certificate"):
+                cert_hash = certificate.sha256
+            with operation.stage("lookup_cert_hash"):
+                hash_match = current_map.has_cert_hash(ssid, calling, cert_hash)
+        if not hash_match:
+            messages.append("Presented certificate does not map to accepted certificate hash!")
+            messages.append("{} not accepted for {} in {}".format(cert_hash, calling, ssid))
+            return self.EXIT_CERT_HASH_MISMATCH, messages
+
+        # Next, we check the cert against the live DNS config, and
+        # finally, we check for IoT Registry revocation.
+        stages = []
+        if live_verify:
+            stages.append(("live_verify", lambda: self.check_live(calling, certificate, ns_override,
+                                                                  self.get_dns_timeout(deadline))))
+        stages.append(("registry", lambda: self.check_registry(certificate, require_registry, ns_override,
+                                                               dns_timeout=self.get_dns_timeout(deadline))))
+        code, stage_messages = self.run_stages(stages, operation, deadline, calling, certificate,
+                                               require_registry, ns_override)
+        messages.extend(stage_messages)
+        # If we've survived to this point, we win!
+        return code, messages
+
+    @classmethod
+    def get_dns_timeout(cls, deadline):
+        """Return the seconds left until ``deadline``, or the DNS default without one.
+
+        This is the timeout stages pass on; the stage thread's
+        :func:`~radius_pkix_cd.dns_dispatch.deadline` is what bounds the
+        lookups dane_discovery makes without passing it on.
+        """
+        if deadline is None:
+            return 5
+        return max(0.001, deadline - time.monotonic())
+
+    def check_live(self, calling, certificate, ns_override, dns_timeout=5):
+        """Run the live verify stage, returning an exit code and messages."""
+        success, reason = self.live_verify(calling, certificate, ns_override, dns_timeout)
+        return self.get_live_result(success, reason)
+
+    def get_live_result(self, success, reason):
+        """Return the exit code and messages for a live verify outcome."""
+        if not success:
+            return self.EXIT_LIVE_VERIFY_FAILED, ["Failed PKIX-CD authentication: {}".format(reason)]
+        return self.EXIT_OK, []
+
+    def check_registry(self, certificate, require_registry, ns_override, revoked=None, dns_timeout=5):
+        """Run the IoT Registry stage, returning an exit code and messages.
+
+        Args:
+            revoked (bool): Revocation status to use, instead of looking it up.
+            dns_timeout (float): Timeout in seconds for the lookup.
+        """
+        messages = []
+        try:
+            issued_by_iotregistry = Utility.check_iot_registry_issuance(certificate, self.registry_domains)
+        except ValueError as err:
+            # Rather than guess whether a name we can't read is in the registry, and maybe skip
+            # the revocation check.
+            return self.EXIT_REGISTRY_FAILED, ["Unusable certificate commonName: {}".format(err)]
+        if require_registry and not issued_by_iotregistry:
+            messages.append("IoT Registry required, and this identity is not in the IoT Registry.")
+        if issued_by_iotregistry and revoked is None:
+            revoked = Utility.check_iot_registry_revoked(certificate, ns_override, self.registry_cache,
+                                                         dns_timeout)
+        if issued_by_iotregistry and revoked:
+            messages.append("Certificate revoked by IoT Registry!")
+        if messages:
+            return self.EXIT_REGISTRY_FAILED, messages
+        return self.EXIT_OK, messages
+
+    def run_stages(self, stages, operation, deadline, calling, certificate, require_registry,
+                   ns_override):
+        """Run DNS-bound stages, returning the first failure, or success.
+
+        Without a deadline, stages run one after another on this thread,
+        and stop at the first failure. With one, each runs on its own
+        thread, and is abandoned if it isn't done by the deadline; its
+        lookups time out then too, so a lookup which answers just in time
+        still gets cached. If ``max_stage_threads`` are already running,
+        the stage fails. Stages are checked in order either way, so the
+        exit code is the same as without a deadline.
+
+        Args:
+            stages (list): Pairs of stage name and function returning an
+                exit code and messages.
+        """
+        if deadline is None:
+            for name, check in stages:
+                with operation.stage(name):
+                    code, messages = check()
+                if code != self.EXIT_OK:
+                    return code, messages
+            return self.EXIT_OK, []
+        started = {}
+        if self.parallel_stages:
+            started = {name: self.start_stage(name, check, operation, deadline) for name, check in stages}
+        all_messages = []
+        for name, check in stages:
+            result = started.get(name) or self.start_stage(name, check, operation, deadline)
+            try:
+                if result is None:
+                    operation.incr("stage_rejected_{}".format(name))
+                    code, messages = self.STAGE_FAILURES[name], [
+                        "Too many checks still running to start {}!".format(name)]
+                else:
+                    code, messages = result.result(timeout=max(0.0, deadline - time.monotonic()))
+            except TimeoutError:
+                code, messages = self.expire_stage(name, operation, calling, certificate,
+                                                   require_registry, ns_override)
+            # A stage which passed on its cached result says so.
+            all_messages.extend(messages)
+            if code != self.EXIT_OK:
+                return code, all_messages
+        return self.EXIT_OK, all_messages
+
+    def start_stage(self, name, check, operation, deadline):
+        """Run ``check`` on a daemon thread, returning a Future for its result.
+
+        The thread's DNS queries and CA certificate downloads give up at
+        ``deadline``, so it doesn't hold its slot for long after. Daemon
+        threads don't hold up a one-shot pkix_cd_verify's exit.
+
+        Return:
+            Future: The stage's result, or None if ``max_stage_threads``
+                are already running.
+        """
+        if not self.stage_slots.acquire(blocking=False):
+            return None
+        result = Future()
+
+        def run():
+            try:
+                with operation.activate(), operation.stage(name), dns_dispatch.deadline(deadline):
+                    try:
+                        result.set_result(check())
+                    except Exception as err:
+                        result.set_exception(err)
+            finally:
+                self.stage_slots.release()
+        threading.Thread(target=run, name="verify-{}".format(name), daemon=True).start()
+        return result
+
+    def expire_stage(self, name, operation, calling, certificate, require_registry, ns_override):
+        """Apply the deadline policy to stage ``name``, which ran out of time.
+
+        Return:
+            int: One of the ``EXIT_*`` codes.
+            list: Messages saying which stage timed out, and what was done.
+        """
+        operation.incr("deadline_expired_{}".format(name))
+        message = "Deadline of {} ms expired during {}".format(self.deadline_ms, name)
+        if self.deadline_policy == "last-known-good":
+            fallback = self.get_last_known_result(name, calling, certificate, require_registry,
+                                                  ns_override)
+            if fallback is not None:
+                operation.incr("deadline_fallback")
+                code, messages = fallback
+                return code, ["{}, using the last cached result.".format(message)] + messages
+            message = "{}, and there is no cached result to use".format(message)
+        return self.STAGE_FAILURES[name], ["{}!".format(message)]
+
+    def get_last_known_result(self, name, calling, certificate, require_registry, ns_override):
+        """Return stage ``name``'s exit code and messages from its cached result.
+
+        Expired results are used, unless they're older than
+        ``deadline_fallback_max_age``.
+
+        Return:
+            tuple: Exit code and messages, or None if nothing usable is cached.
+        """
+        if name == "live_verify" and self.live_cache is not None:
+            cached = self.live_cache.get(self.get_live_cache_key(calling, certificate, ns_override),
+                                         allow_expired=True)
+        elif name == "registry" and self.registry_cache is not None:
+            cached = self.registry_cache.get(Utility.get_registry_cache_key(certificate), allow_expired=True)
+        else:
+            return None
+        if cached is None or cached["stored"] < time.time() - self.deadline_fallback_max_age:
+            return None
+        if name == "live_verify":
+            return self.get_live_result(*cached["value"])
+        return self.check_registry(certificate, require_registry, ns_override, revoked=cached["value"])
+
+    def live_verify(self, calling, certificate, ns_override, dns_timeout=5):
+        """Return whether ``certificate`` validates against DNS for ``calling``.
+
+        With a live verify cache, outcomes are cached by identity and
+        certificate hash, for no longer than the TTL of the identity's
+        TLSA records. An expired outcome is still used for up to
+        ``live_cache_stale`` seconds, while a background thread refreshes
+        it. DNS lookup errors are never cached.
+
+        Args:
+            calling (str): DNS name of the identity.
+            certificate (CertificateContext): Certificate presented by supplicant.
+            ns_override (str): Override system name server.
+            dns_timeout (float): Timeout in seconds for each DNS lookup
+                and CA certificate download.
+
+        Return:
+            bool: True if the certificate is valid for the identity.
+            str: Reason for validation pass/fail.
+        """
+        if self.live_cache is None:
+            return self.validate_live(None, calling, certificate, ns_override, dns_timeout)
+        cache_key = self.get_live_cache_key(calling, certificate, ns_override)
+        now = time.time()
+        cached = self.live_cache.get(cache_key, now, allow_expired=self.live_cache_stale > 0)
+        if cached is not None and cached["expires"] > now:
+            metrics.current().incr("live_cache_hit")
+            return tuple(cached["value"])
+        if cached is not None and cached["expires"] + self.live_cache_stale > now:
+            metrics.current().incr("live_cache_stale")
+            self.revalidate(cache_key, calling, certificate, ns_override)
+            return tuple(cached["value"])
+        metrics.current().incr("live_cache_miss")
+        return self.validate_live(cache_key, calling, certificate, ns_override, dns_timeout)
+
+    @classmethod
+    def get_live_cache_key(cls, calling, certificate, ns_override):
+        """Return the live verify cache key for an identity and certificate."""
+        return "live:{}:{}:{}".format(calling.lower(), certificate.sha256, ns_override or "")
+
+    def validate_live(self, cache_key, calling, certificate, ns_override, dns_timeout=5):
+        """Validate ``certificate`` against DNS, caching under ``cache_key``.
+
+        Raise:
+            TLSAError if the identity's TLSA records can't be retrieved.
+        """
+        # Imported here, so verifies without --live-verify don't load DNS libraries.
+        from dane_discovery.identity import Identity
+
+        identity = Identity(calling, None, ns_override, dns_timeout=dns_timeout)
+        success, reason = identity.validate_certificate(certificate.der)
+        if cache_key is not None:
+            ttl = min(x["tlsa_parsed"]["ttl"] for x in identity.dane_credentials)
+            self.live_cache.set(cache_key, [success, reason], ttl, negative=not success)
+        return success, reason
+
+    def revalidate(self, cache_key, calling, certificate, ns_override):
+        """Refresh a cached live verify result on a background thread.
+
+        Only one refresh per key runs at a time. The thread is a daemon,
+        so a one-shot pkix_cd_verify doesn't wait for it before exiting;
+        the result stays stale, and a later run refreshes it.
+        """
+        with self.lock:
+            if cache_key in self.revalidating:
+                return
+            self.revalidating.add(cache_key)
+
+        def refresh():
+            try:
+                self.validate_live(cache_key, calling, certificate, ns_override)
+            except Exception as err:
+                print("Failed to refresh live verify result for {}: {}".format(calling, err))
+            finally:
+                with self.lock:
+                    self.revalidating.discard(cache_key)
+        threading.Thread(target=refresh, name="live-verify-refresh", daemon=True).start()
+
+    def verify_certificate_file(self, called, calling, certfile, live_verify=False,
+                                require_registry=False, ns_override=None):
+        """Authorize a supplicant whose certificate is in a file.
+
+        This is ``pkix_cd_verify``, returning its exit code instead of
+        exiting. Arguments are as for :func:`verify`, except for:
+
+        Args:
+            certfile (str): Path to the certificate presented by the supplicant.
+
+        Return:
+            int: One of the ``EXIT_*`` codes.
+            list: Human-readable messages explaining the outcome.
+        """
+        # Load the presented certificate or bail.
+        try:
+            with open(certfile) as f_on_disk:
+                cert_pem = f_on_disk.read()
+        except FileNotFoundError:
+            return self.EXIT_MISSING_CERTIFICATE, ["Certificate file not found: {}!".format(certfile)]
+        return self.verify(called, calling, cert_pem, live_verify, require_registry, ns_override)
@@ -42,7 +42,10 @@ setup(name=PROJECT_NAME,
       entry_points={
           "console_scripts": [
               "pkix_cd_manage_trust = radius_pkix_cd.scripts.pkix_cd_manage_trust:main",
-              "pkix_cd_verify = radius_pkix_cd.scripts.pkix_cd_verify:main"
+              "pkix_cd_verify = radius_pkix_cd.scripts.pkix_cd_verify:main",
+              "pkix_cd_verify_batch = radius_pkix_cd.scripts.pkix_cd_verify_batch:main",
+              "pkix_cd_verify_client = radius_pkix_cd.scripts.pkix_cd_verify_client:main",
+              "pkix_cd_verify_daemon = radius_pkix_cd.scripts.pkix_cd_verify_daemon:main"
           ]
       },
       classifiers=[
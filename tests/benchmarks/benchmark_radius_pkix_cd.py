@@ -0,0 +1,326 @@
+"""Benchmark and load-test pkix_cd_verify and pkix_cd_manage_trust.
+
+Synthetic access lists are generated for each size, and every identity
+publishes the device certificates in ``tests/ca2``. DNS and CA certificate
+retrieval are served from an in-process stub, by patching
+``DANE.get_responses`` and ``DANE.wrap_requests``, so runs are
+network-free and repeatable. Trust maps and indexes are built by
+``pkix_cd_manage_trust``, as in production. Results are written as JSON, so
+they can be compared between releases.
+
+Example::
+
+    python tests/benchmarks/benchmark_radius_pkix_cd.py \\
+        --sizes 1000,10000,100000 --output bench.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from dane_discovery.dane import DANE
+
+import radius_pkix_cd
+from radius_pkix_cd.scripts import pkix_cd_manage_trust
+from radius_pkix_cd.scripts.pkix_cd_verify_daemon import VerifyServer
+from radius_pkix_cd.verifier import Verifier
+
+
+parser = argparse.ArgumentParser(description="Benchmark radius_pkix_cd.")
+parser.add_argument("--sizes", dest="sizes", help="Comma-separated identity counts.")
+parser.add_argument("--realms", dest="realms", type=int, help="Number of SSIDs in the access list.")
+parser.add_argument("--iterations", dest="iterations", type=int,
+                    help="Authentications per in-process and client latency benchmark.")
+parser.add_argument("--cold-iterations", dest="cold_iterations", type=int,
+                    help="Authentications per cold-start (fork/exec) latency benchmark.")
+parser.add_argument("--burst", dest="burst", type=int,
+                    help="Number of concurrent verify processes in the burst benchmark.")
+parser.add_argument("--concurrency", dest="concurrency", type=int,
+                    help="pkix_cd_manage_trust --concurrency.")
+parser.add_argument("--dns-latency-ms", dest="dns_latency_ms", type=float,
+                    help="Simulated latency for each stub DNS or HTTPS response.")
+parser.add_argument("--output", dest="output", help="Write JSON results here. Default: stdout.")
+parser.set_defaults(sizes="1000,10000,100000", realms=10, iterations=200,
+                    cold_iterations=20, burst=16, concurrency=8, dns_latency_ms=0.0,
+                    output=None)
+
+DOMAIN = "_device.example.net"
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ca2")
+ca_cert_path = os.path.join(fixtures_dir, "ca.example.net.cert.pem")
+identity_cert_path = os.path.join(fixtures_dir, "ecc.air-quality-sensor.{}.cert.pem".format(DOMAIN))
+registry_cert_path = os.path.join(fixtures_dir, "iotreg.ca.cert.pem")
+IDENTITY = "ecc.air-quality-sensor.{}".format(DOMAIN)
+REGISTRY_IDENTITY = "iotreg.{}".format(DOMAIN)
+REGISTRY_CN = "iotreg.iotregistry.ca"
+
+
+def get_identity_name(num):
+    """Return the DNS name of synthetic identity ``num``."""
+    return "dev{}.{}".format(num, DOMAIN)
+
+
+def get_file_contents(path):
+    """Return the contents of a fixture file."""
+    with open(path) as fixture:
+        return fixture.read()
+
+
+class StubDNS:
+    """Serve TLSA records and CA certificates for the fixture identities."""
+
+    def __init__(self, latency_ms=0.0):
+        """Precompute TLSA record data for the fixture certificates."""
+        self.latency = latency_ms / 1000.0
+        self.ca_pem = get_file_contents(ca_cert_path)
+        identity_pem = get_file_contents(identity_cert_path)
+        registry_pem = get_file_contents(registry_cert_path)
+        self.pkix_cd_rdata = DANE.generate_tlsa_record(4, 0, 0, identity_pem)
+        self.registry_rdata = DANE.generate_tlsa_record(3, 0, 1, registry_pem)
+        self.registry_pkix_cd_rdata = DANE.generate_tlsa_record(4, 0, 0, registry_pem)
+        self.lock = threading.Lock()
+        self.queries = 0
+
+    def lookup(self, dnsname):
+        """Return the TLSA rdata published at ``dnsname``."""
+        dnsname = dnsname.rstrip(".")
+        if dnsname == REGISTRY_CN:
+            return [self.registry_rdata]
+        if dnsname == REGISTRY_IDENTITY:
+            return [self.registry_pkix_cd_rdata]
+        if dnsname.endswith("." + DOMAIN):
+            return [self.pkix_cd_rdata]
+        return []
+
+    def get_responses(self, dnsname, rr_type, nsaddr=None, dns_timeout=5):
+        """Stand in for DANE.get_responses."""
+        with self.lock:
+            self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        responses = ["{}. 300 IN TLSA {}".format(dnsname.rstrip("."), x) for x in self.lookup(dnsname)]
+        return {"dnssec": False, "tcp": True, "tls": False, "responses": responses}
+
+    def wrap_requests(self, url, nsaddr=None, dns_timeout=5):
+        """Stand in for DANE.wrap_requests."""
+        with self.lock:
+            self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.ca_pem
+
+    def patch(self):
+        """Return a context manager which routes DANE lookups to the stub."""
+        patches = [patch.object(DANE, "get_responses", side_effect=self.get_responses),
+                   patch.object(DANE, "wrap_requests", side_effect=self.wrap_requests)]
+
+        class Patched:
+            def __enter__(inner):
+                for item in patches:
+                    item.start()
+
+            def __exit__(inner, *exc):
+                for item in reversed(patches):
+                    item.stop()
+        return Patched()
+
+
+def summarize(samples):
+    """Return latency percentiles in milliseconds, from samples in seconds."""
+    ordered = sorted(x * 1000.0 for x in samples)
+
+    def percentile(pct):
+        return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+    return {"count": len(ordered), "mean": statistics.mean(ordered),
+            "p50": percentile(50), "p90": percentile(90), "p99": percentile(99),
+            "max": ordered[-1]}
+
+
+def write_access_list(path, size, realms):
+    """Write a synthetic access list, including the fixture identities."""
+    with open(path, "w") as access_list:
+        access_list.write("SSID0|{}\n".format(IDENTITY))
+        for num in range(size):
+            access_list.write("SSID{}|{}\n".format(num % realms, get_identity_name(num)))
+        access_list.write("SSID0|{}\n".format(REGISTRY_IDENTITY))
+
+
+def run_manage_trust(workdir, latency_ms, concurrency, result_queue):
+    """Run pkix_cd_manage_trust in this (child) process and report cost."""
+    argv = ["pkix_cd_manage_trust", "--infile", os.path.join(workdir, "access_list.txt"),
+            "--trustmap", os.path.join(workdir, "trust_map.json"),
+            "--cacerts", os.path.join(workdir, "ca.pem"),
+            "--trustindex", os.path.join(workdir, "trust_map.idx"),
+            "--concurrency", str(concurrency)]
+    stub = StubDNS(latency_ms)
+    with open(os.devnull, "w") as devnull, stub.patch(), \
+            patch.object(sys, "argv", argv), patch.object(sys, "stdout", devnull):
+        start = time.perf_counter()
+        pkix_cd_manage_trust.main()
+        elapsed = time.perf_counter() - start
+    result_queue.put({"wall_seconds": elapsed, "dns_queries": stub.queries,
+                      "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+def benchmark_manage_trust(workdir, args):
+    """Measure pkix_cd_manage_trust wall time and peak memory, in a fresh process."""
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    child = context.Process(target=run_manage_trust,
+                            args=(workdir, args.dns_latency_ms, args.concurrency, result_queue))
+    child.start()
+    result = result_queue.get()
+    child.join()
+    return result
+
+
+def time_calls(func, iterations):
+    """Return the duration of each of ``iterations`` calls to ``func``."""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def verify_command(script, trustmap, certfile, identity, extra=()):
+    """Return the argv for a verify entry point."""
+    return ([sys.executable, "-m", "radius_pkix_cd.scripts.{}".format(script),
+             "--called", "00-00-00-00-00-01:SSID0", "--calling", identity,
+             "--certfile", certfile, "--trustmap", trustmap] + list(extra))
+
+
+def run_command(argv, expect=0):
+    """Run ``argv``, and raise if it exits unexpectedly."""
+    result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != expect:
+        raise RuntimeError("{} exited {}: {}".format(argv, result.returncode, result.stdout.decode()))
+
+
+def check_verdict(verdict):
+    """Raise unless a Verifier.verify result is a pass."""
+    code, messages = verdict
+    if code != Verifier.EXIT_OK:
+        raise RuntimeError("Verify returned {}: {}".format(code, messages))
+
+
+def benchmark_burst(argvs):
+    """Run all ``argvs`` at once, and return throughput."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(argvs)) as executor:
+        list(executor.map(run_command, argvs))
+    elapsed = time.perf_counter() - start
+    return {"processes": len(argvs), "wall_seconds": elapsed,
+            "auths_per_second": len(argvs) / elapsed}
+
+
+def benchmark_size(size, args):
+    """Run every benchmark for one access list size."""
+    results = []
+    workdir = tempfile.mkdtemp(prefix="pkix_cd_bench_")
+    try:
+        write_access_list(os.path.join(workdir, "access_list.txt"), size, args.realms)
+        manage = benchmark_manage_trust(workdir, args)
+        results.append(dict(manage, benchmark="manage_trust", size=size))
+
+        stub = StubDNS(args.dns_latency_ms)
+        certfile = identity_cert_path
+        cert_pem = get_file_contents(certfile)
+        registry_pem = get_file_contents(registry_cert_path)
+
+        modes = [("cache_only", IDENTITY, cert_pem, certfile, {}),
+                 ("live_verify", IDENTITY, cert_pem, certfile, {"live_verify": True}),
+                 ("registry", REGISTRY_IDENTITY, registry_pem, registry_cert_path,
+                  {"require_registry": True})]
+        flags = {"live_verify": "--live-verify", "require_registry": "--require-registry"}
+
+        for trust_format in ["json", "index"]:
+            trustmap = os.path.join(workdir, "trust_map.{}".format("json" if trust_format == "json" else "idx"))
+
+            # Cold start, one process per authentication. No DNS, so cache-only.
+            samples = time_calls(lambda: run_command(verify_command("pkix_cd_verify", trustmap,
+                                                                    certfile, IDENTITY)),
+                                 args.cold_iterations)
+            results.append({"benchmark": "verify_cold_exec", "size": size, "mode": "cache_only",
+                            "trust_map_format": trust_format, "latency_ms": summarize(samples)})
+
+            with stub.patch():
+                # Warm, in-process, including the first (loading) call.
+                for mode, calling, cert_pem, _, kwargs in modes:
+                    verifier = Verifier(trustmap)
+                    load = time_calls(lambda: verifier.load_trust_map(), 1)[0]
+                    samples = time_calls(lambda: check_verdict(verifier.verify(
+                        "00-00-00-00-00-01:SSID0", calling, cert_pem, **kwargs)), args.iterations)
+                    results.append({"benchmark": "verify_in_process", "size": size, "mode": mode,
+                                    "trust_map_format": trust_format, "load_ms": load * 1000.0,
+                                    "latency_ms": summarize(samples)})
+
+                # Thin client against the verify service, which does the (stub) DNS.
+                # The service sets the checks, so there's one per mode.
+                socket_path = os.path.join(workdir, "verify.sock")
+                for mode, calling, _, cert_path, kwargs in modes:
+                    server = VerifyServer(socket_path, [trustmap], checks=kwargs)
+                    thread = threading.Thread(target=server.serve_forever)
+                    thread.start()
+                    try:
+                        argv = verify_command("pkix_cd_verify_client", trustmap, cert_path, calling,
+                                              [flags[x] for x in kwargs] + ["--socket", socket_path])
+                        samples = time_calls(lambda: run_command(argv), args.cold_iterations)
+                        results.append({"benchmark": "verify_client", "size": size, "mode": mode,
+                                        "trust_map_format": trust_format,
+                                        "latency_ms": summarize(samples)})
+                        if not kwargs:
+                            argv = verify_command("pkix_cd_verify_client", trustmap, certfile, IDENTITY,
+                                                  ["--socket", socket_path])
+                            results.append(dict(benchmark_burst([argv] * args.burst), benchmark="burst_client",
+                                                size=size, mode="cache_only", trust_map_format=trust_format))
+                    finally:
+                        server.shutdown()
+                        server.server_close()
+                        thread.join()
+
+            argv = verify_command("pkix_cd_verify", trustmap, certfile, IDENTITY)
+            results.append(dict(benchmark_burst([argv] * args.burst), benchmark="burst_cold_exec",
+                                size=size, mode="cache_only", trust_map_format=trust_format))
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def main():
+    """Run the benchmarks and emit JSON results."""
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",")]
+    report = {"meta": {"radius_pkix_cd": radius_pkix_cd.__version__,
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "cpus": os.cpu_count(),
+                       "started": datetime.datetime.utcnow().isoformat() + "Z",
+                       "args": vars(args)},
+              "results": []}
+    for size in sizes:
+        print("Benchmarking {} identities...".format(size), file=sys.stderr)
+        report["results"].extend(benchmark_size(size, args))
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import io
+import json
+import os
+
+import pytest
+
+from unittest.mock import patch
+
+from dane_discovery.dane import DANE
+
+from radius_pkix_cd.batch import BatchVerifier
+from radius_pkix_cd.scripts import pkix_cd_verify_batch
+from radius_pkix_cd.verifier import Verifier
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+rogue_cert_path = os.path.join("tests/ca1/", private_cert_name)
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class TestIntegrationBatch:
+    """Integration tests for the BatchVerifier class and pkix_cd_verify_batch."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    def write_trust_map(self, tmp_path):
+        """Write a trust map authorizing the private cert, return its path."""
+        cert_hash = DANE.generate_sha_by_selector(self.get_file_contents(private_cert_path), "sha256", 0)
+        trust_map = {"SSID1": {identity_name: {"akis": [], "cert_hashes": [cert_hash]}}}
+        trustmap_path = str(tmp_path / "trust_map.json")
+        with open(trustmap_path, "w") as f_p:
+            json.dump(trust_map, f_p)
+        return trustmap_path
+
+    def get_records(self):
+        """Return input lines, and the exit code expected for each record."""
+        called = "00-00-00-00-00-01:SSID1"
+        records = [({"called": called, "calling": identity_name, "certfile": private_cert_path, "id": 1}, 0),
+                   ({"called": called, "calling": identity_name,
+                     "cert_pem": self.get_file_contents(private_cert_path)}, 0),
+                   ({"called": called, "calling": identity_name, "certfile": rogue_cert_path}, 4),
+                   ({"called": "00-00-00-00-00-01:SSID2", "calling": identity_name,
+                     "certfile": private_cert_path}, 3),
+                   ({"called": called, "calling": identity_name, "certfile": "nope.pem"}, 2),
+                   ({"called": called, "calling": identity_name}, 1),
+                   ({"called": called, "calling": identity_name, "cert_pem": "garbage"}, 1)]
+        lines = [json.dumps(x) for x, _ in records]
+        lines.insert(3, "")
+        lines.append("[\"not\", \"a\", \"record\"]")
+        return lines, [x for _, x in records] + [1]
+
+    def test_integration_batch_verifier(self, tmp_path):
+        """Test that results match pkix_cd_verify's exit codes, in order."""
+        lines, expected = self.get_records()
+        batch = BatchVerifier(Verifier(self.write_trust_map(tmp_path)), concurrency=2)
+        batch.window = 1
+        output = io.StringIO()
+        counts = batch.run(lines + lines, output)
+        results = [json.loads(x) for x in output.getvalue().splitlines()]
+        assert [x["code"] for x in results] == expected + expected
+        assert results[0]["id"] == 1
+        assert results[6]["calling"] == identity_name and results[-1]["calling"] is None
+        assert results[0]["line"] == 1 and results[3]["line"] == 5
+        assert counts[0] == 4
+        # The same file and the same PEM are one certificate, verified once per station.
+        assert len(batch.verdicts) == 3
+
+    def test_integration_batch_verifier_cache_size(self, tmp_path):
+        """Test that certificates and verdicts kept for reuse are bounded."""
+        lines, expected = self.get_records()
+        batch = BatchVerifier(Verifier(self.write_trust_map(tmp_path)), concurrency=2, cache_size=2)
+        output = io.StringIO()
+        batch.run(lines + lines, output)
+        assert [json.loads(x)["code"] for x in output.getvalue().splitlines()] == expected + expected
+        assert len(batch.certificates) == 2
+        assert len(batch.verdicts) == 2
+
+    def test_integration_batch_script(self, tmp_path):
+        """Test pkix_cd_verify_batch end to end, with files."""
+        lines, expected = self.get_records()
+        infile = tmp_path / "sessions.jsonl"
+        infile.write_text("\n".join(lines) + "\n")
+        outfile = tmp_path / "results.jsonl"
+        argv = ["pkix_cd_verify_batch", "--infile", str(infile), "--outfile", str(outfile),
+                "--trustmap", self.write_trust_map(tmp_path), "--concurrency", "4"]
+        with patch("sys.argv", argv), pytest.raises(SystemExit) as exit_info:
+            pkix_cd_verify_batch.main()
+        assert exit_info.value.code == 1
+        results = [json.loads(x) for x in outfile.read_text().splitlines()]
+        assert [x["code"] for x in results] == expected
+        # Exits normally when every record passes.
+        infile.write_text(lines[0] + "\n")
+        with patch("sys.argv", argv):
+            pkix_cd_verify_batch.main()
+
+    def test_integration_batch_script_stdout(self, tmp_path, capsys):
+        """Test that diagnostics printed while verifying don't mix into results on stdout."""
+        lines, expected = self.get_records()
+        infile = tmp_path / "sessions.jsonl"
+        infile.write_text("\n".join(lines) + "\n")
+        argv = ["pkix_cd_verify_batch", "--infile", str(infile),
+                "--trustmap", self.write_trust_map(tmp_path)]
+        verify = Verifier.verify
+
+        def noisy_verify(*args, **kwargs):
+            print("Hash mismatch: Registry: ...")
+            return verify(*args, **kwargs)
+        with patch("sys.argv", argv), patch.object(Verifier, "verify", noisy_verify), pytest.raises(SystemExit):
+            pkix_cd_verify_batch.main()
+        captured = capsys.readouterr()
+        results = [json.loads(x) for x in captured.out.splitlines()]
+        assert [x["code"] for x in results] == expected
+        assert "Hash mismatch" in captured.err
@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+
+here_dir = os.path.dirname(os.path.abspath(__file__))
+benchmark_script = os.path.join(here_dir, "..", "benchmarks", "benchmark_radius_pkix_cd.py")
+
+
+class TestIntegrationBenchmark:
+    """Smoke test for the benchmark suite."""
+
+    def test_integration_benchmark_smoke(self, tmp_path):
+        """Run the benchmarks at a tiny scale, and check the JSON report."""
+        output = str(tmp_path / "bench.json")
+        subprocess.run([sys.executable, benchmark_script, "--sizes", "20", "--realms", "2",
+                        "--iterations", "3", "--cold-iterations", "1", "--burst", "2", "--output", output], check=True)
+        with open(output) as report_file:
+            report = json.load(report_file)
+        benchmarks = {x["benchmark"] for x in report["results"]}
+        assert benchmarks == {"manage_trust", "verify_cold_exec", "verify_in_process",
+                              "verify_client", "burst_client", "burst_cold_exec"}
+        manage = [x for x in report["results"] if x["benchmark"] == "manage_trust"][0]
+        assert manage["peak_rss_kb"] > 0
+        assert manage["dns_queries"] > 20
+        for result in report["results"]:
+            if "latency_ms" in result:
+                assert result["latency_ms"]["p50"] <= result["latency_ms"]["p99"]
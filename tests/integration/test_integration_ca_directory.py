@@ -0,0 +1,105 @@
+import datetime
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from unittest.mock import patch
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from radius_pkix_cd.ca_directory import CADirectory
+
+ca1_cert_path = os.path.join("tests/ca1/", "ca.example.net.cert.pem")
+ca2_cert_path = os.path.join("tests/ca2/", "ca.example.net.cert.pem")
+registry_cert_path = os.path.join("tests/ca2/", "iotreg.ca.cert.pem")
+
+
+class TestIntegrationCADirectory:
+    """Integration tests for the CADirectory class."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file, as bytes."""
+        with open(file_path, "rb") as f_p:
+            return f_p.read()
+
+    def generate_cert(self, attributes):
+        """Return a self-signed PEM certificate with the given subject attributes."""
+        key = ec.generate_private_key(ec.SECP256R1())
+        name = x509.Name([x509.NameAttribute(*x) for x in attributes])
+        now = datetime.datetime.utcnow()
+        cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+                .public_key(key.public_key()).serial_number(1)
+                .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+                .sign(key, hashes.SHA256()))
+        return cert.public_bytes(serialization.Encoding.PEM)
+
+    @pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl not installed")
+    def test_integration_ca_directory_subject_hash(self, tmp_path):
+        """Test that subject hashes match openssl x509 -hash."""
+        certs = [self.get_file_contents(x) for x in [ca1_cert_path, ca2_cert_path, registry_cert_path]]
+        certs.append(self.generate_cert([(NameOID.COUNTRY_NAME, "CA"),
+                                         (NameOID.ORGANIZATION_NAME, "  Example   Networks\tInc "),
+                                         (NameOID.COMMON_NAME, "MiXeD Case Root CA")]))
+        certs.append(self.generate_cert([(NameOID.COMMON_NAME, "Ünïcödé Root"),
+                                         (NameOID.DOMAIN_COMPONENT, "Example")]))
+        for num, cert in enumerate(certs):
+            cert_path = tmp_path / "cert{}.pem".format(num)
+            cert_path.write_bytes(cert)
+            expected = subprocess.run(["openssl", "x509", "-hash", "-noout", "-in", str(cert_path)],
+                                      check=True, stdout=subprocess.PIPE).stdout.decode().strip()
+            assert CADirectory.get_subject_hash(cert) == expected
+
+    def test_integration_ca_directory_sync(self, tmp_path):
+        """Test incremental sync, dedupe, and gap-free numbering."""
+        ca1, ca2, registry = [self.get_file_contents(x) for x in
+                              [ca1_cert_path, ca2_cert_path, registry_cert_path]]
+        # Both example.net CAs have the same subject, and so the same hash.
+        shared_hash = CADirectory.get_subject_hash(ca1)
+        assert CADirectory.get_subject_hash(ca2) == shared_hash
+        registry_hash = CADirectory.get_subject_hash(registry)
+        cadir = CADirectory(str(tmp_path / "cadir"))
+        assert cadir.sync([ca1, ca2, registry, ca1]) == (3, 0)
+        assert sorted(os.listdir(cadir.path)) == sorted(["{}.0".format(shared_hash), "{}.1".format(shared_hash),
+                                                         "{}.0".format(registry_hash)])
+        registry_stat = os.stat(cadir.get_file_path(registry_hash, 0))
+        assert cadir.sync([registry, ca1, ca2]) == (0, 0)
+        # Dropping ca1 (at .0) moves ca2 down to .0, and leaves the registry alone.
+        assert cadir.sync([ca2, registry]) == (0, 1)
+        assert sorted(os.listdir(cadir.path)) == sorted(["{}.0".format(shared_hash),
+                                                         "{}.0".format(registry_hash)])
+        assert self.get_file_contents(cadir.get_file_path(shared_hash, 0)) == ca2
+        assert os.stat(cadir.get_file_path(registry_hash, 0)).st_ino == registry_stat.st_ino
+        assert cadir.sync([]) == (0, 2)
+        assert os.listdir(cadir.path) == []
+
+    def test_integration_ca_directory_sync_order(self, tmp_path):
+        """Test that a certificate staying in the directory can be found throughout a sync."""
+        ca1, ca2, registry = [self.get_file_contents(x) for x in
+                              [ca1_cert_path, ca2_cert_path, registry_cert_path]]
+        shared_hash = CADirectory.get_subject_hash(ca1)
+        cadir = CADirectory(str(tmp_path / "cadir"))
+        cadir.sync([ca1, ca2])
+        assert self.get_file_contents(cadir.get_file_path(shared_hash, 1)) == ca2
+        unlink = os.unlink
+        unlinked = []
+
+        def check_unlink(path):
+            unlink(path)
+            unlinked.append(path)
+            # As OpenSSL looks up the issuer: HASH.0, HASH.1, ... up to the first missing file.
+            found = []
+            while os.path.exists(cadir.get_file_path(shared_hash, len(found))):
+                found.append(self.get_file_contents(cadir.get_file_path(shared_hash, len(found))))
+            assert ca2 in found
+        with patch("os.unlink", side_effect=check_unlink):
+            assert cadir.sync([ca2, registry]) == (1, 1)
+        assert unlinked
+        assert sorted(os.listdir(cadir.path)) == sorted(["{}.0".format(shared_hash),
+                                                         "{}.0".format(CADirectory.get_subject_hash(registry))])
+        assert self.get_file_contents(cadir.get_file_path(shared_hash, 0)) == ca2
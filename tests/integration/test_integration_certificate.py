@@ -0,0 +1,85 @@
+import datetime
+import os
+
+import pytest
+
+from unittest.mock import patch
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.name import _ASN1Type
+from cryptography.x509.oid import NameOID
+from dane_discovery.dane import DANE
+from dane_discovery.pki import PKI
+
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.verifier import Verifier
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+
+
+class TestIntegrationCertificate:
+    """Integration tests for the CertificateContext class."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    def generate_cert(self, common_name, string_type=_ASN1Type.UTF8String):
+        """Return a DER certificate with ``common_name`` encoded as ``string_type``."""
+        key = ec.generate_private_key(ec.SECP256R1())
+        subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name, string_type)])
+        issuer = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Example Networks CA1")])
+        now = datetime.datetime.utcnow()
+        cert = (x509.CertificateBuilder().subject_name(subject).issuer_name(issuer)
+                .public_key(key.public_key()).serial_number(1)
+                .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+                .sign(key, hashes.SHA256()))
+        return cert.public_bytes(serialization.Encoding.DER)
+
+    def test_integration_certificate_matches_dane_discovery(self):
+        """Test that derived values match the dane_discovery helpers."""
+        cert_pem = self.get_file_contents(private_cert_path)
+        cert_der = PKI.serialize_cert(PKI.build_x509_object(cert_pem), "DER")
+        for certificate in [cert_pem, cert_der]:
+            context = CertificateContext(certificate)
+            assert context.sha256 == DANE.generate_sha_by_selector(cert_pem, "sha256", 0)
+            assert context.get_sha256(1) == DANE.generate_sha_by_selector(cert_pem, "sha256", 1)
+            assert context.meta == PKI.get_cert_meta(cert_pem)
+            assert context.common_name == PKI.get_cert_meta(cert_pem)["subject"]["commonName"]
+            assert context.aki == PKI.get_authority_key_id_from_certificate(cert_pem)
+            assert context.pem == PKI.der_to_pem(context.der)
+
+    def test_integration_certificate_parses_once(self):
+        """Test that the certificate is only decoded once."""
+        cert_pem = self.get_file_contents(private_cert_path)
+        context = CertificateContext.wrap(cert_pem)
+        assert CertificateContext.wrap(context) is context
+        with patch.object(PKI, "build_x509_object", wraps=PKI.build_x509_object) as mock_build:
+            context.sha256
+            context.common_name
+            context.aki
+            context.get_sha256(1)
+        assert mock_build.call_count == 1
+
+    def test_integration_certificate_common_name_strings(self):
+        """Test that commonNames are decoded by type, and undecodable ones rejected."""
+        for string_type in [_ASN1Type.UTF8String, _ASN1Type.BMPString, _ASN1Type.UniversalString]:
+            assert CertificateContext(self.generate_cert("caf\u00e9.iotregistry.ca", string_type)).common_name == \
+                "caf\u00e9.iotregistry.ca"
+        printable_der = self.generate_cert("abc.iotregistry.ca", _ASN1Type.PrintableString)
+        assert CertificateContext(printable_der).common_name == "abc.iotregistry.ca"
+        # T61String is read as Latin-1, as OpenSSL does.
+        t61_der = printable_der.replace(b"\x13\x12abc.iotregistry.ca", b"\x14\x12\xe9bc.iotregistry.ca")
+        assert CertificateContext(t61_der).common_name == "\u00e9bc.iotregistry.ca"
+        # Not ASCII, in a PrintableString, and not UTF-8, in a UTF8String.
+        for der in [printable_der.replace(b"abc.iotregistry.ca", b"\xe1bc.iotregistry.ca"),
+                    self.generate_cert("abc.iotregistry.ca").replace(b"abc.iotregistry.ca", b"\xffbc.iotregistry.ca")]:
+            with pytest.raises(ValueError):
+                CertificateContext(der).common_name
+            code, messages = Verifier("nope.json").check_registry(CertificateContext(der), False, None)
+            assert code == Verifier.EXIT_REGISTRY_FAILED
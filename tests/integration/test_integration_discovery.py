@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+
+from unittest.mock import patch
+
+from dane_discovery.dane import DANE
+from dane_discovery.exceptions import TLSAError
+
+from radius_pkix_cd.discovery import Discovery
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+ca_cert_path = os.path.join("tests/ca2/", "ca.example.net.cert.pem")
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class TestIntegrationDiscovery:
+    """Integration tests for the Discovery class."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    def generate_response(self, msgs):
+        """Return an rrset for testing."""
+        response = {"dnssec": False, "tcp": True, "tls": False,
+                    "responses": msgs}
+        return response
+
+    def test_integration_discovery_discover_identity(self):
+        """Test discovery of a PKIX-CD identity and its root certificate."""
+        cert_pem = self.get_file_contents(private_cert_path)
+        ca_pem = self.get_file_contents(ca_cert_path)
+        tlsa = "{}. 300 IN TLSA {}".format(identity_name, DANE.generate_tlsa_record(4, 0, 0, cert_pem))
+        with patch.object(DANE, "get_responses", return_value=self.generate_response([tlsa])), \
+                patch.object(DANE, "wrap_requests", return_value=ca_pem.encode()):
+            result = Discovery.discover_identity(identity_name)
+        assert result["cert_hashes"] == [DANE.generate_sha_by_selector(cert_pem, "sha256", 0)]
+        assert len(result["akis"]) == 1
+        assert result["ca_certificates"] == [ca_pem.encode()]
+        assert result["ttl"] == 300
+
+    def test_integration_discovery_discover_all(self):
+        """Test that discovery is concurrent, bounded, and skips failures."""
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def fake_discover(dnsname, ns_override=None):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            if dnsname.startswith("bad"):
+                raise TLSAError("No TLSA records for {}".format(dnsname))
+            return {"akis": [dnsname], "cert_hashes": [dnsname], "ca_certificates": [b"root"]}
+
+        dnsnames = ["{}{}._device.example.com".format("bad" if x % 5 == 0 else "dev", x)
+                    for x in range(40)]
+        with patch.object(Discovery, "discover_identity", side_effect=fake_discover):
+            results = Discovery.discover_all(dnsnames, None, 4)
+        assert list(results.keys()) == [x for x in dnsnames if not x.startswith("bad")]
+        assert 1 < in_flight[1] <= 4
+
+    def test_integration_discovery_build_trust_map(self):
+        """Test that results land in every realm the identity belongs to."""
+        authz_config = {"my._device.example.com": ["SSID1"],
+                        "your._device.example.com": ["SSID1", "SSID2"],
+                        "gone._device.example.com": ["SSID2"]}
+        discovered = {"my._device.example.com": {"akis": ["a1"], "cert_hashes": ["h1"],
+                                                  "ca_certificates": [b"root1"]},
+                      "your._device.example.com": {"akis": ["a2"], "cert_hashes": ["h2"],
+                                                    "ca_certificates": [b"root1", b"root2"]}}
+        trust_map, ca_certificates = Discovery.build_trust_map(authz_config, discovered)
+        expected = {"SSID1": {"my._device.example.com": {"akis": ["a1"], "cert_hashes": ["h1"]},
+                              "your._device.example.com": {"akis": ["a2"], "cert_hashes": ["h2"]}},
+                    "SSID2": {"your._device.example.com": {"akis": ["a2"], "cert_hashes": ["h2"]},
+                              "gone._device.example.com": {}}}
+        assert trust_map == expected
+        assert ca_certificates == {b"root1", b"root2"}
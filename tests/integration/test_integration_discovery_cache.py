@@ -0,0 +1,52 @@
+from unittest.mock import patch
+
+from radius_pkix_cd.discovery import Discovery
+from radius_pkix_cd.discovery_cache import DiscoveryCache
+
+
+class TestIntegrationDiscoveryCache:
+    """Integration tests for the DiscoveryCache class."""
+
+    def generate_result(self, dnsname, ttl=300):
+        """Return a discovery result for testing."""
+        return {"akis": ["aki-" + dnsname], "cert_hashes": ["hash-" + dnsname],
+                "ca_certificates": [b"root"], "ttl": ttl}
+
+    def test_integration_discovery_cache_expiry(self, tmp_path):
+        """Test that entries honor the TLSA TTL and the max TTL."""
+        cache = DiscoveryCache(str(tmp_path / "cache.json"), max_ttl=600)
+        cache.set("short._device.example.com", self.generate_result("short", 30), now=1000)
+        cache.set("long._device.example.com", self.generate_result("long", 86400), now=1000)
+        assert cache.get("short._device.example.com", now=1029)["cert_hashes"] == ["hash-short"]
+        assert cache.get("short._device.example.com", now=1030) is None
+        assert cache.get("long._device.example.com", now=1599)["ca_certificates"] == [b"root"]
+        assert cache.get("long._device.example.com", now=1600) is None
+        assert cache.get("missing._device.example.com", now=1000) is None
+
+    def test_integration_discovery_cache_persistence(self, tmp_path):
+        """Test that the cache survives a save and reload, and tolerates garbage."""
+        cache_path = tmp_path / "cache.json"
+        cache = DiscoveryCache(str(cache_path))
+        cache.set("a._device.example.com", self.generate_result("a"))
+        cache.set("b._device.example.com", self.generate_result("b"))
+        cache.retain(["a._device.example.com"])
+        cache.save()
+        reloaded = DiscoveryCache(str(cache_path))
+        assert reloaded.get("a._device.example.com")["akis"] == ["aki-a"]
+        assert reloaded.get("b._device.example.com") is None
+        cache_path.write_text("{not json")
+        assert DiscoveryCache(str(cache_path)).entries == {}
+
+    def test_integration_discovery_cache_discover_all(self, tmp_path):
+        """Test that discovery only queries identities missing from the cache."""
+        cache = DiscoveryCache(str(tmp_path / "cache.json"))
+        cache.set("cached._device.example.com", self.generate_result("cached"))
+        cache.set("removed._device.example.com", self.generate_result("removed"))
+        dnsnames = ["new._device.example.com", "cached._device.example.com"]
+        with patch.object(Discovery, "discover_identity",
+                          side_effect=lambda x, y: self.generate_result(x)) as mock_discover:
+            results = Discovery.discover_all(dnsnames, None, 2, cache)
+        mock_discover.assert_called_once_with("new._device.example.com", None)
+        assert list(results.keys()) == dnsnames
+        assert results["cached._device.example.com"]["akis"] == ["aki-cached"]
+        assert sorted(cache.entries.keys()) == sorted(dnsnames)
@@ -0,0 +1,67 @@
+import os
+
+import dns.exception
+import pytest
+
+from unittest.mock import patch
+
+from dane_discovery.dane import DANE
+from dane_discovery.exceptions import TLSAError
+
+from radius_pkix_cd.discovery import Discovery
+from radius_pkix_cd.dns_snapshot import DNSSnapshot
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+ca_cert_path = os.path.join("tests/ca2/", "ca.example.net.cert.pem")
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class TestIntegrationDNSSnapshot:
+    """Integration tests for the DNSSnapshot class."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    def fake_get_responses(self, dnsname, rr_type, nsaddr=None, dns_timeout=5):
+        """Serve one identity, and fail for everything else."""
+        if dnsname != identity_name:
+            raise dns.exception.DNSException("NXDOMAIN {}".format(dnsname))
+        cert_pem = self.get_file_contents(private_cert_path)
+        tlsa = "{}. 300 IN TLSA {}".format(identity_name, DANE.generate_tlsa_record(4, 0, 0, cert_pem))
+        return {"dnssec": False, "tcp": True, "tls": False, "responses": [tlsa]}
+
+    def test_integration_dns_snapshot_record_replay(self, tmp_path):
+        """Test that a replayed discovery matches the recorded one, offline."""
+        ca_pem = self.get_file_contents(ca_cert_path)
+        snapshot_path = str(tmp_path / "dns.snapshot")
+        dnsnames = [identity_name, "gone._device.example.net"]
+        with patch.object(DANE, "get_responses", side_effect=self.fake_get_responses), \
+                patch.object(DANE, "wrap_requests", return_value=ca_pem.encode()):
+            snapshot = DNSSnapshot(snapshot_path)
+            with snapshot.record():
+                recorded = Discovery.discover_all(dnsnames)
+            snapshot.save()
+        assert list(recorded.keys()) == [identity_name]
+        original = DANE.__dict__["get_responses"]
+        with patch.object(DANE, "get_a_record", side_effect=AssertionError("Network used")):
+            with DNSSnapshot.load(snapshot_path).replay():
+                replayed = Discovery.discover_all(dnsnames)
+                with pytest.raises(TLSAError):
+                    DANE.get_tlsa_records("gone._device.example.net")
+                with pytest.raises(TLSAError):
+                    DANE.get_tlsa_records("unrecorded._device.example.net")
+        assert DANE.__dict__["get_responses"] is original
+        assert replayed == recorded
+
+    def test_integration_dns_snapshot_invalid(self, tmp_path):
+        """Test that an invalid snapshot file raises ValueError."""
+        snapshot_path = str(tmp_path / "dns.snapshot")
+        with open(snapshot_path, "w") as snapshot_file:
+            snapshot_file.write("not a snapshot")
+        with pytest.raises(ValueError):
+            DNSSnapshot.load(snapshot_path)
+        with pytest.raises(FileNotFoundError):
+            DNSSnapshot.load(str(tmp_path / "missing"))
@@ -0,0 +1,142 @@
+import itertools
+import json
+import os
+
+import pytest
+
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.domain_policy import DomainPolicy
+from radius_pkix_cd.sharded_trust_map import ShardedTrustMap
+from radius_pkix_cd.trust_index import TrustIndex
+from radius_pkix_cd.trust_journal import TrustJournal
+from radius_pkix_cd.trust_map import TrustMap
+from radius_pkix_cd.utility import Utility
+from radius_pkix_cd.verifier import Verifier
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+registry_cert_path = os.path.join("tests/ca2/", "iotreg.ca.cert.pem")
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class TestIntegrationDomainPolicy:
+    """Integration tests for the DomainPolicy class, and subtree grants."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    def test_integration_domain_policy_matches(self):
+        """Test that matching agrees with Utility.dnsname_in_domain."""
+        domains = ["example.com", "_device.example.net", "iotregistry.ca", "a.b.c.d"]
+        names = ["example.com", "x.example.com", "X.Example.COM.", "y.x.example.com", "badexample.com",
+                 "my._device.example.net", "_device.example.net", "example.net", "b.c.d", "z.a.b.c.d"]
+        for domain, name in itertools.product(domains, names):
+            assert DomainPolicy([domain]).matches(name) == Utility.dnsname_in_domain(name, domain)
+        policy = DomainPolicy(domains)
+        for name in names:
+            assert policy.matches(name) == any(Utility.dnsname_in_domain(name, x) for x in domains)
+
+    def test_integration_domain_policy_values(self):
+        """Test values, removal and pruning."""
+        policy = DomainPolicy()
+        policy.add("*.example.com", "SSID1")
+        policy.add("*.sub.example.com", "SSID2")
+        policy.add("*.sub.example.com", "SSID3")
+        assert policy.get_values("a.sub.example.com") == {"SSID1", "SSID2", "SSID3"}
+        assert policy.get_values("sub.example.com") == {"SSID1"}
+        # An empty label mustn't walk into a node's values.
+        assert policy.get_values("a..example.com") == set()
+        with pytest.raises(ValueError):
+            policy.matches("a..example.com")
+        policy.remove("*.sub.example.com", "SSID2")
+        assert policy.get_values("a.sub.example.com") == {"SSID1", "SSID3"}
+        policy.remove("*.sub.example.com", "SSID3")
+        policy.remove("*.example.com", "SSID1")
+        assert policy.root == {}
+        assert DomainPolicy.get_wildcards("a.b.example.com") == ["*.b.example.com", "*.example.com", "*.com"]
+
+    def test_integration_domain_policy_malformed_registry_name(self):
+        """Test that a commonName with an empty label fails the registry check, rather than skip it."""
+        for common_name in ["a..iotregistry.ca", ".iotregistry.ca", ""]:
+            certificate = Mock(spec=CertificateContext, common_name=common_name)
+            with pytest.raises(ValueError):
+                Utility.check_iot_registry_issuance(certificate)
+            code, _ = Verifier("nope.json").check_registry(certificate, False, None)
+            assert code == Verifier.EXIT_REGISTRY_FAILED
+
+    def test_integration_domain_policy_load(self, tmp_path):
+        """Test loading domains from a file."""
+        domains_path = tmp_path / "domains"
+        domains_path.write_text("# Registries\n\niotregistry.ca\n*.registry.example.org\n")
+        policy = DomainPolicy.load(str(domains_path))
+        assert policy.matches("device.iotregistry.ca")
+        assert policy.matches("device.registry.example.org")
+        assert not policy.matches("registry.example.org")
+        domains_path.write_text("iotregistry.ca\nnot a domain\n")
+        with pytest.raises(ValueError, match=":2:"):
+            DomainPolicy.load(str(domains_path))
+
+    def test_integration_domain_policy_registry_domains(self, tmp_path):
+        """Test that registry issuance follows the configured domains."""
+        registry_cert_pem = self.get_file_contents(registry_cert_path)
+        assert Utility.check_iot_registry_issuance(registry_cert_pem)
+        assert not Utility.check_iot_registry_issuance(registry_cert_pem, DomainPolicy(["example.org"]))
+        private_cert_pem = self.get_file_contents(private_cert_path)
+        assert Utility.check_iot_registry_issuance(private_cert_pem, DomainPolicy(["example.net"]))
+
+    def test_integration_domain_policy_access_list(self):
+        """Test that subtree grants are accepted in the access list."""
+        errors = []
+        lines = ["SSID1|*._device.example.com", "SSID1|*.*.example.com", "SSID1|my.*.example.com"]
+        parsed = list(Utility.parse_authz_lines(lines, "test", errors))
+        assert parsed == [("SSID1", "*._device.example.com")]
+        assert [x[1] for x in errors] == [2, 3]
+
+    def write_trust_maps(self, tmp_path):
+        """Write a trust map with a subtree grant in each format, return their paths."""
+        # Mixed case, which every format must match case-insensitively.
+        trust_map = {"SSID1": {"*._Device.Example.net": {"akis": [], "cert_hashes": []}},
+                     "SSID2": {"other._device.example.com": {"akis": [], "cert_hashes": []}}}
+        trustmap_path = str(tmp_path / "trust_map.json")
+        with open(trustmap_path, "w") as f_p:
+            json.dump(trust_map, f_p)
+        index_path = str(tmp_path / "trust_map.idx")
+        TrustIndex.write(index_path, trust_map)
+        shards_path = str(tmp_path / "shards")
+        ShardedTrustMap.write(shards_path, trust_map)
+        return [trustmap_path, index_path, shards_path]
+
+    def test_integration_domain_policy_subtree_grant(self, tmp_path):
+        """Test that subtree grants authorize identities under them, with live verify."""
+        cert_pem = self.get_file_contents(private_cert_path)
+        identity = Mock(dane_credentials=[{"tlsa_parsed": {"ttl": 120}}])
+        for path in self.write_trust_maps(tmp_path):
+            verifier = Verifier(path)
+            with patch("dane_discovery.identity.Identity", return_value=identity) as identity_class:
+                identity.validate_certificate.return_value = (True, "Valid")
+                assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 0
+                identity.validate_certificate.return_value = (False, "Wrong CA")
+                assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 5
+                assert verifier.verify("00-00-00-00-00-01:SSID1", "_device.example.net", cert_pem)[0] == 3
+                assert verifier.verify("00-00-00-00-00-01:SSID1", "a.._device.example.net", cert_pem)[0] == 3
+                assert verifier.verify("00-00-00-00-00-01:SSID2", identity_name, cert_pem)[0] == 3
+            assert identity_class.call_count == 2
+
+    def test_integration_domain_policy_journal(self):
+        """Test that journaled changes add and remove subtree grants, in a new TrustMap."""
+        old = {"SSID1": {"*.example.com": {"akis": [], "cert_hashes": []}}}
+        new = {"SSID2": {"*.example.com": {"akis": [], "cert_hashes": []}}}
+        trust_map = TrustMap(json.loads(json.dumps(old)))
+        assert trust_map.has_subtree_grant("SSID1", "my.example.com")
+        changed = trust_map.apply_changes(TrustJournal.get_changes(old, new))
+        assert not changed.has_subtree_grant("SSID1", "my.example.com")
+        assert changed.has_subtree_grant("SSID2", "my.example.com")
+        # Readers of the old one still see it whole.
+        assert trust_map.trust_map == old
+        assert trust_map.has_subtree_grant("SSID1", "my.example.com")
+        assert not trust_map.has_subtree_grant("SSID2", "my.example.com")
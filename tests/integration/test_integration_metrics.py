@@ -0,0 +1,82 @@
+import json
+import os
+import socket
+
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from dane_discovery.dane import DANE
+
+from radius_pkix_cd import dns_dispatch
+from radius_pkix_cd import metrics
+from radius_pkix_cd.verifier import Verifier
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class TestIntegrationMetrics:
+    """Integration tests for the metrics module."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    def write_trust_map(self, tmp_path):
+        """Write a trust map authorizing the private cert, return its path."""
+        cert_hash = DANE.generate_sha_by_selector(self.get_file_contents(private_cert_path), "sha256", 0)
+        trust_map = {"SSID1": {identity_name: {"akis": [], "cert_hashes": [cert_hash]}}}
+        trustmap_path = str(tmp_path / "trust_map.json")
+        with open(trustmap_path, "w") as f_p:
+            json.dump(trust_map, f_p)
+        return trustmap_path
+
+    def test_integration_metrics_json_log(self, tmp_path):
+        """Test that each verify appends a JSON line with stages and outcome."""
+        log_path = str(tmp_path / "metrics.log")
+        verifier = Verifier(self.write_trust_map(tmp_path), metrics_log=log_path)
+        cert_pem = self.get_file_contents(private_cert_path)
+        verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)
+        verifier.verify("00-00-00-00-00-01:SSID2", identity_name, cert_pem)
+        with open(log_path) as log_file:
+            lines = [json.loads(x) for x in log_file]
+        assert [x["outcome"] for x in lines] == [Verifier.EXIT_OK, Verifier.EXIT_INVALID_CALLED_STATION]
+        assert set(lines[0]["stages_ms"]) == {"load_trust_map", "lookup_identity", "hash_certificate",
+                                              "lookup_cert_hash", "registry"}
+        assert set(lines[1]["stages_ms"]) == {"load_trust_map", "lookup_identity"}
+        assert lines[0]["operation"] == "verify"
+        assert lines[0]["labels"]["calling"] == identity_name
+        assert lines[0]["duration_ms"] >= sum(lines[0]["stages_ms"].values())
+        assert metrics.current() is metrics.NULL_METRICS
+
+    def test_integration_metrics_disabled(self, tmp_path):
+        """Test that without exporters, nothing is recorded."""
+        verifier = Verifier(self.write_trust_map(tmp_path))
+        assert verifier.metrics_exporters == []
+        assert metrics.start([], "verify") is metrics.NULL_METRICS
+        with metrics.NULL_METRICS.stage("anything"):
+            metrics.current().incr("anything")
+        assert metrics.NULL_METRICS.stages == {}
+        assert metrics.NULL_METRICS.counters == {}
+
+    def test_integration_metrics_statsd(self):
+        """Test statsd timers and counters, including DNS query counts."""
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(5)
+        exporter = metrics.StatsdExporter("127.0.0.1:{}".format(receiver.getsockname()[1]))
+        operation = metrics.Metrics("verify")
+        lookup = lambda: dns_dispatch.get_responses("x._device.example.net", "TLSA")
+        with patch.object(dns_dispatch, "pool", Mock()), operation.activate(), operation.stage("live_verify"):
+            lookup()
+            lookup()
+        operation.finish(5)
+        exporter.export(operation)
+        lines = receiver.recv(65535).decode().splitlines()
+        receiver.close()
+        assert "radius_pkix_cd.verify.outcome.5:1|c" in lines
+        assert "radius_pkix_cd.verify.dns_queries:2|c" in lines
+        assert [x for x in lines if x.startswith("radius_pkix_cd.verify.stage.live_verify:")]
+        assert [x for x in lines if x.startswith("radius_pkix_cd.verify.duration:")]
@@ -0,0 +1,210 @@
+import os
+import socketserver
+import struct
+import threading
+
+import dns.message
+import dns.rcode
+import dns.rrset
+import pytest
+
+from unittest.mock import patch
+
+from dane_discovery.dane import DANE
+from dane_discovery.exceptions import TLSAError
+
+from radius_pkix_cd import dns_dispatch
+from radius_pkix_cd import metrics
+from radius_pkix_cd import resolver_pool
+from radius_pkix_cd.discovery import Discovery
+from radius_pkix_cd.resolver_pool import ResolverPool
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+ca_cert_path = os.path.join("tests/ca2/", "ca.example.net.cert.pem")
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class FakeNameServerHandler(socketserver.BaseRequestHandler):
+    """Answer DNS queries over TCP, many per connection."""
+
+    def handle(self):
+        """Answer queries until the client closes the connection."""
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        while True:
+            header = self.read(2)
+            if header is None:
+                return
+            query = dns.message.from_wire(self.read(struct.unpack("!H", header)[0]))
+            with server.lock:
+                server.queries += 1
+            response = dns.message.make_response(query)
+            question = query.question[0]
+            name = question.name.to_text().rstrip(".")
+            if name in server.records:
+                response.answer.append(dns.rrset.from_text(question.name, 300, "IN", "TLSA",
+                                                           server.records[name]))
+            else:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+                response.authority.append(dns.rrset.from_text(
+                    "example.net.", 3600, "IN", "SOA",
+                    "ns.example.net. admin.example.net. 1 7200 3600 1209600 30"))
+            wire = response.to_wire()
+            self.request.sendall(struct.pack("!H", len(wire)) + wire)
+
+    def read(self, count):
+        """Return ``count`` bytes, or None if the connection closed first."""
+        data = b""
+        while len(data) < count:
+            chunk = self.request.recv(count - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+class FakeNameServer(socketserver.ThreadingTCPServer):
+    """Name server on localhost, counting connections and queries."""
+
+    daemon_threads = True
+
+    def __init__(self, records):
+        """Serve TLSA ``records``, a dict of DNS name to record data."""
+        self.records = records
+        self.connections = 0
+        self.queries = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), FakeNameServerHandler)
+
+
+class TestIntegrationResolverPool:
+    """Integration tests for the ResolverPool class."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    @pytest.fixture
+    def nameserver(self):
+        """Run a fake name server serving the private cert's identity."""
+        cert_pem = self.get_file_contents(private_cert_path)
+        server = FakeNameServer({identity_name: DANE.generate_tlsa_record(4, 0, 0, cert_pem)})
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def get_pool(self, nameserver):
+        """Return a ResolverPool pointed at the fake name server's port."""
+        pool = ResolverPool("tcp")
+        pool.ports = {"tcp": nameserver.server_address[1]}
+        return pool
+
+    def test_integration_resolver_pool_reuse_and_cache(self, nameserver):
+        """Test that lookups share one connection, and repeats are cached."""
+        pool = self.get_pool(nameserver)
+        operation = metrics.Metrics("manage_trust")
+        with operation.activate():
+            first = pool.get_responses(identity_name, "TLSA", "127.0.0.1")
+            again = pool.get_responses(identity_name, "TLSA", "127.0.0.1")
+            for _ in range(3):
+                pool.get_responses("gone._device.example.net", "TLSA", "127.0.0.1")
+        pool.close()
+        assert first["tcp"] and not first["tls"]
+        assert " 300 IN TLSA 4 0 0 " in first["responses"][0]
+        # The same record, with its TTL counted down.
+        assert again["responses"][0].split()[2:] == first["responses"][0].split()[2:]
+        assert nameserver.connections == 1
+        assert nameserver.queries == 2
+        assert operation.counters["dns_pool_cache_hit"] == 3
+        assert operation.counters["dns_pool_queries"] == 2
+
+    def test_integration_resolver_pool_ttl(self, nameserver):
+        """Test that cached answers count down their TTL, and expire."""
+        pool = self.get_pool(nameserver)
+        with patch("radius_pkix_cd.resolver_pool.time.time", return_value=1000.0):
+            pool.get_responses(identity_name, "TLSA", "127.0.0.1")
+        with patch("radius_pkix_cd.resolver_pool.time.time", return_value=1200.0):
+            cached = pool.get_responses(identity_name, "TLSA", "127.0.0.1")
+        assert " 100 IN TLSA " in cached["responses"][0]
+        assert nameserver.queries == 1
+        # Empty answers are only kept for the SOA minimum.
+        with patch("radius_pkix_cd.resolver_pool.time.time", return_value=1000.0):
+            pool.get_responses("gone._device.example.net", "TLSA", "127.0.0.1")
+        with patch("radius_pkix_cd.resolver_pool.time.time", return_value=1031.0):
+            pool.get_responses("gone._device.example.net", "TLSA", "127.0.0.1")
+        pool.close()
+        assert nameserver.queries == 3
+
+    def test_integration_resolver_pool_reconnect(self, nameserver):
+        """Test that a query on a connection the server closed is retried."""
+        pool = self.get_pool(nameserver)
+        pool.get_responses("one._device.example.net", "TLSA", "127.0.0.1")
+        for connection, _ in pool.connections["127.0.0.1"]:
+            # As if the server had dropped the idle connection.
+            connection.close()
+        result = pool.get_responses(identity_name, "TLSA", "127.0.0.1")
+        pool.close()
+        assert result["responses"]
+        assert nameserver.connections == 2
+
+    def test_integration_resolver_pool_prefetch(self, nameserver):
+        """Test that prefetched names are answered without more queries."""
+        pool = self.get_pool(nameserver)
+        pool.pipeline_depth = 4
+        dnsnames = [identity_name] + ["{}._device.example.net".format(x) for x in range(9)]
+        assert pool.prefetch(dnsnames + [identity_name], "TLSA", "127.0.0.1") == 10
+        with pytest.raises(TLSAError):
+            with pool.intercept():
+                DANE.get_tlsa_records("0._device.example.net", "127.0.0.1")
+        assert nameserver.connections == 1
+        assert nameserver.queries == 10
+
+    def test_integration_resolver_pool_transport_details(self, capsys):
+        """Test that responses report the pool's transport, and prefetch failures go to stderr."""
+        response = dns.message.make_response(dns.message.make_query(identity_name, "TLSA"))
+        assert ResolverPool("tls").get_query_details(response, "TLSA")["tls"]
+        assert not ResolverPool("tcp").get_query_details(response, "TLSA")["tls"]
+        listener = socketserver.TCPServer(("127.0.0.1", 0), socketserver.BaseRequestHandler)
+        port = listener.server_address[1]
+        listener.server_close()
+        pool = ResolverPool("tcp")
+        pool.ports = {"tcp": port}
+        assert pool.prefetch([identity_name], "TLSA", "127.0.0.1") == 0
+        captured = capsys.readouterr()
+        assert "Unable to prefetch from 127.0.0.1" in captured.err
+        assert captured.out == ""
+
+    def test_integration_resolver_pool_discovery(self, nameserver):
+        """Test that discovery runs through the pool, and DANE is restored after."""
+        ca_pem = self.get_file_contents(ca_cert_path)
+        pool = self.get_pool(nameserver)
+        original = DANE.__dict__["get_responses"]
+        with patch.object(ResolverPool, "wrap_requests", return_value=ca_pem.encode()):
+            with pool.intercept() as resolvers:
+                discovered = Discovery.discover_all([identity_name, "gone._device.example.net"],
+                                                    "127.0.0.1", 4, None, resolvers)
+        assert DANE.__dict__["get_responses"] is original
+        assert list(discovered) == [identity_name]
+        assert nameserver.queries == 2
+
+    def test_integration_resolver_pool_install(self):
+        """Test that the process-wide pool is installed once, and its lookups still counted."""
+        with patch.object(resolver_pool, "installed", None), patch.object(dns_dispatch, "pool", None), \
+                patch.dict(dns_dispatch.originals, clear=True), \
+                patch.object(DANE, "get_responses"), patch.object(DANE, "wrap_requests"):
+            operation = metrics.Metrics("verify")
+            with operation.activate():
+                pool = resolver_pool.install("tcp")
+                assert resolver_pool.install("tls") is pool
+                assert pool.transport == "tcp"
+                with patch.object(pool, "get_responses", return_value={"responses": []}) as get_responses:
+                    assert DANE.get_responses(identity_name, "TLSA") == {"responses": []}
+                assert get_responses.call_count == 1
+            assert operation.counters["dns_queries"] == 1
+        with pytest.raises(ValueError):
+            ResolverPool("udp")
@@ -0,0 +1,58 @@
+import sqlite3
+
+from radius_pkix_cd.result_cache import ResultCache
+
+
+class TestIntegrationResultCache:
+    """Integration tests for the ResultCache class."""
+
+    def test_integration_result_cache_expiry(self, tmp_path):
+        """Test that results expire, with separate caps for negative results."""
+        cache = ResultCache(str(tmp_path / "cache.db"), max_ttl=100, negative_ttl=10)
+        cache.set("good", {"ok": True}, 300, now=1000)
+        cache.set("bad", False, 300, negative=True, now=1000)
+        cache.set("never", True, 0, now=1000)
+        assert cache.get("good", now=1099)["value"] == {"ok": True}
+        assert cache.get("good", now=1100) is None
+        assert cache.get("bad", now=1009)["value"] is False
+        assert cache.get("bad", now=1010) is None
+        assert cache.get("bad", now=1010, allow_expired=True)["stored"] == 1000
+        assert cache.get("never", now=1000) is None
+
+    def test_integration_result_cache_shared(self, tmp_path):
+        """Test that two caches on the same file see each other's results."""
+        cache_path = str(tmp_path / "cache.db")
+        ResultCache(cache_path).set("key", [1, 2], 60)
+        assert ResultCache(cache_path).get("key")["value"] == [1, 2]
+
+    def test_integration_result_cache_unavailable(self, tmp_path):
+        """Test that an unusable cache file behaves as an empty cache."""
+        cache = ResultCache(str(tmp_path / "missing" / "cache.db"))
+        cache.set("key", True, 60)
+        assert cache.get("key") is None
+
+    def test_integration_result_cache_eviction(self, tmp_path):
+        """Test that the least recently used results are evicted first."""
+        cache = ResultCache(str(tmp_path / "cache.db"), max_entries=2)
+        cache.set("a", 1, 600, now=1000)
+        cache.set("b", 2, 600, now=1001)
+        # Recently read results count as recently used.
+        assert cache.get("a", now=1000 + cache.touch_interval + 1)["value"] == 1
+        cache.set("c", 3, 600, now=1002)
+        assert cache.get("b", now=1003) is None
+        assert cache.get("a", now=1003)["value"] == 1
+        assert cache.get("c", now=1003)["value"] == 3
+
+    def test_integration_result_cache_upgrade(self, tmp_path):
+        """Test that a cache file from before eviction is upgraded."""
+        cache_path = str(tmp_path / "cache.db")
+        connection = sqlite3.connect(cache_path)
+        connection.execute("CREATE TABLE results (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                           "stored REAL NOT NULL, expires REAL NOT NULL)")
+        connection.execute("INSERT INTO results VALUES ('old', '1', 1000, 2000)")
+        connection.commit()
+        connection.close()
+        cache = ResultCache(cache_path, max_entries=1)
+        cache.set("new", 2, 60, now=1500)
+        assert cache.get("old", now=1500) is None
+        assert cache.get("new", now=1500)["value"] == 2
@@ -0,0 +1,88 @@
+import os
+
+from dane_discovery.dane import DANE
+
+from radius_pkix_cd.sharded_trust_map import ShardedTrustMap
+from radius_pkix_cd.trust_map import TrustMap
+from radius_pkix_cd.verifier import Verifier
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class TestIntegrationShardedTrustMap:
+    """Integration tests for the ShardedTrustMap class."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    def generate_trust_map(self):
+        """Return a trust map with a few realms."""
+        return {"SSID{}".format(x): {"dev{}._device.example.com".format(y): {"akis": ["aki"],
+                                                                         "cert_hashes": ["h{}".format(y)]}
+                                     for y in range(x, x + 5)}
+                for x in range(4)}
+
+    def get_shard_path(self, path, realm):
+        """Return the path of a realm's shard, in the current generation."""
+        return os.path.join(path, ShardedTrustMap.read_manifest(path)["shards"][realm]["file"])
+
+    def test_integration_sharded_trust_map_write(self, tmp_path):
+        """Test that only changed shards are written, and stale ones removed a generation later."""
+        path = str(tmp_path / "shards")
+        trust_map = self.generate_trust_map()
+        assert ShardedTrustMap.write(path, trust_map)
+        assert len(os.listdir(path)) == 5
+        inodes = {x: os.stat(self.get_shard_path(path, x)).st_ino for x in trust_map}
+        old_paths = {x: self.get_shard_path(path, x) for x in trust_map}
+        generation_1 = ShardedTrustMap(path)
+        assert not ShardedTrustMap.write(path, trust_map)
+        trust_map["SSID1"]["new._device.example.com"] = {"akis": [], "cert_hashes": []}
+        del trust_map["SSID3"]
+        assert ShardedTrustMap.write(path, trust_map)
+        assert os.stat(self.get_shard_path(path, "SSID0")).st_ino == inodes["SSID0"]
+        assert self.get_shard_path(path, "SSID1") != old_paths["SSID1"]
+        # The previous generation is still whole, for verifiers reading its manifest.
+        assert not generation_1.has_identity("SSID1", "new._device.example.com")
+        assert generation_1.has_identity("SSID3", "dev3._device.example.com")
+        trust_map["SSID0"]["new._device.example.com"] = {"akis": [], "cert_hashes": []}
+        assert ShardedTrustMap.write(path, trust_map)
+        assert not os.path.exists(old_paths["SSID1"])
+        assert not os.path.exists(old_paths["SSID3"])
+        assert len(os.listdir(path)) == 1 + 3 + 1
+        sharded = ShardedTrustMap(path)
+        assert sharded.generation == 3
+        reference = TrustMap(trust_map)
+        for realm in ["SSID0", "SSID1", "SSID3", "SSID4"]:
+            assert sharded.has_realm(realm) == reference.has_realm(realm)
+            for num in range(10):
+                dnsname = "dev{}._device.example.com".format(num)
+                assert sharded.has_identity(realm, dnsname) == reference.has_identity(realm, dnsname)
+                assert sharded.has_cert_hash(realm, dnsname, "h{}".format(num)) == \
+                    reference.has_cert_hash(realm, dnsname, "h{}".format(num))
+
+    def test_integration_sharded_trust_map_verifier(self, tmp_path):
+        """Test that the verifier loads only the shard it needs, and reloads on publish."""
+        path = str(tmp_path / "shards")
+        cert_pem = self.get_file_contents(private_cert_path)
+        cert_hash = DANE.generate_sha_by_selector(cert_pem, "sha256", 0)
+        trust_map = self.generate_trust_map()
+        ShardedTrustMap.write(path, trust_map)
+        verifier = Verifier(path)
+        code, _ = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)
+        assert code == Verifier.EXIT_INVALID_CALLED_STATION
+        assert list(verifier.trust_map.loaded.keys()) == ["SSID1"]
+        trust_map["SSID2"][identity_name] = {"akis": [], "cert_hashes": [cert_hash]}
+        ShardedTrustMap.write(path, trust_map)
+        code, _ = verifier.verify("00-00-00-00-00-01:SSID2", identity_name, cert_pem)
+        assert code == Verifier.EXIT_OK
+        assert list(verifier.trust_map.loaded.keys()) == ["SSID2"]
+        with open(self.get_shard_path(path, "SSID0"), "w") as shard_file:
+            shard_file.write("{")
+        code, _ = verifier.verify("00-00-00-00-00-01:SSID0", identity_name, cert_pem)
+        assert code == Verifier.EXIT_MISSING_TRUST_MAP
+        code, _ = Verifier(str(tmp_path)).verify("00-00-00-00-00-01:SSID0", identity_name, cert_pem)
+        assert code == Verifier.EXIT_MISSING_TRUST_MAP
@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+
+from dane_discovery.dane import DANE
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+# Packages a cache-only pkix_cd_verify must not import.
+heavy_packages = ["dane_discovery", "cryptography", "dns", "requests", "urllib3"]
+
+# Run pkix_cd_verify in-process, then report which heavy packages got loaded.
+verify_script = """
+import json, sys
+from radius_pkix_cd.scripts import pkix_cd_verify
+sys.argv = ["pkix_cd_verify"] + sys.argv[1:]
+try:
+    pkix_cd_verify.main()
+except SystemExit as exit:
+    code = exit.code
+loaded = sorted(set(x.split(".")[0] for x in sys.modules) & set({heavy}))
+print(json.dumps({{"code": code, "loaded": loaded}}))
+""".format(heavy=repr(heavy_packages))
+
+
+class TestIntegrationStartup:
+    """Startup cost of pkix_cd_verify."""
+
+    def write_trust_map(self, tmp_path):
+        """Write a trust map authorizing the private cert, return its path."""
+        with open(private_cert_path) as f_p:
+            cert_hash = DANE.generate_sha_by_selector(f_p.read(), "sha256", 0)
+        trust_map = {"SSID1": {identity_name: {"akis": [], "cert_hashes": [cert_hash]}}}
+        trustmap_path = str(tmp_path / "trust_map.json")
+        with open(trustmap_path, "w") as f_p:
+            json.dump(trust_map, f_p)
+        return trustmap_path
+
+    def test_integration_startup_imports(self):
+        """Test that importing pkix_cd_verify doesn't load DNS or X.509 libraries."""
+        script = ("import json, sys\n"
+                  "import radius_pkix_cd.scripts.pkix_cd_verify\n"
+                  "print(json.dumps(sorted(set(x.split('.')[0] for x in sys.modules))))")
+        result = subprocess.run([sys.executable, "-c", script],
+                                check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        assert not set(json.loads(result.stdout)) & set(heavy_packages)
+
+    def test_integration_startup_cache_only_verify(self, tmp_path):
+        """Test that a cache-only verify doesn't load DNS or X.509 libraries."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        args = ["--called", "00-00-00-00-00-01:SSID1", "--calling", identity_name,
+                "--certfile", private_cert_path, "--trustmap", trustmap_path]
+        result = subprocess.run([sys.executable, "-c", verify_script] + args,
+                                check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        report = json.loads(result.stdout.splitlines()[-1])
+        assert report == {"code": 0, "loaded": []}
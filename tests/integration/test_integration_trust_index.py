@@ -0,0 +1,59 @@
+import hashlib
+
+import pytest
+
+from radius_pkix_cd.trust_index import TrustIndex
+from radius_pkix_cd.trust_map import TrustMap
+
+
+class TestIntegrationTrustIndex:
+    """Integration tests for the TrustIndex class."""
+
+    def cert_hash(self, seed):
+        """Return a fake certificate hash."""
+        return hashlib.sha256(seed.encode()).hexdigest()
+
+    def generate_trust_map(self):
+        """Return a trust map with a few realms and many identities."""
+        trust_map = {"SSID1": {}, "SSID2": {}, "EMPTY": {}}
+        for num in range(500):
+            dnsname = "dev{}._device.example.com".format(num)
+            trust = {"akis": ["aki"], "cert_hashes": [self.cert_hash(dnsname),
+                                                      self.cert_hash(dnsname + "-next")]}
+            trust_map["SSID1" if num % 2 else "SSID2"][dnsname] = trust
+        trust_map["SSID1"]["dev0._device.example.com"] = {}
+        return trust_map
+
+    def test_integration_trust_index_matches_trust_map(self, tmp_path):
+        """Test that the index answers the same as the JSON trust map."""
+        trust_map = self.generate_trust_map()
+        index_path = str(tmp_path / "trust_map.idx")
+        TrustIndex.write(index_path, trust_map)
+        assert TrustIndex.is_trust_index(index_path)
+        index = TrustIndex(index_path)
+        reference = TrustMap(trust_map)
+        for realm in ["SSID1", "SSID2", "EMPTY", "SSID3"]:
+            assert index.has_realm(realm) == reference.has_realm(realm)
+            for num in range(502):
+                dnsname = "dev{}._device.example.com".format(num)
+                assert index.has_identity(realm, dnsname) == reference.has_identity(realm, dnsname)
+                for cert_hash in [self.cert_hash(dnsname), self.cert_hash(dnsname + "-next"),
+                                  self.cert_hash("nope"), "not-hex"]:
+                    assert (index.has_cert_hash(realm, dnsname, cert_hash)
+                            == reference.has_cert_hash(realm, dnsname, cert_hash))
+
+    def test_integration_trust_index_rejects_garbage(self, tmp_path):
+        """Test that files which are not an index are refused."""
+        json_path = tmp_path / "trust_map.json"
+        json_path.write_text("{}")
+        assert not TrustIndex.is_trust_index(str(json_path))
+        with pytest.raises(ValueError):
+            TrustIndex(str(json_path))
+        empty_path = tmp_path / "empty.idx"
+        empty_path.write_bytes(b"")
+        with pytest.raises(ValueError):
+            TrustIndex(str(empty_path))
+        truncated_path = tmp_path / "truncated.idx"
+        truncated_path.write_bytes(TrustIndex.build(self.generate_trust_map())[:-10])
+        with pytest.raises(ValueError):
+            TrustIndex(str(truncated_path))
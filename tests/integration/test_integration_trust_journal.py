@@ -0,0 +1,126 @@
+import copy
+import json
+import os
+
+from unittest.mock import patch
+
+from dane_discovery.dane import DANE
+
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.trust_journal import TrustJournal
+from radius_pkix_cd.trust_map import TrustMap
+from radius_pkix_cd.utility import Utility
+from radius_pkix_cd.verifier import Verifier
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+ca1_cert_path = os.path.join("tests/ca1/", "ca.example.net.cert.pem")
+ca2_cert_path = os.path.join("tests/ca2/", "ca.example.net.cert.pem")
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class TestIntegrationTrustJournal:
+    """Integration tests for the TrustJournal class."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file, as bytes."""
+        with open(file_path, "rb") as f_p:
+            return f_p.read()
+
+    def test_integration_trust_journal_changes(self):
+        """Test that changes turn the old trust map into the new one, idempotently."""
+        old = {"SSID0": {"a._device.example.com": {"akis": ["k1"], "cert_hashes": ["h1"]}},
+               "SSID1": {"a._device.example.com": {"akis": ["k1"], "cert_hashes": ["h1", "h2"]},
+                         "b._device.example.com": {"akis": ["k2"], "cert_hashes": ["h3"]},
+                         "c._device.example.com": {"akis": [], "cert_hashes": []}}}
+        new = {"SSID1": {"a._device.example.com": {"akis": ["k1"], "cert_hashes": ["h2", "h4"]},
+                         "c._device.example.com": {"akis": [], "cert_hashes": []},
+                         "d._device.example.com": {"akis": ["k3"], "cert_hashes": ["h5"]}},
+               "SSID2": {"d._device.example.com": {"akis": ["k3"], "cert_hashes": ["h5"]}}}
+        changes = TrustJournal.get_changes(old, new)
+        assert changes["realms_added"] == ["SSID2"]
+        assert changes["realms_removed"] == ["SSID0"]
+        assert [(x["realm"], x["identity"]) for x in changes["identities_removed"]] == \
+            [("SSID0", "a._device.example.com"), ("SSID1", "b._device.example.com")]
+        assert len(changes["identities_added"]) == 2
+        changed, = changes["identities_changed"]
+        assert changed["cert_hashes_added"] == ["h4"] and changed["cert_hashes_revoked"] == ["h1"]
+        assert changed["akis_added"] == [] and changed["akis_revoked"] == []
+        trust_map = copy.deepcopy(old)
+        TrustJournal.apply_changes(trust_map, changes)
+        assert trust_map == new
+        TrustJournal.apply_changes(trust_map, json.loads(json.dumps(changes)))
+        assert trust_map == new
+
+    def test_integration_trust_journal_publish(self, tmp_path):
+        """Test that each published generation is journaled, and the journal is trimmed."""
+        trustmap_path = str(tmp_path / "trust_map.json")
+        cacerts_path = str(tmp_path / "ca.pem")
+        journal = TrustJournal(TrustJournal.get_path(trustmap_path), max_entries=2)
+        ca1, ca2 = [self.get_file_contents(x) for x in [ca1_cert_path, ca2_cert_path]]
+        trust_map = {"SSID1": {"a._device.example.com": {"akis": ["k1"], "cert_hashes": ["h1"]}}}
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [ca1], journal)
+        assert not Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [ca1], journal)
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [ca2], journal)
+        trust_map["SSID2"] = {}
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [ca2], journal)
+        entries = journal.read()
+        assert [x["generation"] for x in entries] == [2, 3]
+        assert entries[0]["changes"]["ca_roots_added"] == [CertificateContext(ca2).sha256]
+        assert entries[0]["changes"]["ca_roots_removed"] == [CertificateContext(ca1).sha256]
+        assert entries[1]["changes"]["realms_added"] == ["SSID2"]
+        assert entries[1]["trustmap_sha256"] == Utility.read_manifest(trustmap_path)["trustmap_sha256"]
+        assert len(journal.get_changes_since(1, 3)) == 2
+        assert journal.get_changes_since(0, 3) is None
+
+    def test_integration_trust_journal_verifier(self, tmp_path):
+        """Test that the verifier applies journaled changes, or reloads."""
+        trustmap_path = str(tmp_path / "trust_map.json")
+        cacerts_path = str(tmp_path / "ca.pem")
+        journal = TrustJournal(TrustJournal.get_path(trustmap_path))
+        cert_pem = self.get_file_contents(private_cert_path).decode()
+        cert_hash = DANE.generate_sha_by_selector(cert_pem, "sha256", 0)
+        trust_map = {"SSID1": {identity_name: {"akis": [], "cert_hashes": [cert_hash]}}}
+        Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [], journal)
+        verifier = Verifier(trustmap_path)
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 0
+        loaded = verifier.trust_map
+        trust_map["SSID1"][identity_name]["cert_hashes"] = ["other"]
+        Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [], journal)
+        with patch.object(TrustMap, "load", wraps=TrustMap.load) as load:
+            assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 4
+            assert load.call_count == 0 and verifier.trust_map_generation == 2
+            # The changes went into a new TrustMap, so a verify already holding the old one sees it whole.
+            assert verifier.trust_map is not loaded
+            assert loaded.has_cert_hash("SSID1", identity_name, cert_hash)
+            # A generation missing from the journal means a full reload.
+            trust_map = {"SSID2": trust_map["SSID1"]}
+            Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [])
+            assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 3
+            assert load.call_count == 1 and verifier.trust_map_generation == 3
+        assert verifier.trust_map.trust_map == trust_map
+
+    def test_integration_trust_journal_manifest_race(self, tmp_path):
+        """Test that a trust map read before its manifest is caught up once the manifest arrives."""
+        trustmap_path = str(tmp_path / "trust_map.json")
+        cacerts_path = str(tmp_path / "ca.pem")
+        manifest_path = Utility.get_manifest_path(trustmap_path)
+        journal = TrustJournal(TrustJournal.get_path(trustmap_path))
+        cert_pem = self.get_file_contents(private_cert_path).decode()
+        cert_hash = DANE.generate_sha_by_selector(cert_pem, "sha256", 0)
+        trust_map = {"SSID1": {identity_name: {"akis": [], "cert_hashes": [cert_hash]}}}
+        Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [], journal)
+        verifier = Verifier(trustmap_path)
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 0
+        trust_map["SSID2"] = {}
+        Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [], journal)
+        previous_manifest = self.get_file_contents(manifest_path)
+        trust_map["SSID1"][identity_name]["cert_hashes"] = ["other"]
+        Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [], journal)
+        # As if the request came between the new trust map and its manifest.
+        new_manifest = self.get_file_contents(manifest_path)
+        Utility.write_file_atomically(manifest_path, previous_manifest)
+        verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)
+        Utility.write_file_atomically(manifest_path, new_manifest)
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 4
+        assert verifier.trust_map_generation == 3
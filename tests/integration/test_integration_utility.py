@@ -1,8 +1,15 @@
+import io
+import json
 import os
 import pprint
 
 from unittest.mock import MagicMock
+from unittest.mock import patch
 
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.result_cache import ResultCache
+from radius_pkix_cd.sharded_trust_map import ShardedTrustMap
+from radius_pkix_cd.trust_index import TrustIndex
 from radius_pkix_cd.utility import Utility
 from dane_discovery.pki import PKI
 from dane_discovery.dane import DANE
@@ -76,4 +83,131 @@ class TestIntegrationUtility:
         response = self.generate_response([tlsa_record_bad_2])
         print(response)
         mock_dane.get_responses = MagicMock(return_value=response)
-        assert Utility.check_iot_registry_revoked(non_registry_cert_pem, None)
\ No newline at end of file
+        assert Utility.check_iot_registry_revoked(non_registry_cert_pem, None)
+
+    def test_integration_check_iot_registry_revoked_cached(self, tmp_path):
+        """Test that registry status is cached, honoring the TLSA record TTL."""
+        tlsa_record_fmt = "{}. {} IN TLSA {}"
+        registry_cert_pem = self.get_file_contents(registry_cert_path)
+        test_dns_name = PKI.get_cert_meta(registry_cert_pem)["subject"]["commonName"]
+        tlsa = DANE.generate_tlsa_record(3, 0, 1, registry_cert_pem)
+        cache = ResultCache(str(tmp_path / "registry.db"), max_ttl=3600, negative_ttl=60)
+
+        # Not revoked, cached for the record's TTL.
+        response = self.generate_response([tlsa_record_fmt.format(test_dns_name, 373, tlsa)])
+        with patch.object(DANE, "get_responses", return_value=response) as mock_responses:
+            assert not Utility.check_iot_registry_revoked(registry_cert_pem, None, cache)
+            assert not Utility.check_iot_registry_revoked(registry_cert_pem, None, cache)
+        assert mock_responses.call_count == 1
+        cache_key = "registry:{}:{}".format(test_dns_name, DANE.generate_sha_by_selector(registry_cert_pem, "sha256", 0))
+        cached = cache.get(cache_key)
+        assert cached["expires"] - cached["stored"] == 373
+
+        # Missing from the registry: revoked, and negative-cached.
+        cache = ResultCache(str(tmp_path / "negative.db"), max_ttl=3600, negative_ttl=60)
+        with patch.object(DANE, "get_responses", return_value=self.generate_response([])) as mock_responses:
+            assert Utility.check_iot_registry_revoked(registry_cert_pem, None, cache)
+            assert Utility.check_iot_registry_revoked(registry_cert_pem, None, cache)
+        assert mock_responses.call_count == 1
+        cached = cache.get(cache_key)
+        assert cached["expires"] - cached["stored"] == 60
+
+    def test_integration_publish_trust_store(self, tmp_path):
+        """Test that trust map and CA bundle are published as one generation."""
+        trustmap_path = str(tmp_path / "trust_map.json")
+        cacerts_path = str(tmp_path / "ca.pem")
+        trust_map = {"SSID1": {"my._device.example.com": {"akis": ["a"], "cert_hashes": ["h"]}}}
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [b"root1"])
+        assert Utility.read_manifest(trustmap_path)["generation"] == 1
+        assert not Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [b"root1"])
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [b"root1", b"root2"])
+        manifest = Utility.read_manifest(trustmap_path)
+        assert manifest["generation"] == 2
+        assert manifest["trustmap_sha256"] == Utility.get_file_digest(trustmap_path)
+        assert manifest["cacerts_sha256"] == Utility.get_file_digest(cacerts_path)
+        with open(trustmap_path) as f_p:
+            assert json.load(f_p) == trust_map
+        with open(cacerts_path, "rb") as f_p:
+            assert f_p.read() == b"root1\nroot2"
+        assert sorted(os.listdir(str(tmp_path))) == ["ca.pem", "trust_map.json", "trust_map.json.manifest"]
+
+    def test_integration_check_iot_registry_revoked_malformed(self, tmp_path):
+        """Test that lookup failures and malformed records fail closed, uncached."""
+        registry_cert_pem = self.get_file_contents(registry_cert_path)
+        cache = ResultCache(str(tmp_path / "registry.db"), 3600, 60)
+        malformed = ["iotreg.ca. 300 IN TLSA 3 0 x 0123", "iotreg.ca. 300 IN TLSA 3"]
+        for responses in malformed:
+            with patch.object(DANE, "get_responses", return_value=self.generate_response([responses])):
+                assert Utility.check_iot_registry_revoked(registry_cert_pem, None, cache)
+        with patch.object(DANE, "get_responses", side_effect=ConnectionRefusedError()):
+            assert Utility.check_iot_registry_revoked(registry_cert_pem, None, cache)
+        assert cache.get(Utility.get_registry_cache_key(CertificateContext(registry_cert_pem))) is None
+
+    def test_integration_publish_trust_store_index(self, tmp_path):
+        """Test that the index is part of the generation, and repaired if it's behind."""
+        trustmap_path = str(tmp_path / "trust_map.json")
+        cacerts_path = str(tmp_path / "ca.pem")
+        index_path = str(tmp_path / "trust_map.idx")
+        trust_map = {"SSID1": {"my._device.example.com": {"akis": ["a"], "cert_hashes": ["00" * 32]}}}
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [b"root1"], None, index_path)
+        manifest = Utility.read_manifest(trustmap_path)
+        assert manifest["trustindex_sha256"] == Utility.get_file_digest(index_path)
+        assert not Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [b"root1"], None,
+                                               index_path)
+        # As if a run was killed after the trust map, before the index.
+        stale = TrustIndex.build({})
+        with open(index_path, "wb") as f_p:
+            f_p.write(stale)
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [b"root1"], None, index_path)
+        assert TrustIndex(index_path).has_identity("SSID1", "my._device.example.com")
+        os.unlink(index_path)
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [b"root1"], None, index_path)
+        assert Utility.read_manifest(trustmap_path)["generation"] == 3
+
+    def test_integration_publish_trust_store_shards(self, tmp_path):
+        """Test that the shards are part of the generation, and repaired if they're behind."""
+        trustmap_path = str(tmp_path / "trust_map.json")
+        cacerts_path = str(tmp_path / "ca.pem")
+        shards_path = str(tmp_path / "shards")
+        trust_map = {"SSID1": {"my._device.example.com": {"akis": ["a"], "cert_hashes": ["h"]}}}
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [], None, None, shards_path)
+        shards_manifest = os.path.join(shards_path, "manifest.json")
+        assert Utility.read_manifest(trustmap_path)["trustshards_sha256"] == Utility.get_file_digest(shards_manifest)
+        assert not Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [], None, None, shards_path)
+        # As if a run was killed after the trust map, before the shards.
+        ShardedTrustMap.write(shards_path, {})
+        assert Utility.publish_trust_store(trustmap_path, cacerts_path, trust_map, [], None, None, shards_path)
+        assert ShardedTrustMap(shards_path).has_identity("SSID1", "my._device.example.com")
+
+    def test_integration_update_trust_store_file(self, tmp_path):
+        """Test that the trust store file is only rewritten when it changes."""
+        trustmap_path = str(tmp_path / "trust_map.json")
+        assert Utility.update_trust_store_file(trustmap_path, {})
+        assert not Utility.update_trust_store_file(trustmap_path, {})
+        assert Utility.update_trust_store_file(trustmap_path, {"SSID1": {}})
+        with open(trustmap_path) as f_p:
+            assert json.load(f_p) == {"SSID1": {}}
+
+    def test_integration_utility_get_authz_config_streaming(self, tmp_path, capsys):
+        """Test several access lists and stdin, deduplication and bulk error reporting."""
+        first = tmp_path / "first.txt"
+        first.write_text("SSID2|your._device.example.com\n"
+                         "SSID2|your._device.example.com\n"
+                         "no pipe here\n"
+                         "\n"
+                         "SSID1|bad name._device.example.com\r\n")
+        second = tmp_path / "second.txt"
+        second.write_text("SSID1|your._device.example.com\r\n"
+                          "SSID3|1.2.3.4\n"
+                          "SSID1|a|b\n")
+        with patch("sys.stdin", io.StringIO("SSID2|your._device.example.com\nSSID3|my._device.example.com\n")):
+            trust_structure = Utility.get_authz_config([str(first), str(second), "-"],
+                                                       max_reported_errors=3)
+        assert trust_structure == {"your._device.example.com": ["SSID2", "SSID1"],
+                                   "my._device.example.com": ["SSID3"]}
+        assert list(trust_structure.keys()) == ["your._device.example.com", "my._device.example.com"]
+        output = capsys.readouterr().out
+        assert "Skipped 4 incorrectly formatted lines:" in output
+        assert "first.txt:3: Expected REALM|DNSNAME" in output
+        assert "first.txt:5: Bad ID name" in output
+        assert "...and 1 more." in output
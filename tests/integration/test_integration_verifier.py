@@ -0,0 +1,403 @@
+import json
+import os
+import re
+import threading
+import time
+
+import dns.exception
+import pytest
+
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from dane_discovery.dane import DANE
+from dane_discovery.exceptions import TLSAError
+
+from radius_pkix_cd import dns_dispatch
+from radius_pkix_cd import rlm_python
+from radius_pkix_cd.certificate import CertificateContext
+from radius_pkix_cd.service import send_request
+from radius_pkix_cd.scripts import pkix_cd_verify_client
+from radius_pkix_cd.scripts.pkix_cd_verify_daemon import VerifyServer
+from radius_pkix_cd.trust_index import TrustIndex
+from radius_pkix_cd.utility import Utility
+from radius_pkix_cd.verifier import Verifier
+
+private_cert_name = "ecc.air-quality-sensor._device.example.net.cert.pem"
+private_cert_path = os.path.join("tests/ca2/", private_cert_name)
+rogue_cert_path = os.path.join("tests/ca1/", private_cert_name)
+identity_name = "ecc.air-quality-sensor._device.example.net"
+
+
+class TestIntegrationVerifier:
+    """Integration tests for the Verifier class and verify service."""
+
+    def get_file_contents(self, file_path):
+        """Return the contents of a file."""
+        with open(file_path) as f_p:
+            return f_p.read()
+
+    def write_trust_map(self, tmp_path):
+        """Write a trust map authorizing the private cert, return its path."""
+        cert_hash = DANE.generate_sha_by_selector(self.get_file_contents(private_cert_path), "sha256", 0)
+        trust_map = {"SSID1": {identity_name: {"akis": [], "cert_hashes": [cert_hash]}}}
+        trustmap_path = str(tmp_path / "trust_map.json")
+        with open(trustmap_path, "w") as f_p:
+            json.dump(trust_map, f_p)
+        return trustmap_path
+
+    def test_integration_verifier_verify(self, tmp_path):
+        """Test the exit codes returned by Verifier.verify."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        cert_pem = self.get_file_contents(private_cert_path)
+        verifier = Verifier(trustmap_path)
+        code, _ = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)
+        assert code == Verifier.EXIT_OK
+        code, _ = verifier.verify("00-00-00-00-00-01:SSID2", identity_name, cert_pem)
+        assert code == Verifier.EXIT_INVALID_CALLED_STATION
+        code, _ = verifier.verify("SSID1", identity_name, cert_pem)
+        assert code == Verifier.EXIT_INVALID_CALLED_STATION
+        code, _ = verifier.verify("00-00-00-00-00-01:SSID1", "other._device.example.net", cert_pem)
+        assert code == Verifier.EXIT_INVALID_CALLED_STATION
+        rogue_pem = self.get_file_contents(rogue_cert_path)
+        code, _ = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, rogue_pem)
+        assert code == Verifier.EXIT_CERT_HASH_MISMATCH
+        code, _ = Verifier(str(tmp_path / "nope.json")).verify("00-00-00-00-00-01:SSID1",
+                                                               identity_name, cert_pem)
+        assert code == Verifier.EXIT_MISSING_TRUST_MAP
+
+    def test_integration_verifier_trust_index(self, tmp_path):
+        """Test that Verifier accepts a compiled trust map index."""
+        with open(self.write_trust_map(tmp_path)) as f_p:
+            trust_map = json.load(f_p)
+        index_path = str(tmp_path / "trust_map.idx")
+        TrustIndex.write(index_path, trust_map)
+        cert_pem = self.get_file_contents(private_cert_path)
+        verifier = Verifier(index_path)
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 0
+        assert isinstance(verifier.trust_map, TrustIndex)
+        rogue_pem = self.get_file_contents(rogue_cert_path)
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, rogue_pem)[0] == 4
+
+    def test_integration_verifier_reload(self, tmp_path):
+        """Test that a changed trust map is picked up by an existing Verifier."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        cert_pem = self.get_file_contents(private_cert_path)
+        verifier = Verifier(trustmap_path)
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 0
+        with open(trustmap_path, "w") as f_p:
+            json.dump({"SSID2": {}}, f_p)
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 3
+
+    def test_integration_verifier_unreadable_trust_map(self, tmp_path):
+        """Test that a garbled trust map keeps the previous one, or fails with 1."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        cert_pem = self.get_file_contents(private_cert_path)
+        verifier = Verifier(trustmap_path)
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 0
+        with open(trustmap_path, "w") as f_p:
+            f_p.write("{\"SSID1\": ")
+        assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 0
+        assert Verifier(trustmap_path).verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem)[0] == 1
+
+    def test_integration_verifier_live_cache(self, tmp_path):
+        """Test that live verify results are cached, and refreshed while stale."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        cert_pem = self.get_file_contents(private_cert_path)
+        verifier = Verifier(trustmap_path, live_cache=str(tmp_path / "live.db"), live_cache_stale=300)
+        identity = Mock(dane_credentials=[{"tlsa_parsed": {"ttl": 120}}])
+        identity.validate_certificate.return_value = (True, "Valid")
+        with patch("dane_discovery.identity.Identity", return_value=identity) as identity_class:
+            for _ in range(3):
+                assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)[0] == 0
+            assert identity_class.call_count == 1
+            # An expired result is still used, and refreshed in the background.
+            certificate = CertificateContext(cert_pem)
+            cache_key = Verifier.get_live_cache_key(identity_name, certificate, None)
+            verifier.live_cache.set(cache_key, [True, "Valid"], 120, now=time.time() - 200)
+            released = threading.Event()
+
+            def slow_validate(certificate):
+                released.wait(5)
+                return False, "Revoked"
+            identity.validate_certificate.side_effect = slow_validate
+            assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)[0] == 0
+            refreshes = [x for x in threading.enumerate() if x.name == "live-verify-refresh"]
+            # Not holding up a one-shot pkix_cd_verify's exit.
+            assert [x.daemon for x in refreshes] == [True]
+            released.set()
+            refreshes[0].join()
+            identity.validate_certificate.side_effect = None
+            assert identity_class.call_count == 2
+            assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)[0] == 5
+            # Too stale to use at all.
+            verifier.live_cache.set(cache_key, [True, "Valid"], 60, now=time.time() - 400)
+            identity.validate_certificate.return_value = (True, "Valid")
+            assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)[0] == 0
+            assert identity_class.call_count == 3
+
+    def test_integration_verifier_deadline(self, tmp_path):
+        """Test that a slow live verify is cut off at the deadline, per the policy."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        cert_pem = self.get_file_contents(private_cert_path)
+        live_cache = str(tmp_path / "live.db")
+        released = threading.Event()
+
+        def slow_validate(certificate):
+            released.wait(5)
+            return True, "Valid"
+        identity = Mock(dane_credentials=[{"tlsa_parsed": {"ttl": 120}}])
+        identity.validate_certificate.side_effect = slow_validate
+        with patch("dane_discovery.identity.Identity", return_value=identity):
+            verifier = Verifier(trustmap_path, live_cache=live_cache, deadline_ms=100)
+            started = time.monotonic()
+            code, messages = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)
+            assert time.monotonic() - started < 2
+            assert code == Verifier.EXIT_LIVE_VERIFY_FAILED
+            assert "expired during live_verify" in messages[0]
+            # Nothing cached yet, so last-known-good fails closed too.
+            verifier = Verifier(trustmap_path, live_cache=live_cache, deadline_ms=100,
+                                deadline_policy="last-known-good", parallel_stages=True)
+            code, messages = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)
+            assert code == Verifier.EXIT_LIVE_VERIFY_FAILED
+            assert "no cached result" in messages[0]
+            # An expired result is used, unless it's too old.
+            certificate = CertificateContext(cert_pem)
+            cache_key = Verifier.get_live_cache_key(identity_name, certificate, None)
+            verifier.live_cache.set(cache_key, [True, "Valid"], 120, now=time.time() - 3600)
+            code, messages = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)
+            assert code == Verifier.EXIT_OK
+            assert "using the last cached result" in messages[0]
+            verifier.deadline_fallback_max_age = 600
+            code, _ = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)
+            assert code == Verifier.EXIT_LIVE_VERIFY_FAILED
+            released.set()
+            # Within the deadline, the result is as without one.
+            code, messages = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)
+            assert (code, messages) == (Verifier.EXIT_OK, [])
+
+    def test_integration_verifier_deadline_bounds(self, tmp_path):
+        """Test that stages get the remaining budget as timeout, and can't pile up."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        cert_pem = self.get_file_contents(private_cert_path)
+        released = threading.Event()
+
+        def slow_validate(certificate):
+            released.wait(5)
+            return True, "Valid"
+        identity = Mock(dane_credentials=[{"tlsa_parsed": {"ttl": 120}}])
+        identity.validate_certificate.side_effect = slow_validate
+        with patch("dane_discovery.identity.Identity", return_value=identity) as identity_class, \
+                patch.object(Verifier, "max_stage_threads", 1):
+            verifier = Verifier(trustmap_path, deadline_ms=100)
+            code, _ = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)
+            assert code == Verifier.EXIT_LIVE_VERIFY_FAILED
+            assert 0 < identity_class.call_args[1]["dns_timeout"] <= 0.1
+            # The abandoned stage still holds the only slot.
+            code, messages = verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)
+            assert code == Verifier.EXIT_LIVE_VERIFY_FAILED
+            assert "Too many checks" in messages[0]
+            assert identity_class.call_count == 1
+            released.set()
+            for thread in threading.enumerate():
+                if thread.name == "verify-live_verify":
+                    thread.join()
+            assert verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)[0] == 0
+
+    def test_integration_verifier_http_timeout(self, tmp_path):
+        """Test that with a deadline, CA certificate downloads get a timeout."""
+        original = classmethod(lambda cls, url, nsaddr=None, dns_timeout=5: b"")
+        with patch.dict(dns_dispatch.originals, clear=True), patch.object(dns_dispatch, "http_timeout", False), \
+                patch.object(DANE, "get_responses"), patch.object(DANE, "wrap_requests", original):
+            Verifier(self.write_trust_map(tmp_path))
+            assert DANE.__dict__["wrap_requests"] is original
+            Verifier(self.write_trust_map(tmp_path), deadline_ms=100)
+            with patch.object(Utility, "get_a_record", return_value="192.0.2.1") as get_a_record, \
+                    patch("requests.Session") as session:
+                DANE.wrap_requests("https://ca.example.net/ca.pem", None, 0.25)
+        assert get_a_record.call_args[0][2] == 0.25
+        assert session.return_value.get.call_args[1]["timeout"] == 0.25
+
+    def test_integration_verifier_deadline_lookups(self, tmp_path):
+        """Test that the deadline bounds the lookups dane_discovery doesn't pass a timeout to."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        cert_pem = self.get_file_contents(private_cert_path)
+        timeouts = []
+
+        def get_responses(dnsname, rr_type, nsaddr=None, dns_timeout=5):
+            timeouts.append(dns_timeout)
+            raise dns.exception.Timeout()
+        with patch.dict(dns_dispatch.originals, clear=True), patch.object(dns_dispatch, "pool", None), \
+                patch.object(DANE, "get_responses", get_responses), patch.object(DANE, "wrap_requests"):
+            verifier = Verifier(trustmap_path, deadline_ms=200)
+            with pytest.raises(TLSAError):
+                verifier.verify("00-00-00-00-00-01:SSID1", identity_name, cert_pem, True)
+            # DANE.get_tlsa_records asks for the default 5 seconds.
+            assert timeouts and all(0 < timeout <= 0.2 for timeout in timeouts)
+            # Outside a stage, lookups keep the timeout they ask for.
+            with pytest.raises(dns.exception.Timeout):
+                DANE.get_responses(identity_name, "TLSA", None, 5)
+            assert timeouts[-1] == 5
+        with patch("dns.resolver.Resolver") as resolver_class:
+            resolver_class.return_value.resolve.return_value = ["192.0.2.1"]
+            assert Utility.get_a_record("ca.example.net", None, 0.25) == "192.0.2.1"
+        assert resolver_class.return_value.lifetime == 0.25
+
+    def test_integration_verify_service(self, tmp_path):
+        """Test a round trip through the verify service."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        socket_path = str(tmp_path / "verify.sock")
+        server = VerifyServer(socket_path, [trustmap_path])
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            request = {"called": "00-00-00-00-00-01:SSID1", "calling": identity_name,
+                       "cert_pem": self.get_file_contents(private_cert_path),
+                       "trustmap": trustmap_path, "checks": {}}
+            assert send_request(socket_path, request, 5)["code"] == 0
+            request["cert_pem"] = self.get_file_contents(rogue_cert_path)
+            assert send_request(socket_path, request, 5)["code"] == 4
+            del request["cert_pem"]
+            assert send_request(socket_path, request, 5)["code"] == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        assert not os.path.exists(socket_path)
+
+    def test_integration_verify_service_options(self, tmp_path):
+        """Test that the service verifies as configured, whatever the client asks for."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        socket_path = str(tmp_path / "verify.sock")
+        live_cache = str(tmp_path / "live.db")
+        server = VerifyServer(socket_path, [trustmap_path], {"live_cache": live_cache},
+                              {"live_verify": True})
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        identity = Mock(dane_credentials=[{"tlsa_parsed": {"ttl": 120}}])
+        identity.validate_certificate.return_value = (False, "Revoked")
+        try:
+            request = {"called": "00-00-00-00-00-01:SSID1", "calling": identity_name,
+                       "cert_pem": self.get_file_contents(private_cert_path),
+                       "checks": {"live_verify": True},
+                       "options": {"live_cache": str(tmp_path / "other.db"), "registry_domains": "/etc/passwd"}}
+            with patch("dane_discovery.identity.Identity", return_value=identity):
+                assert send_request(socket_path, request, 5)["code"] == 5
+            request["trustmap"] = str(tmp_path / "other.json")
+            response = send_request(socket_path, request, 5)
+            assert response["code"] == 1
+            assert "not served" in response["messages"][0]
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        assert list(server.verifiers) == [trustmap_path]
+        assert os.path.exists(live_cache)
+        assert not os.path.exists(str(tmp_path / "other.db"))
+
+    def test_integration_verify_service_checks(self, tmp_path):
+        """Test that the service refuses requests for other checks than its own."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        socket_path = str(tmp_path / "verify.sock")
+        server = VerifyServer(socket_path, [trustmap_path])
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            request = {"called": "00-00-00-00-00-01:SSID1", "calling": identity_name,
+                       "cert_pem": self.get_file_contents(private_cert_path),
+                       "checks": {"live_verify": False, "require_registry": False, "ns_override": None}}
+            assert send_request(socket_path, request, 5)["code"] == 0
+            # Stricter than the service, which would pass what these fail.
+            for checks in [{"live_verify": True}, {"require_registry": True}, {"ns_override": "127.0.0.1"}]:
+                response = send_request(socket_path, dict(request, checks=checks), 5)
+                assert "code" not in response
+                assert "are not the service's" in response["refused"]
+            del request["checks"]
+            assert send_request(socket_path, request, 5)["code"] == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_integration_verify_client_checks(self, tmp_path, capsys):
+        """Test that the client verifies stricter checks than the service's in-process."""
+        trustmap_path = self.write_trust_map(tmp_path)
+        socket_path = str(tmp_path / "verify.sock")
+        server = VerifyServer(socket_path, [trustmap_path])
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        identity = Mock(dane_credentials=[{"tlsa_parsed": {"ttl": 120}}])
+        identity.validate_certificate.return_value = (False, "Revoked")
+        argv = ["pkix_cd_verify_client", "--called", "00-00-00-00-00-01:SSID1", "--calling", identity_name,
+                "--certfile", private_cert_path, "--trustmap", trustmap_path, "--socket", socket_path]
+        try:
+            with patch("dane_discovery.identity.Identity", return_value=identity):
+                with patch("sys.argv", argv), pytest.raises(SystemExit) as exited:
+                    pkix_cd_verify_client.main()
+                assert exited.value.code == 0
+                assert "refused" not in capsys.readouterr().out
+                with patch("sys.argv", argv + ["--live-verify"]), pytest.raises(SystemExit) as exited:
+                    pkix_cd_verify_client.main()
+                assert exited.value.code == 5
+                assert "Verify service refused" in capsys.readouterr().out
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_integration_rlm_python_authorize(self, tmp_path):
+        """Test the rlm_python3 module's return codes."""
+        config = {"trustmap": self.write_trust_map(tmp_path)}
+        cert_pem = self.get_file_contents(private_cert_path)
+        rogue_pem = self.get_file_contents(rogue_cert_path)
+        called = ("Called-Station-Id", '"00-00-00-00-00-01:SSID1"')
+        calling = ("User-Name", '"{}"'.format(identity_name))
+        with patch.object(rlm_python, "radiusd", Mock(config=config)):
+            assert rlm_python.instantiate(None) == 0
+            request = (called, calling, ("TLS-Client-Cert", cert_pem.replace("\n", "\\n")))
+            assert rlm_python.authorize(request) == rlm_python.RLM_MODULE_OK
+            assert rlm_python.authorize((called, calling, ("TLS-Client-Cert", rogue_pem))) == \
+                rlm_python.RLM_MODULE_REJECT
+            # Certificate files aren't read: FreeRADIUS deletes them before the module runs.
+            assert rlm_python.authorize((called, calling, ("TLS-Client-Cert", '"{}"'.format(private_cert_path)))) == \
+                rlm_python.RLM_MODULE_INVALID
+            assert rlm_python.authorize((called, calling)) == rlm_python.RLM_MODULE_INVALID
+            assert len(rlm_python.verifiers) == 1
+            # Settings are read at instantiation, not per request.
+            config["trustmap"] = str(tmp_path / "nope.json")
+            assert rlm_python.authorize(request) == rlm_python.RLM_MODULE_OK
+            assert rlm_python.instantiate(None) == 0
+            assert rlm_python.authorize(request) == rlm_python.RLM_MODULE_FAIL
+            rlm_python.detach(None)
+        assert rlm_python.verifiers == {}
+        assert rlm_python.settings == {}
+
+    def get_example_config(self):
+        """Return the settings, and the module's section functions, from the example rlm_python3 config."""
+        config, functions = {}, {}
+        with open("tests/configs/freeradius/python3") as f_p:
+            for line in f_p:
+                match = re.match(r'^\s*func_(\w+) = (\w+)$', line)
+                if match:
+                    functions[match.group(1)] = match.group(2)
+                match = re.match(r'^\s*(\w+) = "(.*)"$', line)
+                if match:
+                    config[match.group(1)] = match.group(2)
+        return config, functions
+
+    def test_integration_rlm_python_example_config(self, tmp_path):
+        """Test that the example config authorizes once per request, from the request's certificate."""
+        config, functions = self.get_example_config()
+        assert functions == {"instantiate": "instantiate", "authorize": "authorize", "detach": "detach"}
+        config["trustmap"] = self.write_trust_map(tmp_path)
+        called = ("Called-Station-Id", '"00-00-00-00-00-01:SSID1"')
+        calling = ("User-Name", '"{}"'.format(identity_name))
+        cert_pem = self.get_file_contents(private_cert_path)
+        request = (called, calling, (config["certificate_attribute"], cert_pem))
+        with patch.object(rlm_python, "radiusd", Mock(config=config)):
+            assert rlm_python.instantiate(None) == 0
+            assert rlm_python.authorize(request) == rlm_python.RLM_MODULE_OK
+            assert rlm_python.authorize(request) == rlm_python.RLM_MODULE_OK
+            assert os.listdir(str(tmp_path)) == ["trust_map.json"]
+            rlm_python.detach(None)
+